@@ -0,0 +1,488 @@
+"""各脚本热点路径的基准测试
+
+每个用例按若干规模生成确定性语料（见 corpus.py），在子进程中运行对应的
+脚本，记录耗时、吞吐量和峰值内存（RSS）。结果可以写入 JSON，并与之前保存
+的基线比较，耗时或内存超过阈值的用例标记为退化，退出码为 1。
+
+    $ python benchmarks/bench.py -o baseline.json
+    $ python benchmarks/bench.py -k recode -k mypdf --baseline baseline.json
+
+语料在同一次运行中按 (种类, 规模) 复用；会修改输入的命令每次运行前先复制
+一份。各脚本都以 --no-cache 运行，缓存目录也指向临时目录，测到的是冷启动
+时的性能。
+"""
+
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, NamedTuple, Optional
+
+import click
+
+import corpus
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 各类语料在 1 倍规模时的条目数
+BASE_SIZES = {"text": 200, "pair": 20_000, "pdf": 40, "frames": 30}
+
+UNITS = {"text": "files", "pair": "lines", "pdf": "pages", "frames": "frames"}
+
+
+def make_corpus(kind: str, path: str, n: int) -> tuple[int, int]:
+    """在 path 下生成 n 个条目的语料，返回 (总字节数, 条目数)"""
+    os.makedirs(path)
+    if kind == "text":
+        return corpus.text_tree(path, n)
+    if kind == "pair":
+        return corpus.text_pair(
+            os.path.join(path, "a.txt"), os.path.join(path, "b.txt"), n
+        )
+    if kind == "pdf":
+        return corpus.pdf(os.path.join(path, "input.pdf"), n)
+    if kind == "frames":
+        return corpus.frames(path, n)
+    raise ValueError(kind)
+
+
+def _copy(src: str, work: str) -> str:
+    dst = os.path.join(work, "input")
+    shutil.copytree(src, dst)
+    return dst
+
+
+def _modified_copy(src: str, work: str) -> str:
+    """复制一份语料，修改、删除和移动其中少量文件"""
+    dst = _copy(src, work)
+    paths = sorted(
+        os.path.join(dir_path, name)
+        for dir_path, _, names in os.walk(dst)
+        for name in names
+    )
+    for i, path in enumerate(paths):
+        if i % 50 == 1:
+            with open(path, "ab") as f:
+                f.write(b"changed\n")
+        elif i % 97 == 2:
+            os.remove(path)
+        elif i % 89 == 3:
+            os.replace(path, path + ".moved")
+    return dst
+
+
+class Case(NamedTuple):
+    name: str
+    # 语料种类，见 BASE_SIZES
+    corpus: str
+    # (语料路径, 工作目录) -> 脚本及其参数；每次运行前调用，可以准备输入
+    argv: Callable[[str, str], list[str]]
+    # 是否支持 -j
+    jobs: bool = True
+    # 视为成功的退出码
+    ok: tuple[int, ...] = (0,)
+
+
+def _pdf(path: str) -> str:
+    return os.path.join(path, "input.pdf")
+
+
+CASES = (
+    Case(
+        "recode-stats",
+        "text",
+        lambda src, work: ["recode.py", "-r", src, "--full-scan", "--no-cache"],
+    ),
+    Case(
+        "recode-convert",
+        "text",
+        lambda src, work: [
+            "recode.py",
+            "-r",
+            _copy(src, work),
+            "-t",
+            "UTF-8",
+            "-n",
+            "LF",
+            "--no-cache",
+        ],
+    ),
+    Case(
+        "find_content-search",
+        "text",
+        lambda src, work: ["find_content.py", corpus.NEEDLE, src, "--no-cache"],
+    ),
+    Case(
+        "find_content-index",
+        "text",
+        lambda src, work: [
+            "find_content.py",
+            "index",
+            "build",
+            src,
+            "-i",
+            os.path.join(work, "index.sqlite3"),
+        ],
+    ),
+    Case(
+        "count_code_lines",
+        "text",
+        lambda src, work: ["count_code_lines.py", src, "--no-cache"],
+    ),
+    Case(
+        "line_compare",
+        "pair",
+        lambda src, work: [
+            "line_compare.py",
+            os.path.join(src, "a.txt"),
+            os.path.join(src, "b.txt"),
+            "--no-cache",
+        ],
+        jobs=False,
+        ok=(0, 1),
+    ),
+    Case(
+        "compare_folder-diff",
+        "text",
+        lambda src, work: [
+            "compare_folder.py",
+            "diff",
+            src,
+            _modified_copy(src, work),
+            "--no-cache",
+        ],
+        ok=(0, 1),
+    ),
+    Case(
+        "compare_folder-dupes",
+        "text",
+        lambda src, work: ["compare_folder.py", "dupes", src, "--no-cache"],
+    ),
+    Case(
+        "mypdf-split",
+        "pdf",
+        lambda src, work: [
+            "mypdf.py",
+            "split",
+            _pdf(src),
+            "-a",
+            "-o",
+            os.path.join(work, "out"),
+        ],
+    ),
+    Case(
+        "mypdf-split-prune",
+        "pdf",
+        lambda src, work: [
+            "mypdf.py",
+            "split",
+            _pdf(src),
+            "-a",
+            "-p",
+            "-o",
+            os.path.join(work, "out"),
+        ],
+    ),
+    Case(
+        "mypdf-merge",
+        "pdf",
+        lambda src, work: [
+            "mypdf.py",
+            "merge",
+            _pdf(src),
+            _pdf(src),
+            "-o",
+            os.path.join(work, "out.pdf"),
+        ],
+        jobs=False,
+    ),
+    Case(
+        "mypdf-merge-low-memory",
+        "pdf",
+        lambda src, work: [
+            "mypdf.py",
+            "merge",
+            _pdf(src),
+            _pdf(src),
+            "-l",
+            "-o",
+            os.path.join(work, "out.pdf"),
+        ],
+        jobs=False,
+    ),
+    Case(
+        "mypdf-extract-images",
+        "pdf",
+        lambda src, work: [
+            "mypdf.py",
+            "extract-images",
+            _pdf(src),
+            "-o",
+            os.path.join(work, "out"),
+        ],
+    ),
+    Case(
+        "mypdf-nup",
+        "pdf",
+        lambda src, work: [
+            "mypdf.py",
+            "nup",
+            _pdf(src),
+            "-g",
+            "2x2",
+            "-o",
+            os.path.join(work, "out.pdf"),
+        ],
+    ),
+    Case(
+        "make_gif",
+        "frames",
+        lambda src, work: ["make_gif.py", src, os.path.join(work, "out.gif")],
+    ),
+    Case(
+        "make_gif-global-palette",
+        "frames",
+        lambda src, work: [
+            "make_gif.py",
+            src,
+            os.path.join(work, "out.gif"),
+            "--global-palette",
+        ],
+    ),
+)
+
+
+class Measurement(NamedTuple):
+    seconds: float
+    # 峰值 RSS（KiB），没有 resource 模块的平台上为 None
+    peak_rss: Optional[int]
+
+
+# 由一个很小的中间进程启动脚本并统计 RUSAGE_CHILDREN：Linux 上子进程的
+# ru_maxrss 从 fork 时父进程的 RSS 算起，直接从本进程启动会把已载入的
+# numpy、PIL 也算进去
+_WRAPPER = """
+import subprocess, sys, time
+start = time.perf_counter()
+code = subprocess.call(sys.argv[1:], stdout=subprocess.DEVNULL)
+seconds = time.perf_counter() - start
+try:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if sys.platform == "darwin":
+        rss //= 1024
+except ImportError:
+    rss = -1
+print(code, seconds, rss)
+"""
+
+
+def measure(argv: list[str], env: dict, ok: tuple[int, ...]) -> Measurement:
+    """运行一次脚本，返回耗时和峰值 RSS"""
+    script = os.path.join(ROOT, argv[0])
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.run(
+            [sys.executable, "-c", _WRAPPER, sys.executable, script, *argv[1:]],
+            stdout=subprocess.PIPE,
+            stderr=stderr,
+            env=env,
+            check=True,
+        )
+        code, seconds, rss = proc.stdout.split()
+        if int(code) not in ok:
+            stderr.seek(0)
+            message = stderr.read().decode(errors="replace")
+            raise click.ClickException(
+                f"{' '.join(argv)} exited with {code.decode()}\n{message}"
+            )
+    return Measurement(float(seconds), int(rss) if int(rss) >= 0 else None)
+
+
+def run_case(
+    case: Case,
+    src: str,
+    tmp: str,
+    repeat: int,
+    jobs: int,
+    env: dict,
+) -> Measurement:
+    """运行 repeat 次，取最短耗时和最大峰值内存"""
+    runs = []
+    for _ in range(repeat):
+        work = tempfile.mkdtemp(dir=tmp)
+        try:
+            argv = case.argv(src, work)
+            if case.jobs:
+                argv += ["-j", str(jobs)]
+            runs.append(measure(argv, env, case.ok))
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+    rss = [m.peak_rss for m in runs if m.peak_rss is not None]
+    return Measurement(min(m.seconds for m in runs), max(rss) if rss else None)
+
+
+def compare(result: dict, baseline: dict, threshold: float) -> tuple[str, bool]:
+    """和基线中的同一项比较，返回 (说明, 是否退化)"""
+    base = baseline.get((result["case"], result["scale"]))
+    if base is None:
+        return "", False
+    notes = []
+    regressed = False
+    for key, label in (("seconds", "time"), ("peak_rss_kib", "rss")):
+        if not result[key] or not base.get(key):
+            continue
+        change = result[key] / base[key] - 1
+        notes.append(f"{label} {change:+.0%}")
+        regressed |= change > threshold
+    return ", ".join(notes), regressed
+
+
+@click.command()
+@click.option(
+    "-k",
+    "--case",
+    "patterns",
+    help="Only run cases whose name contains this string. Can be repeated.",
+    multiple=True,
+)
+@click.option(
+    "-s",
+    "--scale",
+    "scales",
+    help="Corpus size as a multiple of the base size. Default: 1, 4, 16.",
+    type=click.IntRange(min=1),
+    multiple=True,
+    default=(1, 4, 16),
+)
+@click.option(
+    "-r",
+    "--repeat",
+    help="Runs per case and size; the fastest is kept. Default: 3.",
+    type=click.IntRange(min=1),
+    default=3,
+)
+@click.option(
+    "-j",
+    "--jobs",
+    help="Passed to scripts that support -j. Default: 1.",
+    type=click.IntRange(min=0),
+    default=1,
+)
+@click.option(
+    "-o",
+    "--output",
+    help="Write the results as JSON to this file.",
+    type=click.Path(dir_okay=False),
+)
+@click.option(
+    "-b",
+    "--baseline",
+    help="Compare with results saved earlier by --output.",
+    type=click.Path(exists=True, dir_okay=False),
+)
+@click.option(
+    "--threshold",
+    help="Slowdown or memory growth counted as a regression, in percent. "
+    "Default: 10.",
+    type=click.FloatRange(min=0),
+    default=10,
+)
+@click.option("--list", "list_cases", help="List the cases and exit.", is_flag=True)
+def main(
+    patterns: tuple[str],
+    scales: tuple[int],
+    repeat: int,
+    jobs: int,
+    output: Optional[str],
+    baseline: Optional[str],
+    threshold: float,
+    list_cases: bool,
+):
+    """按不同规模运行各脚本的基准测试，输出耗时、吞吐量和峰值内存"""
+
+    cases = [c for c in CASES if not patterns or any(p in c.name for p in patterns)]
+    if list_cases:
+        for case in cases:
+            click.echo(case.name)
+        return
+
+    base = {}
+    if baseline:
+        with open(baseline, encoding="utf-8") as f:
+            base = {(r["case"], r["scale"]): r for r in json.load(f)["results"]}
+
+    results = []
+    regressions = 0
+    click.echo(
+        f"{'case':<26}{'scale':>6}{'items':>8}{'seconds':>10}"
+        f"{'MB/s':>9}{'items/s':>10}{'RSS MB':>9}"
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, MYCMD_CACHE_DIR=os.path.join(tmp, "cache"))
+        corpora = {}
+        for scale in sorted(set(scales)):
+            for case in cases:
+                key = case.corpus, scale
+                if key not in corpora:
+                    path = os.path.join(tmp, f"{case.corpus}-{scale}")
+                    n = BASE_SIZES[case.corpus] * scale
+                    corpora[key] = path, *make_corpus(case.corpus, path, n)
+                src, size, items = corpora[key]
+
+                m = run_case(case, src, tmp, repeat, jobs, env)
+                result = {
+                    "case": case.name,
+                    "scale": scale,
+                    "items": items,
+                    "unit": UNITS[case.corpus],
+                    "input_bytes": size,
+                    "seconds": round(m.seconds, 4),
+                    "mb_per_second": round(size / m.seconds / 1e6, 3),
+                    "items_per_second": round(items / m.seconds, 2),
+                    "peak_rss_kib": m.peak_rss,
+                }
+                results.append(result)
+
+                rss = f"{m.peak_rss / 1024:.1f}" if m.peak_rss else "-"
+                line = (
+                    f"{case.name:<26}{scale:>6}{items:>8}{m.seconds:>10.3f}"
+                    f"{result['mb_per_second']:>9.2f}"
+                    f"{result['items_per_second']:>10.1f}{rss:>9}"
+                )
+                note, regressed = compare(result, base, threshold / 100)
+                if note:
+                    line += f"  {note}"
+                if regressed:
+                    regressions += 1
+                    click.secho(line + "  REGRESSED", fg="red")
+                else:
+                    click.echo(line)
+
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "cpus": os.cpu_count(),
+                    "jobs": jobs,
+                    "repeat": repeat,
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+    if baseline:
+        click.echo(f"found {regressions} regression(s)", err=True)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
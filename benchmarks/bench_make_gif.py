@@ -0,0 +1,58 @@
+"""比较 make_gif 逐帧量化与 --global-palette 两种编码方式的耗时和文件大小
+
+输入是合成的“屏幕录像”：固定的窗口和文字背景上，每帧只有光标移动、
+新增几个字符，以及偶尔滚动一次。
+
+    $ python benchmarks/bench_make_gif.py --frames 200
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+from corpus import frames as make_frames
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(args: list[str]) -> float:
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, os.path.join(ROOT, "make_gif.py"), *args],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - start
+
+
+@click.command()
+@click.option("--frames", type=click.IntRange(min=2), default=120)
+@click.option("--width", type=click.IntRange(min=64), default=800)
+@click.option("--height", type=click.IntRange(min=64), default=500)
+@click.option("-j", "--jobs", type=click.IntRange(min=0), default=0)
+def main(frames: int, width: int, height: int, jobs: int):
+    """生成合成屏幕录像，分别用两种方式编码并输出耗时和文件大小"""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        indir = os.path.join(tmp, "frames")
+        os.mkdir(indir)
+        make_frames(indir, frames, (width, height))
+
+        click.echo(f"{frames} frames of {width}x{height}")
+        click.echo(f"{'mode':<16}{'seconds':>10}{'bytes':>14}")
+        for mode, extra in (
+            ("per-frame", []),
+            ("global-palette", ["--global-palette"]),
+        ):
+            out = os.path.join(tmp, f"{mode}.gif")
+            seconds = run([indir, out, "-j", str(jobs), *extra])
+            click.echo(f"{mode:<16}{seconds:>10.2f}{os.path.getsize(out):>14,}")
+
+
+if __name__ == "__main__":
+    main()
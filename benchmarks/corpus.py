@@ -0,0 +1,274 @@
+"""生成基准测试用的确定性语料
+
+同样的参数和 seed 总是生成完全相同的文件：
+
+- text_tree：GB2312、BIG5、UTF-8、UTF-8-SIG 混合编码，LF、CRLF、CR 以及
+  混合行尾的源码树，部分文件含有 NEEDLE
+- text_pair：一对大文本文件，第二个在第一个的基础上随机改动少量行
+- pdf：多页 PDF，每页有文字和图片，部分图片在各页之间共享
+- frames：合成的屏幕录像帧序列
+
+各函数返回 (总字节数, 条目数)，条目分别是文件、行、页和帧。
+"""
+
+import io
+import os
+import random
+
+import numpy as np
+from PIL import Image
+
+NEEDLE = "benchmark_needle"
+
+# 简体和繁体常用字，生成时只保留目标编码能表示的字
+_HANZI = (
+    "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发"
+    "年动同工也能下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如"
+    "水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然"
+    "這為個國時來們於對會發動過說產種後學經進著部電裡現實兩體機當點從業應開還義"
+)
+
+ENCODINGS = ("UTF-8", "UTF-8-SIG", "GB2312", "BIG5")
+_ENCODING_WEIGHTS = (4, 1, 3, 2)
+NEWLINES = ("\n", "\r\n", "\r", None)
+_NEWLINE_WEIGHTS = (5, 4, 1, 1)
+
+# 扩展名和对应的行注释
+_LANGUAGES = (
+    (".py", "# "),
+    (".c", "// "),
+    (".cpp", "// "),
+    (".java", "// "),
+    (".js", "// "),
+    (".txt", ""),
+)
+
+_pools: dict[str, str] = {}
+
+
+def _pool(encoding: str) -> str:
+    pool = _pools.get(encoding)
+    if pool is None:
+        chars = []
+        for ch in dict.fromkeys(_HANZI):
+            try:
+                ch.encode(encoding)
+            except UnicodeEncodeError:
+                continue
+            chars.append(ch)
+        pool = _pools[encoding] = "".join(chars)
+    return pool
+
+
+def _sentence(rng: random.Random, pool: str) -> str:
+    return "".join(rng.choices(pool, k=rng.randint(4, 24)))
+
+
+def _source_lines(rng: random.Random, comment: str, pool: str, count: int):
+    """生成类似源码的行：代码、中文注释、空行和字符串
+
+    中文行占一半左右：chardet 对以 ASCII 为主的 GB2312、BIG5 文件给出的
+    置信度很低，会被 recode 当作无法识别的编码跳过。
+    """
+    for i in range(count):
+        kind = rng.random()
+        if kind < 0.05:
+            yield ""
+        elif kind < 0.5:
+            yield comment + "".join(rng.choices(pool, k=rng.randint(8, 32)))
+        elif kind < 0.6:
+            yield f'    message_{i} = "{_sentence(rng, pool)}"'
+        else:
+            depth = " " * 4 * rng.randint(0, 3)
+            yield f"{depth}value_{i} = compute(value_{i - 1}, {rng.randint(0, 999)})"
+
+
+def text_tree(
+    root: str, files: int, seed: int = 0, lines: tuple[int, int] = (20, 400)
+) -> tuple[int, int]:
+    """在 root 下生成 files 个文本文件，每个目录最多 32 个文件"""
+    rng = random.Random(seed)
+    total = 0
+    for i in range(files):
+        encoding = rng.choices(ENCODINGS, _ENCODING_WEIGHTS)[0]
+        newline = rng.choices(NEWLINES, _NEWLINE_WEIGHTS)[0]
+        ext, comment = rng.choice(_LANGUAGES)
+
+        text = list(_source_lines(rng, comment, _pool(encoding), rng.randint(*lines)))
+        if rng.random() < 0.05:
+            text.insert(rng.randrange(len(text)), f"{comment}{NEEDLE}")
+        if newline is None:
+            data = "".join(line + rng.choice(NEWLINES[:3]) for line in text)
+        else:
+            data = newline.join(text) + newline
+
+        dir_path = os.path.join(root, f"d{i // 256:03d}", f"d{i // 32 % 8}")
+        os.makedirs(dir_path, exist_ok=True)
+        path = os.path.join(dir_path, f"f{i}{ext}")
+        with open(path, "wb") as f:
+            total += f.write(data.encode(encoding))
+    return total, files
+
+
+def text_pair(
+    path1: str, path2: str, lines: int, seed: int = 0, edit_rate: float = 0.01
+) -> tuple[int, int]:
+    """生成 lines 行的 path1，以及按 edit_rate 替换、插入、删除行后的 path2"""
+    rng = random.Random(seed)
+    pool = _pool("UTF-8")
+    a = list(_source_lines(rng, "# ", pool, lines))
+    b = []
+    for line in a:
+        r = rng.random()
+        if r < edit_rate / 3:
+            b.append(_sentence(rng, pool))
+        elif r < edit_rate * 2 / 3:
+            b.append(line)
+            b.append(_sentence(rng, pool))
+        elif r >= edit_rate:
+            b.append(line)
+
+    total = 0
+    for path, text in ((path1, a), (path2, b)):
+        with open(path, "w", encoding="UTF-8", newline="\n") as f:
+            total += f.write("\n".join(text) + "\n")
+    return total, lines
+
+
+def _jpeg(rng: np.random.Generator, size: tuple[int, int]) -> bytes:
+    """渐变加噪声的图片，尽量接近照片的压缩率"""
+    width, height = size
+    image = np.empty((height, width, 3), np.float32)
+    image[:] = rng.uniform(0, 255, 3)
+    image += np.linspace(0, rng.uniform(-120, 120), width)[None, :, None]
+    image += rng.normal(0, 24, image.shape)
+    buf = io.BytesIO()
+    Image.fromarray(np.clip(image, 0, 255).astype(np.uint8)).save(
+        buf, "JPEG", quality=85
+    )
+    return buf.getvalue()
+
+
+def _image_xobject(writer, data: bytes, size: tuple[int, int]):
+    from pypdf.generic import DecodedStreamObject, NameObject, NumberObject
+
+    stream = DecodedStreamObject()
+    stream.set_data(data)
+    stream.update(
+        {
+            NameObject("/Type"): NameObject("/XObject"),
+            NameObject("/Subtype"): NameObject("/Image"),
+            NameObject("/Width"): NumberObject(size[0]),
+            NameObject("/Height"): NumberObject(size[1]),
+            NameObject("/ColorSpace"): NameObject("/DeviceRGB"),
+            NameObject("/BitsPerComponent"): NumberObject(8),
+            NameObject("/Filter"): NameObject("/DCTDecode"),
+        }
+    )
+    return writer._add_object(stream)
+
+
+def pdf(path: str, pages: int, seed: int = 0, shared: int = 8) -> tuple[int, int]:
+    """生成 pages 页的 A4 PDF
+
+    每页有几十行文字、一张共享图片和一张独有图片；所有共享图片都挂在每一页
+    的资源字典里，和一些工具生成的文件一样带有大量未用到的资源。
+    """
+    from pypdf import PdfWriter
+    from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+    rng = np.random.default_rng(seed)
+    words = random.Random(seed)
+    writer = PdfWriter()
+
+    font = writer._add_object(
+        DictionaryObject(
+            {
+                NameObject("/Type"): NameObject("/Font"),
+                NameObject("/Subtype"): NameObject("/Type1"),
+                NameObject("/BaseFont"): NameObject("/Helvetica"),
+            }
+        )
+    )
+    logos = {
+        NameObject(f"/S{i}"): _image_xobject(writer, _jpeg(rng, (320, 240)), (320, 240))
+        for i in range(shared)
+    }
+
+    for i in range(pages):
+        page = writer.add_blank_page(595, 842)
+        photo = _image_xobject(writer, _jpeg(rng, (240, 180)), (240, 180))
+        xobjects = DictionaryObject(logos)
+        xobjects[NameObject("/P")] = photo
+        page[NameObject("/Resources")] = DictionaryObject(
+            {
+                NameObject("/Font"): DictionaryObject({NameObject("/F1"): font}),
+                NameObject("/XObject"): xobjects,
+            }
+        )
+
+        ops = ["BT /F1 10 Tf 12 TL 50 790 Td"]
+        for _ in range(40):
+            line = " ".join(
+                words.choice(("lorem", "ipsum", "dolor", "sit", "amet", "page"))
+                for _ in range(12)
+            )
+            ops.append(f"({line} {i + 1}) '")
+        ops.append("ET")
+        ops.append(f"q 160 0 0 120 50 60 cm /S{i % shared} Do Q")
+        ops.append("q 160 0 0 120 300 60 cm /P Do Q")
+        content = DecodedStreamObject()
+        content.set_data("\n".join(ops).encode("latin-1"))
+        page[NameObject("/Contents")] = writer._add_object(content)
+
+    with open(path, "wb") as f:
+        writer.write(f)
+    return os.path.getsize(path), pages
+
+
+def frames(
+    outdir: str, count: int, size: tuple[int, int] = (800, 500), seed: int = 0
+) -> tuple[int, int]:
+    """生成 count 张合成的屏幕截图
+
+    固定的窗口和文字背景上，每帧只有光标移动、新增几个字符，以及偶尔滚动
+    一次。
+    """
+    rng = np.random.default_rng(seed)
+    width, height = size
+    screen = np.empty((height, width, 3), np.uint8)
+    # 渐变的桌面背景和一个带标题栏的窗口
+    screen[:] = np.linspace(40, 120, width, dtype=np.uint8)[None, :, None]
+    screen[..., 2] = 160
+    top, left = height // 10, width // 10
+    bottom, right = height - top, width - left
+    screen[top:bottom, left:right] = 250
+    screen[top : top + 24, left:right] = (60, 90, 160)
+
+    # 文字用随机颜色深浅的小块表示，逐帧出现
+    line_h, char_w = 16, 8
+    x, y = left + 8, top + 32
+    total = 0
+    for i in range(count):
+        for _ in range(rng.integers(1, 4)):
+            if x + char_w > right - 8:
+                x, y = left + 8, y + line_h
+            if y + line_h > bottom - 8:
+                # 滚动一行
+                screen[top + 32 : bottom - 8 - line_h, left:right] = screen[
+                    top + 32 + line_h : bottom - 8, left:right
+                ]
+                screen[bottom - 8 - line_h : bottom - 8, left:right] = 250
+                y -= line_h
+            shade = rng.integers(0, 80)
+            glyph = rng.random((line_h - 4, char_w - 2)) < 0.4
+            block = screen[y + 2 : y + line_h - 2, x + 1 : x + char_w - 1]
+            block[glyph] = (shade, shade, shade)
+            x += char_w
+        frame = screen.copy()
+        # 光标
+        frame[y + 2 : y + line_h - 2, x : x + 2] = 0
+        path = os.path.join(outdir, f"frame{i}.png")
+        Image.fromarray(frame).save(path)
+        total += os.path.getsize(path)
+    return total, count
@@ -0,0 +1,22 @@
+"""各脚本共用的 click 命令组"""
+
+import click
+
+
+class DefaultGroup(click.Group):
+    """第一个参数不是子命令时按 default 子命令处理
+
+    脚本改为子命令结构后，原来不带子命令的用法保持不变。要处理的参数与子
+    命令同名时，写在 -- 之后，或显式给出默认的子命令。
+
+        @click.group(cls=DefaultGroup, default="search")
+    """
+
+    def __init__(self, *args, default: str, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.default = default
+
+    def parse_args(self, ctx, args):
+        if args and args[0] not in self.commands and args[0] != "--help":
+            args = [self.default, *args]
+        return super().parse_args(ctx, args)
@@ -4,5 +4,848 @@
 # 文件（同名、同内容）
 # 文件夹（同名、同内容）
 # 文件系统结构
-# 
+#
 # 可选是否递归深入比较、是否只比较文件、只比较子文件夹
+#
+# 实现：
+# 先只用 scandir 读取两边的元数据，大小不同的文件直接判为修改，只有大小
+# 相同的同名文件、以及可能是移动的新增/删除文件才读取内容计算哈希。每个
+# 目录都有由子项元数据组成的 Merkle 摘要，信任修改时间时摘要相同的子树
+# 整个跳过。
+#
+# snapshot 把一棵树的元数据、文件哈希和目录摘要保存为 SQLite 文件，比较时
+# 任意一侧都可以是快照，两侧内容摘要相同的子树直接跳过。
+#
+# dupes 查找重复文件：先按大小分组，再比较首尾块的哈希，最后才计算完整
+# 哈希，每一步都只处理上一步中仍有重复的文件。
+
+import hashlib
+import json
+import mmap
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from collections import Counter
+from contextlib import closing
+from typing import Iterator, NamedTuple, Optional, Union
+
+import click
+
+from clickgroup import DefaultGroup
+from filecache import open_cache
+from parallel import imap_bounded, resolve_jobs
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+CHUNK_SIZE = 1 << 20
+
+# 装有 xxhash 时使用更快的 XXH3，否则使用标准库的 BLAKE2
+if xxhash is not None:
+    HASH_NAME = "xxh3_128"
+    _new_hash = xxhash.xxh3_128
+else:
+    HASH_NAME = "blake2b"
+    _new_hash = partial(hashlib.blake2b, digest_size=16)
+
+_CACHE_KIND = f"file-hash-{HASH_NAME}-1"
+
+# 查找重复文件时先比较的首尾块大小
+EDGE_SIZE = 64 << 10
+
+# 每写入多少条哈希提交一次缓存事务
+_PUT_BATCH = 256
+
+_local = threading.local()
+
+
+def _buffer() -> bytearray:
+    buf = getattr(_local, "buffer", None)
+    if buf is None:
+        buf = _local.buffer = bytearray(CHUNK_SIZE)
+    return buf
+
+
+def hash_file(path: str) -> bytes:
+    """分块计算文件内容的哈希"""
+    h = _new_hash()
+    buf = _buffer()
+    view = memoryview(buf)
+    with open(path, "rb", buffering=0) as f:
+        while n := f.readinto(buf):
+            h.update(view[:n])
+    return h.digest()
+
+
+class SnapshotStat(NamedTuple):
+    """快照中记录的元数据，与 os.stat_result 的同名字段对应"""
+
+    st_size: int
+    st_mtime_ns: int
+    st_ino: int = 0
+
+
+def hash_edges(path: str) -> bytes:
+    """计算文件首尾各 EDGE_SIZE 字节的哈希，不超过两块的文件即为完整哈希"""
+    h = _new_hash()
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size <= 2 * EDGE_SIZE:
+            h.update(f.read())
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                h.update(mm[:EDGE_SIZE])
+                h.update(mm[-EDGE_SIZE:])
+    return h.digest()
+
+
+class File:
+    __slots__ = ("path", "st", "digest")
+
+    def __init__(
+        self,
+        path: Optional[str],
+        st: Union[os.stat_result, SnapshotStat],
+        digest: Optional[bytes] = None,
+    ):
+        # 来自快照的文件没有可以读取的路径
+        self.path = path
+        self.st = st
+        # 内容哈希，需要时才计算
+        self.digest = digest
+
+    @property
+    def size(self) -> int:
+        return self.st.st_size
+
+    @property
+    def mtime(self) -> int:
+        return self.st.st_mtime_ns
+
+
+class Dir:
+    __slots__ = ("path", "children", "meta", "digest")
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.children: dict[str, Union[File, Dir]] = {}
+        # 由子项名字、大小和修改时间组成的 Merkle 摘要
+        self.meta: Optional[bytes] = None
+        # 由子项名字和内容哈希组成的 Merkle 摘要，所有文件都有哈希时才可计算
+        self.digest: Optional[bytes] = None
+
+
+Node = Union[File, Dir]
+
+
+def merkle(items: Iterator[tuple[str, bytes, bytes]]) -> bytes:
+    """把 (名字, 类型, 摘要) 按名字排序后合并为目录摘要"""
+    h = hashlib.blake2b(digest_size=16)
+    for name, kind, digest in sorted(items):
+        h.update(os.fsencode(name) + b"\0" + kind)
+        h.update(digest)
+    return h.digest()
+
+
+def _meta(file: File) -> bytes:
+    return file.size.to_bytes(8, "little") + file.mtime.to_bytes(
+        8, "little", signed=True
+    )
+
+
+def scan(root: str, recursive: bool = True, errors: Optional[list] = None) -> Dir:
+    """读取 root 下的目录结构和文件元数据，不读取文件内容
+
+    不进入指向目录的符号链接，符号链接和特殊文件不参与比较。
+    recursive 为假时子目录只记录名字。
+    """
+    node = Dir(root)
+    try:
+        with os.scandir(root) as it:
+            entries = list(it)
+    except OSError as e:
+        entries = []
+        if errors is not None:
+            errors.append((root, type(e).__name__))
+
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                if recursive:
+                    node.children[entry.name] = scan(entry.path, True, errors)
+                else:
+                    node.children[entry.name] = Dir(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                st = entry.stat(follow_symlinks=False)
+                node.children[entry.name] = File(entry.path, st)
+        except OSError as e:
+            if errors is not None:
+                errors.append((entry.path, type(e).__name__))
+
+    if recursive:
+        node.meta = merkle(
+            (
+                (name, b"d", child.meta)
+                if isinstance(child, Dir)
+                # 文件的元数据摘要即大小和修改时间
+                else (name, b"f", _meta(child))
+            )
+            for name, child in node.children.items()
+        )
+    return node
+
+
+def iter_files(node: Dir, prefix: str) -> Iterator[tuple[str, File]]:
+    """产出目录下所有文件的 (相对路径, File)"""
+    for name, child in node.children.items():
+        if isinstance(child, Dir):
+            yield from iter_files(child, f"{prefix}{name}/")
+        else:
+            yield prefix + name, child
+
+
+def content_digest(node: Dir) -> Optional[bytes]:
+    """计算目录的内容摘要，有文件尚未计算哈希时返回 None"""
+    if node.digest is None:
+        items = []
+        for name, child in node.children.items():
+            if isinstance(child, Dir):
+                digest = content_digest(child)
+                kind = b"d"
+            else:
+                digest = child.digest
+                kind = b"f"
+            if digest is None:
+                return None
+            items.append((name, kind, digest))
+        node.digest = merkle(items)
+    return node.digest
+
+
+def _hash_entry(file: File) -> Union[bytes, OSError]:
+    try:
+        return hash_file(file.path)
+    except OSError as e:
+        return e
+
+
+def fill_digests(
+    files: list[File], jobs: int = 1, use_cache: bool = True
+) -> list[tuple[str, str]]:
+    """为 files 计算内容哈希，返回出错的 (路径, 错误名)
+
+    哈希按 (路径, 大小, 修改时间, inode) 缓存；缓存在主线程中查询和写入，
+    未命中的文件交给线程池读取，hashlib 计算时会释放 GIL。
+    """
+    cache = open_cache(_CACHE_KIND) if use_cache else None
+    todo = []
+    for file in files:
+        if file.digest is not None or file.path is None:
+            continue
+        if cache is not None:
+            try:
+                value = cache.get(file.path, file.st)
+            except (OSError, sqlite3.Error):
+                value = None
+            if value is not None:
+                file.digest = bytes.fromhex(value)
+                continue
+        todo.append(file)
+
+    errors = []
+    puts = []
+
+    def flush():
+        try:
+            with cache.batch():
+                for file in puts:
+                    cache.put(file.path, file.digest.hex(), file.st)
+        except sqlite3.Error:
+            pass
+        puts.clear()
+
+    for file, result in imap_bounded(
+        _hash_entry, todo, jobs, executor=ThreadPoolExecutor
+    ):
+        if isinstance(result, OSError):
+            errors.append((file.path, type(result).__name__))
+            continue
+        file.digest = result
+        if cache is not None:
+            puts.append(file)
+            if len(puts) >= _PUT_BATCH:
+                flush()
+    if puts:
+        flush()
+    return errors
+
+
+class Report(NamedTuple):
+    # 新增、删除的目录以 / 结尾，其中的文件不再逐一列出
+    added: list[str]
+    removed: list[str]
+    modified: list[str]
+    # (原路径, 新路径)
+    moved: list[tuple[str, str]]
+    errors: list[tuple[str, str]]
+
+    @property
+    def differences(self) -> int:
+        return (
+            len(self.added) + len(self.removed) + len(self.modified) + len(self.moved)
+        )
+
+
+def compare_trees(
+    a: Dir,
+    b: Dir,
+    jobs: int = 1,
+    trust_mtime: bool = False,
+    files: bool = True,
+    dirs: bool = True,
+    recursive: bool = True,
+    use_cache: bool = True,
+) -> Report:
+    """比较两棵目录树
+
+    files 为假时只比较目录结构；dirs 为假时新增、删除的目录展开为其中的
+    文件。内容哈希只对大小相同的同名文件，以及大小与另一侧某个新增/删除
+    文件相同的文件计算，后者用于识别移动。
+    """
+    # 大小相同、需要比较内容的同名文件
+    pairs: list[tuple[str, File, File]] = []
+    modified = []
+    # 只在一侧存在的 (相对路径, 节点)
+    gone: list[tuple[str, Node]] = []
+    new: list[tuple[str, Node]] = []
+
+    def visit(da: Dir, db: Dir, prefix: str):
+        if da.digest is not None and da.digest == db.digest:
+            return
+        if trust_mtime and da.meta is not None and da.meta == db.meta:
+            return
+        for name in da.children.keys() | db.children.keys():
+            rel = prefix + name
+            x = da.children.get(name)
+            y = db.children.get(name)
+            if isinstance(x, Dir) and isinstance(y, Dir):
+                if recursive:
+                    visit(x, y, rel + "/")
+                continue
+            if isinstance(x, File) and isinstance(y, File):
+                if not files:
+                    continue
+                if x.size != y.size:
+                    modified.append(rel)
+                elif not (trust_mtime and x.mtime == y.mtime):
+                    pairs.append((rel, x, y))
+                continue
+            # 只在一侧存在，或一侧是文件另一侧是目录
+            for node, side in ((x, gone), (y, new)):
+                if node is not None and (files or isinstance(node, Dir)):
+                    side.append((rel, node))
+
+    visit(a, b, "")
+
+    # 只在一侧存在的文件中，大小在两侧都出现的可能是移动
+    gone_files, new_files = [], []
+    if files and recursive:
+        for nodes, out in ((gone, gone_files), (new, new_files)):
+            for rel, node in nodes:
+                if isinstance(node, Dir):
+                    out.extend(iter_files(node, rel + "/"))
+                else:
+                    out.append((rel, node))
+    sizes = {f.size for _, f in gone_files} & {f.size for _, f in new_files}
+    candidates = [f for _, f in gone_files + new_files if f.size in sizes]
+
+    errors = fill_digests(
+        [f for _, x, y in pairs for f in (x, y)] + candidates, jobs, use_cache
+    )
+
+    for rel, x, y in pairs:
+        if x.digest is None or x.digest != y.digest:
+            modified.append(rel)
+
+    moved = []
+    # 整个目录的移动：两侧内容摘要相同的非空目录
+    moved_dirs = set()
+    if dirs and sizes:
+        by_digest = {}
+        for rel, node in gone:
+            if isinstance(node, Dir) and node.children and content_digest(node):
+                by_digest.setdefault(node.digest, []).append(rel)
+        for rel, node in new:
+            if isinstance(node, Dir) and node.children and content_digest(node):
+                olds = by_digest.get(node.digest)
+                if olds:
+                    old = olds.pop(0)
+                    moved.append((old + "/", rel + "/"))
+                    moved_dirs.update((old + "/", rel + "/"))
+
+    def in_moved_dir(rel: str) -> bool:
+        return any(rel.startswith(d) for d in moved_dirs)
+
+    by_content = {}
+    for rel, f in gone_files:
+        if f.digest is not None and not in_moved_dir(rel):
+            by_content.setdefault((f.size, f.digest), []).append(rel)
+    moved_files = set()
+    for rel, f in new_files:
+        if f.digest is None or in_moved_dir(rel):
+            continue
+        olds = by_content.get((f.size, f.digest))
+        if olds:
+            old = olds.pop(0)
+            moved.append((old, rel))
+            moved_files.update((old, rel))
+
+    def remaining(nodes, side_files):
+        if dirs:
+            out = [rel + "/" if isinstance(node, Dir) else rel for rel, node in nodes]
+        elif recursive:
+            out = [rel for rel, _ in side_files]
+        else:
+            out = [rel for rel, node in nodes if isinstance(node, File)]
+        return sorted(p for p in out if p not in moved_dirs and p not in moved_files)
+
+    return Report(
+        added=remaining(new, new_files),
+        removed=remaining(gone, gone_files),
+        modified=sorted(modified),
+        moved=sorted(moved),
+        errors=errors,
+    )
+
+
+SNAPSHOT_VERSION = "1"
+
+
+def open_snapshot(path: str) -> sqlite3.Connection:
+    db = sqlite3.connect(path)
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+        " WITHOUT ROWID"
+    )
+    # 路径相对于快照的根目录，以 / 分隔，根目录本身为 ""
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS files ("
+        " path TEXT PRIMARY KEY,"
+        " size INTEGER NOT NULL,"
+        " mtime INTEGER NOT NULL,"
+        " digest BLOB) WITHOUT ROWID"
+    )
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS dirs ("
+        " path TEXT PRIMARY KEY,"
+        " meta BLOB,"
+        " digest BLOB) WITHOUT ROWID"
+    )
+    return db
+
+
+def _snapshot_meta(db: sqlite3.Connection) -> dict[str, str]:
+    return dict(db.execute("SELECT key, value FROM meta"))
+
+
+def load_snapshot(path: str) -> Dir:
+    """把快照文件读回为目录树，其中的文件都带有快照时的哈希"""
+    try:
+        with closing(sqlite3.connect(f"file:{path}?mode=ro", uri=True)) as db:
+            meta = _snapshot_meta(db)
+            if meta.get("version") != SNAPSHOT_VERSION:
+                raise click.ClickException(f"{path} is not a folder snapshot")
+            if meta["hash"] != HASH_NAME:
+                raise click.ClickException(
+                    f"{path} uses {meta['hash']} hashes, but {HASH_NAME} is in use"
+                )
+            dirs = {}
+            # 按路径排序，父目录总在子目录之前
+            for rel, meta_digest, digest in db.execute(
+                "SELECT path, meta, digest FROM dirs ORDER BY path"
+            ):
+                node = dirs[rel] = Dir(None)
+                node.meta = meta_digest
+                node.digest = digest
+                if rel:
+                    parent, _, name = rel.rpartition("/")
+                    dirs[parent].children[name] = node
+            for rel, size, mtime, digest in db.execute(
+                "SELECT path, size, mtime, digest FROM files"
+            ):
+                parent, _, name = rel.rpartition("/")
+                dirs[parent].children[name] = File(
+                    None, SnapshotStat(size, mtime), digest
+                )
+    except sqlite3.DatabaseError:
+        raise click.ClickException(f"{path} is not a folder snapshot")
+    return dirs[""]
+
+
+def load_tree(path: str, recursive: bool = True, errors: Optional[list] = None) -> Dir:
+    """目录直接扫描，文件按快照读取"""
+    if os.path.isdir(path):
+        return scan(path, recursive, errors)
+    return load_snapshot(path)
+
+
+def _iter_dirs(node: Dir, rel: str) -> Iterator[tuple[str, Dir]]:
+    yield rel, node
+    for name, child in node.children.items():
+        if isinstance(child, Dir):
+            yield from _iter_dirs(child, f"{rel}/{name}" if rel else name)
+
+
+def take_snapshot(
+    root: str,
+    output: str,
+    jobs: int = 1,
+    use_cache: bool = True,
+    rebuild: bool = False,
+) -> Counter:
+    """为 root 生成快照写入 output
+
+    output 已经是同一目录的快照时，大小和修改时间都没有变化的文件沿用其中
+    的哈希，只重新计算变化了的文件。新快照先写入临时文件再替换 output。
+    """
+    counter = Counter()
+    errors = []
+    tree = scan(root, True, errors)
+    files = list(iter_files(tree, ""))
+
+    if not rebuild and os.path.isfile(output):
+        try:
+            with closing(sqlite3.connect(output)) as db:
+                meta = _snapshot_meta(db)
+                if (
+                    meta.get("version") == SNAPSHOT_VERSION
+                    and meta.get("hash") == HASH_NAME
+                    and meta.get("root") == os.path.abspath(root)
+                ):
+                    old = {
+                        rel: (size, mtime, digest)
+                        for rel, size, mtime, digest in db.execute(
+                            "SELECT path, size, mtime, digest FROM files"
+                        )
+                    }
+                    for rel, file in files:
+                        size, mtime, digest = old.get(rel, (None, None, None))
+                        if (size, mtime) == (file.size, file.mtime):
+                            file.digest = digest
+        except sqlite3.DatabaseError:
+            pass
+
+    counter["unchanged"] = sum(file.digest is not None for _, file in files)
+    errors += fill_digests([file for _, file in files], jobs, use_cache)
+    counter["hashed"] = sum(file.digest is not None for _, file in files)
+    counter["hashed"] -= counter["unchanged"]
+    counter["errors"] = len(errors)
+    for path, error in errors:
+        click.echo(f"{error} {path}", err=True)
+
+    tmp = output + ".tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    with closing(open_snapshot(tmp)) as db, db:
+        db.executemany(
+            "INSERT INTO meta VALUES (?, ?)",
+            (
+                ("version", SNAPSHOT_VERSION),
+                ("hash", HASH_NAME),
+                ("root", os.path.abspath(root)),
+                ("created", str(int(time.time()))),
+            ),
+        )
+        db.executemany(
+            "INSERT INTO files VALUES (?, ?, ?, ?)",
+            ((rel, f.size, f.mtime, f.digest) for rel, f in files),
+        )
+        db.executemany(
+            "INSERT INTO dirs VALUES (?, ?, ?)",
+            (
+                (rel, node.meta, content_digest(node))
+                for rel, node in _iter_dirs(tree, "")
+            ),
+        )
+    os.replace(tmp, output)
+    counter["files"] = len(files)
+    return counter
+
+
+class DupeGroup(NamedTuple):
+    size: int
+    paths: list[str]
+
+    @property
+    def reclaimable(self) -> int:
+        return self.size * (len(self.paths) - 1)
+
+
+def _edges_entry(file: File) -> Union[bytes, OSError]:
+    try:
+        return hash_edges(file.path)
+    except OSError as e:
+        return e
+
+
+def _regroup(groups, keys, errors) -> list[list[File]]:
+    """按 keys 中对应的结果把每组再细分，只保留仍有重复的组"""
+    out = []
+    for group in groups:
+        sub = {}
+        for file in group:
+            key = keys(file)
+            if isinstance(key, OSError):
+                errors.append((file.path, type(key).__name__))
+            elif key is not None:
+                sub.setdefault(key, []).append(file)
+        out += [g for g in sub.values() if len(g) > 1]
+    return out
+
+
+def find_dupes(
+    roots: list[str], jobs: int = 1, min_size: int = 1, use_cache: bool = True
+) -> tuple[list[DupeGroup], list[tuple[str, str]]]:
+    """查找 roots 下内容相同的文件，返回 (重复文件组, 出错的文件)
+
+    同一文件的多个硬链接只计一次。
+    """
+    errors = []
+    by_size = {}
+    inodes = set()
+    for root in roots:
+        for _, file in iter_files(scan(root, True, errors), ""):
+            if file.size < min_size:
+                continue
+            inode = (file.st.st_dev, file.st.st_ino)
+            if file.st.st_ino:
+                if inode in inodes:
+                    continue
+                inodes.add(inode)
+            by_size.setdefault(file.size, []).append(file)
+    groups = [g for g in by_size.values() if len(g) > 1]
+
+    edges = dict(
+        imap_bounded(
+            _edges_entry,
+            [file for group in groups for file in group],
+            jobs,
+            executor=ThreadPoolExecutor,
+        )
+    )
+    groups = _regroup(groups, edges.get, errors)
+
+    # 首尾块已经覆盖整个文件的组不必再计算完整哈希
+    large = [file for group in groups for file in group if file.size > 2 * EDGE_SIZE]
+    errors += fill_digests(large, jobs, use_cache)
+    groups = _regroup(groups, lambda f: f.digest if f.size > 2 * EDGE_SIZE else b"", [])
+
+    dupes = [DupeGroup(g[0].size, sorted(f.path for f in g)) for g in groups]
+    dupes.sort(key=lambda g: (-g.reclaimable, g.paths))
+    return dupes, errors
+
+
+@click.group(cls=DefaultGroup, default="diff")
+def cli():
+    """比较两个文件夹下的文件差别"""
+
+
+def print_report(report: Report, as_json: bool):
+    for path, error in report.errors:
+        click.echo(f"{error} {path}", err=True)
+
+    if as_json:
+        click.echo(json.dumps(report._asdict(), ensure_ascii=False, indent=2))
+    else:
+        for path in report.added:
+            click.echo(f"A  {path}")
+        for path in report.removed:
+            click.echo(f"D  {path}")
+        for path in report.modified:
+            click.echo(f"M  {path}")
+        for old, new in report.moved:
+            click.echo(f"R  {old} -> {new}")
+    click.echo(f"found {report.differences} difference(s)", err=True)
+
+
+@cli.command()
+@click.argument("path1", type=click.Path(exists=True))
+@click.argument("path2", type=click.Path(exists=True))
+@click.option(
+    "-j",
+    "--jobs",
+    help="Number of hashing threads, 0 for all CPUs. Default: 0.",
+    type=click.IntRange(min=0),
+    default=0,
+)
+@click.option(
+    "-t",
+    "--trust-mtime",
+    help="Treat files with equal size and modification time as identical, "
+    "and skip subtrees whose metadata digests match.",
+    is_flag=True,
+)
+@click.option(
+    "--no-recursive",
+    help="Only compare the direct children of PATH1 and PATH2.",
+    is_flag=True,
+)
+@click.option(
+    "--files-only",
+    help="Only compare files, listing added or removed folders file by file.",
+    is_flag=True,
+)
+@click.option(
+    "--dirs-only",
+    help="Only compare the folder structure.",
+    is_flag=True,
+)
+@click.option(
+    "--json",
+    "as_json",
+    help="Print the report as JSON.",
+    is_flag=True,
+)
+@click.option(
+    "--no-cache",
+    help="Do not read or update the file hash cache.",
+    is_flag=True,
+)
+def diff(
+    path1: str,
+    path2: str,
+    jobs: int,
+    trust_mtime: bool,
+    no_recursive: bool,
+    files_only: bool,
+    dirs_only: bool,
+    as_json: bool,
+    no_cache: bool,
+):
+    """比较 PATH1 和 PATH2，列出新增（A）、删除（D）、修改（M）和移动（R）的项
+
+    PATH1、PATH2 可以是文件夹，也可以是 snapshot 命令生成的快照文件。
+    有差异时退出码为 1。
+    """
+    if files_only and dirs_only:
+        raise click.UsageError("--files-only and --dirs-only are exclusive")
+
+    errors = []
+    recursive = not no_recursive
+    # 两侧通常在不同磁盘上，同时读取元数据
+    with ThreadPoolExecutor(2) as pool:
+        a, b = pool.map(lambda p: load_tree(p, recursive, errors), (path1, path2))
+
+    report = compare_trees(
+        a,
+        b,
+        resolve_jobs(jobs),
+        trust_mtime,
+        files=not dirs_only,
+        dirs=not files_only,
+        recursive=recursive,
+        use_cache=not no_cache,
+    )
+    report = report._replace(errors=errors + report.errors)
+    print_report(report, as_json)
+    if report.differences:
+        sys.exit(1)
+
+
+@cli.command()
+@click.argument("root", type=click.Path(exists=True, file_okay=False))
+@click.argument("output", type=click.Path(dir_okay=False))
+@click.option(
+    "-j",
+    "--jobs",
+    help="Number of hashing threads, 0 for all CPUs. Default: 0.",
+    type=click.IntRange(min=0),
+    default=0,
+)
+@click.option(
+    "--rebuild",
+    help="Hash every file even if OUTPUT is an earlier snapshot of ROOT.",
+    is_flag=True,
+)
+@click.option(
+    "--no-cache",
+    help="Do not read or update the file hash cache.",
+    is_flag=True,
+)
+def snapshot(root: str, output: str, jobs: int, rebuild: bool, no_cache: bool):
+    """把 ROOT 的文件大小、修改时间、哈希和目录摘要保存到快照文件 OUTPUT
+
+    OUTPUT 已是 ROOT 的快照时只重新计算大小或修改时间变化了的文件。
+    """
+    counter = take_snapshot(root, output, resolve_jobs(jobs), not no_cache, rebuild)
+    for key in ("files", "unchanged", "hashed", "errors"):
+        click.echo(f"\t{key}: {counter[key]}")
+
+
+@cli.command()
+@click.argument(
+    "roots", nargs=-1, required=True, type=click.Path(exists=True, file_okay=False)
+)
+@click.option(
+    "-j",
+    "--jobs",
+    help="Number of hashing threads, 0 for all CPUs. Default: 0.",
+    type=click.IntRange(min=0),
+    default=0,
+)
+@click.option(
+    "--min-size",
+    help="Ignore files smaller than this many bytes. Default: 1.",
+    type=click.IntRange(min=0),
+    default=1,
+)
+@click.option(
+    "--json",
+    "as_json",
+    help="Print the duplicate groups as JSON.",
+    is_flag=True,
+)
+@click.option(
+    "--no-cache",
+    help="Do not read or update the file hash cache.",
+    is_flag=True,
+)
+def dupes(roots: tuple[str], jobs: int, min_size: int, as_json: bool, no_cache: bool):
+    """查找 ROOTS 下内容相同的文件，并统计删除重复后可以节省的空间"""
+
+    groups, errors = find_dupes(roots, resolve_jobs(jobs), min_size, not no_cache)
+    for path, error in errors:
+        click.echo(f"{error} {path}", err=True)
+
+    reclaimable = sum(g.reclaimable for g in groups)
+    if as_json:
+        click.echo(
+            json.dumps(
+                {
+                    "groups": [g._asdict() for g in groups],
+                    "reclaimable": reclaimable,
+                },
+                ensure_ascii=False,
+                indent=2,
+            )
+        )
+        return
+
+    for group in groups:
+        click.echo(f"{len(group.paths)} x {group.size:,} bytes")
+        for path in group.paths:
+            click.echo(f"\t{path}")
+    click.echo()
+    click.echo(
+        f"found {len(groups)} duplicate groups, {reclaimable:,} bytes reclaimable"
+    )
+
+
+if __name__ == "__main__":
+    cli()
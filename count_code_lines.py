@@ -1,13 +1,38 @@
+import codecs
+import json
 import os
 import re
-from typing import Optional
+import sqlite3
+from collections import Counter
+from functools import partial
+from typing import NamedTuple, Optional
 
-import chardet
+import click
 
-includes = [
-    r"^.*\.py$",
-    r"^.*\.(?:js|jsx|ts|tsx)$",
-]
+import textinfo
+import watch_daemon
+from filecache import open_cache
+from parallel import batched, imap_bounded, resolve_jobs
+from walk import walk
+
+# 语言名: (文件路径正则, 行注释前缀, 块注释的起止标记)
+language_specs = {
+    "Python": (
+        [r"^.*\.py$"],
+        ("#",),
+        (('"""', '"""'), ("'''", "'''")),
+    ),
+    "JavaScript": (
+        [r"^.*\.(?:js|jsx)$"],
+        ("//",),
+        (("/*", "*/"),),
+    ),
+    "TypeScript": (
+        [r"^.*\.(?:ts|tsx)$"],
+        ("//",),
+        (("/*", "*/"),),
+    ),
+}
 
 excludes = [
     r"^.*\.idea.*$",
@@ -15,48 +40,265 @@ excludes = [
     r"^.*\.vscode.*$",
     r"^.*venv.*$",
     r"^.*node_modules.*$",
-    r"^.*build.*$"
+    r"^.*build.*$",
 ]
 
 
-def open_smartly(file, *args, **kwargs):
-    with open(file, "rb") as rbf:
-        encoding = chardet.detect(rbf.read(1024))["encoding"]
-    return open(file, *args, encoding=encoding, **kwargs)
+class Language(NamedTuple):
+    name: str
+    patterns: list[re.Pattern]
+    line_comments: tuple[bytes, ...]
+    block_comments: tuple[tuple[bytes, bytes], ...]
+
 
+class Lines(NamedTuple):
+    code: int
+    blank: int
+    comment: int
 
-includes = [re.compile(i) for i in includes]
+
+languages = [
+    Language(
+        name,
+        [re.compile(i) for i in patterns],
+        tuple(i.encode() for i in line_comments),
+        tuple((i.encode(), j.encode()) for i, j in block_comments),
+    )
+    for name, (patterns, line_comments, block_comments) in language_specs.items()
+]
 excludes = [re.compile(i) for i in excludes]
 
+# 结果缓存的命名空间，统计规则变化时递增
+_CACHE_KIND = "code-lines-2"
+
+# 每个任务处理的文件数，摊薄跨进程提交的开销
+_BATCH_SIZE = 64
+
+
+def excluded(rel: str) -> bool:
+    """相对于 ROOT 的路径 rel 是否匹配 excludes
+
+    与原来从 . 开始遍历时一样只看 ROOT 之下的部分，ROOT 本身位于 build、
+    venv 等目录中时不会排除所有文件。
+    """
+    return any(x.match(rel) for x in excludes)
+
+
+def prune(root: str, dir_path: str) -> bool:
+    """目录本身匹配 excludes 时不再进入，其中的文件同样会被排除"""
+    return excluded(os.path.relpath(dir_path, root) + os.sep)
+
+
+def language_index(file: str) -> Optional[int]:
+    """只按文件名模式返回 file 所属语言在 languages 中的序号，不考虑 excludes"""
+    for i, language in enumerate(languages):
+        if any(x.match(file) for x in language.patterns):
+            return i
+    return None
+
+
+def match_language(root: str, file: str) -> Optional[int]:
+    """返回 root 下的 file 所属语言在 languages 中的序号"""
+    if excluded(os.path.relpath(file, root)):
+        return None
+    return language_index(file)
+
+
+def count_lines(data: bytes, language: Language) -> Lines:
+    """在字节上把各行分为代码、空行和注释
+
+    data 的编码必须是 CR、LF 为单字节的编码（见 textinfo.newline_transparent），
+    GB18030、BIG5 等编码的多字节字符里不会出现它们，因此不必解码。
+    """
+    code = blank = comment = 0
+    block_end = None
+    for line in data.splitlines():
+        line = line.strip()
+        if block_end is not None:
+            comment += 1
+            if block_end in line:
+                block_end = None
+            continue
+        if not line:
+            blank += 1
+            continue
+        if line.startswith(language.line_comments):
+            comment += 1
+            continue
+        for start, end in language.block_comments:
+            if line.startswith(start):
+                comment += 1
+                if end not in line[len(start) :]:
+                    block_end = end
+                break
+        else:
+            code += 1
+    return Lines(code, blank, comment)
 
-def match_and_count(file: str, allow_empty=False) -> Optional[int]:
-    def func0(x: str):
-        return 1
 
-    def func1(x: str):
-        return 1 if x.strip() != "" else 0
+def count_file(
+    path: str, language: Language, use_cache: bool = True
+) -> Optional[Lines]:
+    """统计单个文件；二进制或无法读取的文件返回 None
 
-    func = func1 if allow_empty else func0
+    编码由 textinfo.detect 识别，结果缓存在 filecache 中。UTF-16/32 等
+    CR、LF 不是单字节的编码先转为 UTF-8。
+    """
     try:
-        for pattern in includes:
-            if pattern.match(file):
-                if any(map(lambda x: x.match(file), excludes)):
-                    return
-                with open_smartly(file) as f:
-                    return sum(map(func, f))
-    except BaseException:
-        pass
-    return
-
-
-counter = 0
-for root, dirs, files in os.walk("."):
-    for file in files:
-        full_path = os.path.join(root, file)
-        line_nums = match_and_count(full_path)
-        if line_nums:
-            print("[{}]\t{}".format(line_nums, full_path))
-            counter += line_nums
-
-print()
-print("total: ", counter)
+        info = textinfo.detect(path, use_cache)
+        if info.encoding is None or info.newlines is False:
+            return None
+        with open(path, "rb") as f:
+            data = f.read()
+        if not textinfo.newline_transparent(info.encoding):
+            data = data.decode(info.encoding).encode("utf-8")
+        elif b"\0" in data:
+            return None
+        elif data.startswith(codecs.BOM_UTF8):
+            data = data[len(codecs.BOM_UTF8) :]
+        return count_lines(data, language)
+    except (OSError, UnicodeDecodeError, LookupError):
+        return None
+
+
+def _count_batch(use_cache: bool, batch: list[tuple]) -> list[Optional[Lines]]:
+    return [
+        lines if lines is not None else count_file(path, languages[index], use_cache)
+        for path, index, lines in batch
+    ]
+
+
+def _from_daemon(root: str, records: list):
+    for path, value in watch_daemon.unpruned(root, records, partial(prune, root)):
+        index = match_language(root, path)
+        if index is not None and value is not None and value[0] == index:
+            yield path, languages[index].name, Lines(*value[1:])
+
+
+def count_tree(root: str, jobs: int = 1, ignore: bool = False, use_cache: bool = True):
+    """按遍历顺序产出 (path, 语言名, Lines)
+
+    缓存在主进程中查询和写入，只有未命中的文件会交给工作进程读取。有守护
+    进程（见 watch_daemon）监视 root 时直接使用它的结果，按路径顺序产出。
+    """
+    if use_cache:
+        records = watch_daemon.query(root, "lines", ignore)
+        if records is not None:
+            yield from _from_daemon(root, records)
+            return
+
+    cache = open_cache(_CACHE_KIND) if use_cache else None
+    # 未命中文件在读取之前的 stat，写缓存时使用
+    stats = {}
+
+    def gen_items():
+        for entry in walk(root, partial(prune, root), ignore):
+            index = match_language(root, entry.path)
+            if index is None:
+                continue
+            lines = None
+            if cache is not None:
+                try:
+                    st = entry.stat()
+                    value = cache.get(entry.path, st)
+                except (OSError, sqlite3.Error):
+                    st = value = None
+                if value is not None:
+                    lines = Lines(*value)
+                elif st is not None:
+                    stats[entry.path] = st
+            yield entry.path, index, lines
+
+    for batch, results in imap_bounded(
+        partial(_count_batch, use_cache), batched(gen_items(), _BATCH_SIZE), jobs
+    ):
+        puts = []
+        for (path, index, cached), lines in zip(batch, results):
+            st = stats.pop(path, None)
+            if lines is None:
+                continue
+            if cached is None and st is not None:
+                puts.append((path, list(lines), st))
+            yield path, languages[index].name, lines
+
+        if puts:
+            try:
+                with cache.batch():
+                    for put in puts:
+                        cache.put(*put)
+            except sqlite3.Error:
+                pass
+
+
+@click.command()
+@click.argument("root", default=".", type=click.Path(exists=True, file_okay=False))
+@click.option(
+    "-j",
+    "--jobs",
+    help="Number of worker processes, 0 for all CPUs. Default: 0.",
+    type=click.IntRange(min=0),
+    default=0,
+)
+@click.option(
+    "--json",
+    "as_json",
+    help="Print the result as JSON.",
+    is_flag=True,
+)
+@click.option(
+    "--no-cache",
+    help="Do not read or update the line count cache.",
+    is_flag=True,
+)
+@click.option(
+    "--ignore",
+    help="Honor .gitignore/.ignore files and skip .git.",
+    is_flag=True,
+)
+def cli(root: str, jobs: int, as_json: bool, no_cache: bool, ignore: bool):
+    """按语言统计 ROOT（默认为当前目录）下代码文件的代码、注释和空行数"""
+
+    files = []
+    totals = {}
+    for path, language, lines in count_tree(
+        root, resolve_jobs(jobs), ignore, not no_cache
+    ):
+        files.append({"path": path, "language": language, **lines._asdict()})
+        total = totals.setdefault(language, Counter())
+        total["files"] += 1
+        total.update(lines._asdict())
+        if not as_json and sum(lines):
+            print("[{}]\t{}".format(sum(lines), path))
+
+    total = sum(totals.values(), Counter())
+    if as_json:
+        result = {
+            "files": files,
+            "languages": {k: dict(v) for k, v in totals.items()},
+            "total": dict(total),
+        }
+        click.echo(json.dumps(result, ensure_ascii=False, indent=2))
+        return
+
+    print()
+    print(
+        "{:<12}{:>8}{:>10}{:>10}{:>10}".format(
+            "language", "files", "code", "comment", "blank"
+        )
+    )
+    for language, count in sorted(totals.items()):
+        print(
+            "{:<12}{:>8}{:>10}{:>10}{:>10}".format(
+                language,
+                count["files"],
+                count["code"],
+                count["comment"],
+                count["blank"],
+            )
+        )
+    print()
+    print("total: ", total["code"] + total["comment"] + total["blank"])
+
+
+if __name__ == "__main__":
+    cli()
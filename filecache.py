@@ -0,0 +1,166 @@
+"""以 (路径, 大小, 修改时间, inode) 为键的持久化文件结果缓存
+
+各脚本把对单个文件的计算结果（编码识别、行数统计等）存入同一个 SQLite
+数据库，文件的大小、修改时间或 inode 变化后对应记录自动失效。记录按最近
+使用时间淘汰，总条数不超过 max_entries。
+"""
+
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Any, Optional
+
+DEFAULT_MAX_ENTRIES = 500_000
+
+# 命中时最近使用时间的刷新粒度（秒），避免每次命中都写库
+_TOUCH_INTERVAL = 3600
+
+# 每写入多少条检查一次容量
+_EVICT_EVERY = 1000
+
+
+def cache_dir() -> str:
+    """缓存目录，可用环境变量 MYCMD_CACHE_DIR 覆盖"""
+    path = os.environ.get("MYCMD_CACHE_DIR")
+    if path:
+        return path
+    if os.name == "nt":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "mycmd")
+
+
+def file_key(path: str) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+
+class FileCache:
+    """一个命名空间（kind）下的文件结果缓存，值为可 JSON 序列化的对象"""
+
+    def __init__(
+        self,
+        kind: str,
+        path: Optional[str] = None,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ):
+        if path is None:
+            os.makedirs(cache_dir(), exist_ok=True)
+            path = os.path.join(cache_dir(), "filecache.sqlite3")
+        self.kind = kind
+        self.path = path
+        self.max_entries = max_entries
+        self._puts = 0
+
+        # 自动提交 + WAL：多个进程可以同时读写而不必各自管理事务
+        self._db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " kind TEXT NOT NULL,"
+            " path TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " mtime INTEGER NOT NULL,"
+            " ino INTEGER NOT NULL,"
+            " used INTEGER NOT NULL,"
+            " value TEXT NOT NULL,"
+            " PRIMARY KEY (kind, path))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @contextmanager
+    def batch(self):
+        """把其中的多次写入合并为一个事务"""
+        self._db.execute("BEGIN")
+        try:
+            yield self
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def get(self, path: str, st: Optional[os.stat_result] = None) -> Any:
+        """返回 path 的缓存值；没有记录或文件已变化时返回 None"""
+        if st is None:
+            st = os.stat(path)
+        key = file_key(path)
+        row = self._db.execute(
+            "SELECT size, mtime, ino, used, value FROM entries"
+            " WHERE kind = ? AND path = ?",
+            (self.kind, key),
+        ).fetchone()
+        if row is None:
+            return None
+        size, mtime, ino, used, value = row
+        if (size, mtime, ino) != (st.st_size, st.st_mtime_ns, st.st_ino):
+            return None
+
+        now = int(time.time())
+        if now - used > _TOUCH_INTERVAL:
+            self._db.execute(
+                "UPDATE entries SET used = ? WHERE kind = ? AND path = ?",
+                (now, self.kind, key),
+            )
+        return json.loads(value)
+
+    def put(self, path: str, value: Any, st: Optional[os.stat_result] = None):
+        if st is None:
+            st = os.stat(path)
+        self._db.execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                self.kind,
+                file_key(path),
+                st.st_size,
+                st.st_mtime_ns,
+                st.st_ino,
+                int(time.time()),
+                json.dumps(value, ensure_ascii=False),
+            ),
+        )
+        self._puts += 1
+        if self._puts % _EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        """按最近使用时间淘汰超出容量的记录"""
+        (count,) = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()
+        if count > self.max_entries:
+            self._db.execute(
+                "DELETE FROM entries WHERE rowid IN"
+                " (SELECT rowid FROM entries ORDER BY used LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+
+_opened: dict[str, tuple[int, FileCache]] = {}
+
+
+def open_cache(kind: str) -> Optional[FileCache]:
+    """返回当前进程中 kind 对应的共享缓存实例
+
+    子进程会重新打开连接（SQLite 连接不能跨 fork 使用）。缓存目录不可用时
+    返回 None，调用方应退化为不使用缓存。
+    """
+    pid = os.getpid()
+    opened = _opened.get(kind)
+    if opened is not None and opened[0] == pid:
+        return opened[1]
+    try:
+        cache = FileCache(kind)
+    except (OSError, sqlite3.Error):
+        return None
+    _opened[kind] = (pid, cache)
+    return cache
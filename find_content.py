@@ -1,38 +1,670 @@
-import sys
+import codecs
+import itertools
+import json
+import mmap
 import os
-import chardet
+import re
+import sqlite3
+import zlib
+from array import array
+from collections import Counter, defaultdict
+from contextlib import closing
+from functools import partial
+from typing import Iterator, NamedTuple, Optional
 
+import click
 
-def smart_open(path, mode):
-    with open(path, "rb") as rbf:
-        encoding = chardet.detect(rbf.read(1024))["encoding"]
+import textinfo
+import watch_daemon
+from clickgroup import DefaultGroup
+from filecache import cache_dir
+from parallel import batched, imap_bounded, resolve_jobs
+from walk import walk
+
+# 在这些编码下把要查找的内容编码为字节，直接在文件字节上匹配
+default_encodings = (
+    "UTF-8",
+    "GB18030",
+    "BIG5",
+    "UTF-16-LE",
+    "UTF-16-BE",
+)
+
+# 每个任务处理的文件数，摊薄跨进程提交的开销
+_BATCH_SIZE = 64
+
+
+class Query(NamedTuple):
+    needle: str
+    # needle 在各候选编码下的字节形式
+    patterns: tuple[bytes, ...]
+    regex: Optional[re.Pattern]
+    line_number: bool
+    max_count: Optional[int]
+    use_cache: bool
+
+
+class Hit(NamedTuple):
+    # 未要求行号时为 0
+    lineno: int
+    line: str
+
+
+def make_query(
+    needle: str,
+    encodings=default_encodings,
+    regex: bool = False,
+    line_number: bool = False,
+    max_count: Optional[int] = None,
+    use_cache: bool = True,
+) -> Query:
+    patterns = set()
+    for encoding in encodings:
+        try:
+            patterns.add(needle.encode(encoding))
+        except UnicodeEncodeError:
+            pass
+    return Query(
+        needle,
+        tuple(patterns),
+        re.compile(needle) if regex else None,
+        line_number,
+        max_count,
+        use_cache,
+    )
+
+
+def smart_open(path, mode, use_cache=True):
+    encoding = textinfo.detect(path, use_cache).encoding
     return open(path, mode, encoding=encoding)
 
 
-def search_file(file_path, str_to_find):
+def _needle_encoding(encoding: str, head: bytes) -> str:
+    """文件正文实际使用的编码：去掉 BOM 的含义，区分 UTF-16/32 的字节序"""
+    name = codecs.lookup(encoding).name
+    if name == "utf-8-sig":
+        return "utf-8"
+    if name in ("utf-16", "utf-32"):
+        # UTF-32-LE 的 BOM 同样以 FF FE 开头
+        le = head.startswith(codecs.BOM_UTF16_LE)
+        return name + ("-le" if le else "-be")
+    return encoding
+
+
+def _search_text(path: str, query: Query, encoding: str) -> list[Hit]:
+    """解码后逐行查找，用于正则和非 ASCII 兼容编码"""
+    hits = []
+    with open(path, "r", encoding=encoding) as f:
+        for lineno, line in enumerate(f, 1):
+            if query.regex is not None:
+                found = query.regex.search(line)
+            else:
+                found = query.needle in line
+            if not found:
+                continue
+            if not query.line_number:
+                return [Hit(0, "")]
+            hits.append(Hit(lineno, line.rstrip("\r\n")))
+            if query.max_count and len(hits) >= query.max_count:
+                break
+    return hits
+
+
+def _count_lines(data: bytes) -> int:
+    """data 中的换行数，LF、CRLF 和单独的 CR 各算一个，与文本模式读取一致"""
+    return data.count(b"\n") + data.count(b"\r") - data.count(b"\r\n")
+
+
+def _line_end(mm: mmap.mmap, pos: int) -> int:
+    ends = [i for i in (mm.find(b"\n", pos), mm.find(b"\r", pos)) if i != -1]
+    return min(ends, default=len(mm))
+
+
+def _search_bytes(mm: mmap.mmap, pattern: bytes, encoding: str, query: Query):
+    """在字节上查找 pattern，只解码命中的行"""
+    hits = []
+    lineno, counted = 1, 0
+    pos = mm.find(pattern)
+    while pos != -1:
+        start = max(mm.rfind(b"\n", 0, pos), mm.rfind(b"\r", 0, pos)) + 1
+        end = _line_end(mm, pos)
+        lineno += _count_lines(mm[counted:start])
+        counted = start
+        line = mm[start:end].decode(encoding, "replace")
+        hits.append(Hit(lineno, line))
+        if query.max_count and len(hits) >= query.max_count:
+            break
+        pos = mm.find(pattern, end)
+    return hits
+
+
+def search_file(path: str, query: Query) -> list[Hit]:
+    """在单个文件中查找，返回命中的行；不要求行号时最多返回一个 Hit"""
+    if query.regex is not None:
+        encoding = textinfo.detect(path, query.use_cache).encoding
+        if encoding is None:
+            return []
+        return _search_text(path, query, encoding)
+
+    if os.path.getsize(path) == 0:
+        return []
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        found = {p for p in query.patterns if mm.find(p) != -1}
+        if not found:
+            return []
+
+        # 字节命中后再按文件的实际编码确认，排除二进制文件和其他编码的巧合
+        info = textinfo.detect(path, query.use_cache)
+        if info.encoding is None:
+            return []
+        encoding = _needle_encoding(info.encoding, mm[:4])
+        try:
+            pattern = query.needle.encode(encoding)
+        except (UnicodeEncodeError, LookupError):
+            return []
+        if pattern not in found:
+            return []
+
+        if not query.line_number:
+            return [Hit(0, "")]
+        if not textinfo.newline_transparent(encoding):
+            return _search_text(path, query, info.encoding)
+        return _search_bytes(mm, pattern, encoding, query)
+
+
+def search_files(query: Query, paths: list[str]) -> list[tuple]:
+    """依次查找 paths，返回 (path, hits, error)；无法解码的文件视为不匹配"""
+    results = []
+    for path in paths:
+        hits, error = [], None
+        try:
+            hits = search_file(path, query)
+        except (UnicodeDecodeError, LookupError, ValueError):
+            pass
+        except OSError as e:
+            error = f"[{type(e).__name__}] {e.strerror}"
+        results.append((path, hits, error))
+    return results
+
+
+def gen_files(find_path: str, ignore: bool = False, jobs: int = 1) -> Iterator[str]:
+    for entry in walk(find_path, ignore=ignore, jobs=jobs):
+        yield entry.path
+
+
+def search_paths(paths, query: Query, jobs: int = 1) -> Iterator[tuple]:
+    """并行查找 paths，按输入顺序流式产出 (path, hits, error)
+
+    文件不超过一批时直接在主进程中查找，不启动进程池。
+    """
+    batches = batched(paths, _BATCH_SIZE)
+    first = next(batches, [])
+    second = next(batches, None)
+    if second is None:
+        yield from search_files(query, first)
+        return
+
+    for _, results in imap_bounded(
+        partial(search_files, query),
+        itertools.chain((first, second), batches),
+        jobs,
+    ):
+        yield from results
+
+
+def traverse(
+    find_path: str, query: Query, jobs: int = 1, ignore: bool = False
+) -> Iterator[tuple]:
+    """遍历 find_path，按遍历顺序流式产出 (path, hits, error)
+
+    有守护进程（见 watch_daemon）监视 find_path 时不再遍历：查找字符串时只
+    检查它给出的候选文件，按路径顺序产出。
+    """
+    paths = None
+    if query.use_cache:
+        if query.regex is None:
+            paths = watch_daemon.query(find_path, "search", ignore, needle=query.needle)
+        else:
+            paths = watch_daemon.query(find_path, "files", ignore)
+    if paths is None:
+        paths = gen_files(find_path, ignore, jobs)
+    return search_paths(paths, query, jobs)
+
+
+# 超过此大小的文件不建立三元组索引，查询时总是作为候选
+MAX_INDEX_SIZE = 16 << 20
+
+# 索引格式变化时加一，打开旧索引时直接重建
+_INDEX_VERSION = 2
+# 内存中积累这么多条倒排记录（文件, 三元组），或这么多个不同的三元组后
+# 写入数据库。源码的三元组不多，主要受前者限制；用字很杂的文本每个三元组
+# 都要占用一个字典项，由后者限制
+_FLUSH_POSTINGS = 1 << 20
+_FLUSH_GRAMS = 1 << 18
+
+
+def index_path(root: str) -> str:
+    """root 对应的默认索引文件，位于 filecache 的缓存目录中"""
+    root = os.path.normcase(os.path.abspath(root))
+    os.makedirs(cache_dir(), exist_ok=True)
+    return os.path.join(cache_dir(), f"index-{zlib.crc32(root.encode()):08x}.sqlite3")
+
+
+def open_index(path: str) -> sqlite3.Connection:
+    """打开索引
+
+    每个三元组的倒排表是一个 BLOB，内容为按 id 升序排列的 uint32 数组。
+    files.id 不会重用，新文件的 id 直接追加到倒排表末尾；删除的文件只从
+    files 中删去，查询时自然被过滤，失效的 id 累计超过现有文件数时再统一
+    清理（见 _compact）。
+    """
+    db = sqlite3.connect(path, timeout=60)
+    db.execute("PRAGMA journal_mode=WAL")
+    (version,) = db.execute("PRAGMA user_version").fetchone()
+    if version != _INDEX_VERSION:
+        with db:
+            for table in ("files", "grams", "postings", "meta"):
+                db.execute(f"DROP TABLE IF EXISTS {table}")
+            db.execute(f"PRAGMA user_version = {_INDEX_VERSION}")
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS files ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        " path TEXT UNIQUE NOT NULL,"
+        " size INTEGER NOT NULL,"
+        " mtime INTEGER NOT NULL,"
+        " ino INTEGER NOT NULL,"
+        # 1：已建立索引；0：过大，总是候选；-1：不是文本，永不匹配
+        " indexed INTEGER NOT NULL)"
+    )
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS postings ("
+        " gram TEXT PRIMARY KEY,"
+        " ids BLOB NOT NULL) WITHOUT ROWID"
+    )
+    # stale：上次清理之后删除的文件数
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS meta ("
+        " key TEXT PRIMARY KEY,"
+        " value INTEGER NOT NULL) WITHOUT ROWID"
+    )
+    return db
+
+
+def _ids(blob: bytes) -> array:
+    ids = array("I")
+    ids.frombytes(blob)
+    return ids
+
+
+def _append_postings(db: sqlite3.Connection, pending: dict[str, array]):
+    db.executemany(
+        "INSERT INTO postings VALUES (?, ?) ON CONFLICT (gram)"
+        " DO UPDATE SET ids = CAST(ids || excluded.ids AS BLOB)",
+        # 按三元组顺序写入，B 树页面依次填充
+        ((gram, pending[gram].tobytes()) for gram in sorted(pending)),
+    )
+    pending.clear()
+
+
+def _compact(db: sqlite3.Connection):
+    """从倒排表中去掉已删除文件的 id"""
+    live = {id for (id,) in db.execute("SELECT id FROM files")}
+    for gram, blob in db.execute("SELECT gram, ids FROM postings").fetchall():
+        ids = _ids(blob)
+        kept = array("I", (id for id in ids if id in live))
+        if not kept:
+            db.execute("DELETE FROM postings WHERE gram = ?", (gram,))
+        elif len(kept) != len(ids):
+            db.execute(
+                "UPDATE postings SET ids = ? WHERE gram = ?", (kept.tobytes(), gram)
+            )
+
+
+def trigrams(text: str) -> set[str]:
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+def index_file(path: str, size: int, use_cache: bool = True) -> tuple[int, tuple]:
+    """计算单个文件的三元组，返回 (indexed, grams)，indexed 的含义同 files 表"""
+    if size > MAX_INDEX_SIZE:
+        return 0, ()
     try:
-        with smart_open(file_path, "r") as f:
-            if str_to_find in f.read():
-                return True
-    except:
-        pass
-    return False
-
-
-def traverse(find_path, str_to_find):
-    counter = 0
-    for root, dirs, files in os.walk(find_path):
-        for i in files:
-            file_path = os.path.join(root, i)
-            if search_file(file_path, str_to_find):
-                counter += 1
-                print(file_path)
+        encoding = textinfo.detect(path, use_cache).encoding
+        if encoding is None:
+            return -1, ()
+        # 与字节查找保持一致：个别非法字节不影响其余内容的索引
+        with open(path, "r", encoding=encoding, errors="replace") as f:
+            return 1, tuple(trigrams(f.read()))
+    except (LookupError, OSError):
+        return -1, ()
+
+
+def _index_files(use_cache: bool, paths: list[tuple]) -> list[tuple]:
+    """计算 (path, stat) 中每个文件的三元组，返回 (path, stat, indexed, grams)"""
+    return [(path, st, *index_file(path, st[0], use_cache)) for path, st in paths]
+
+
+def update_index(
+    db: sqlite3.Connection,
+    root: str,
+    jobs: int = 1,
+    use_cache: bool = True,
+    rebuild: bool = False,
+    ignore: bool = False,
+) -> Counter:
+    """按大小、修改时间和 inode 增量更新 root 的索引，返回各类文件的数量"""
+    if rebuild:
+        db.execute("DELETE FROM postings")
+        db.execute("DELETE FROM files")
+        db.execute("DELETE FROM meta")
+    known = {
+        path: (id, (size, mtime, ino))
+        for id, path, size, mtime, ino in db.execute(
+            "SELECT id, path, size, mtime, ino FROM files"
+        )
+    }
+
+    def gen_changed():
+        for entry in walk(root, ignore=ignore, jobs=jobs):
+            path = os.path.abspath(entry.path)
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            st = (st.st_size, st.st_mtime_ns, st.st_ino)
+            old = known.pop(path, None)
+            if old is not None and old[1] == st:
+                counter["unchanged"] += 1
+                continue
+            if old is not None:
+                counter["stale"] += 1
+                db.execute("DELETE FROM files WHERE id = ?", (old[0],))
+            yield path, st
+
+    counter = Counter()
+    pending: dict[str, array] = defaultdict(partial(array, "I"))
+    buffered = 0
+    with db:
+        for _, results in imap_bounded(
+            partial(_index_files, use_cache),
+            batched(gen_changed(), _BATCH_SIZE),
+            jobs,
+        ):
+            for path, st, indexed, grams in results:
+                counter["indexed"] += 1
+                (id,) = db.execute(
+                    "INSERT INTO files (path, size, mtime, ino, indexed)"
+                    " VALUES (?, ?, ?, ?, ?) RETURNING id",
+                    (path, *st, indexed),
+                ).fetchone()
+                for gram in grams:
+                    pending[gram].append(id)
+                buffered += len(grams)
+                if buffered >= _FLUSH_POSTINGS or len(pending) >= _FLUSH_GRAMS:
+                    _append_postings(db, pending)
+                    buffered = 0
+        _append_postings(db, pending)
+
+        # 遍历中没有再出现的文件已被删除
+        for id, _ in known.values():
+            counter["removed"] += 1
+            counter["stale"] += 1
+            db.execute("DELETE FROM files WHERE id = ?", (id,))
+
+        row = db.execute("SELECT value FROM meta WHERE key = 'stale'").fetchone()
+        stale = counter.pop("stale", 0) + (row[0] if row else 0)
+        (live,) = db.execute("SELECT COUNT(*) FROM files").fetchone()
+        if stale > live:
+            _compact(db)
+            stale = 0
+        db.execute("INSERT OR REPLACE INTO meta VALUES ('stale', ?)", (stale,))
     return counter
 
 
+def query_index(db: sqlite3.Connection, needle: str) -> list[str]:
+    """返回可能包含 needle 的文件：含有 needle 全部三元组的文件和未建索引的大文件"""
+    grams = trigrams(needle)
+    if not grams:
+        sql = "SELECT path FROM files WHERE indexed >= 0 ORDER BY path"
+        return [path for (path,) in db.execute(sql)]
+
+    lists = []
+    for gram in grams:
+        row = db.execute("SELECT ids FROM postings WHERE gram = ?", (gram,)).fetchone()
+        if row is None:
+            lists = []
+            break
+        lists.append(_ids(row[0]))
+    found = set()
+    if lists:
+        lists.sort(key=len)
+        found.update(lists[0])
+        for ids in lists[1:]:
+            found.intersection_update(ids)
+    # 已删除文件的 id 在 files 中找不到，在这里被过滤
+    sql = (
+        "SELECT path FROM files WHERE indexed = 0"
+        " OR id IN (SELECT value FROM json_each(?)) ORDER BY path"
+    )
+    return [path for (path,) in db.execute(sql, (json.dumps(sorted(found)),))]
+
+
+@click.group(cls=DefaultGroup, default="search")
+def cli():
+    """查找内容包含指定字符串的文本文件
+
+    \b
+    CONTENT 与子命令同名时，用 -- 或显式的 search 子命令：
+        find_content -- index
+        find_content search index
+    """
+
+
+def search_options(func):
+    """search 和 index query 共用的选项"""
+    for option in reversed(
+        (
+            click.option(
+                "-e",
+                "--encoding",
+                "encodings",
+                help="Candidate encodings. "
+                f"Default: {', '.join(default_encodings)}.",
+                default=default_encodings,
+                multiple=True,
+            ),
+            click.option(
+                "-n",
+                "--line-number",
+                help="Print matching lines with their line numbers.",
+                is_flag=True,
+            ),
+            click.option(
+                "-m",
+                "--max-count",
+                help="Stop after NUM matches (files, or lines with -n).",
+                type=click.IntRange(min=1),
+            ),
+            click.option(
+                "-j",
+                "--jobs",
+                help="Number of worker processes, 0 for all CPUs. Default: 0.",
+                type=click.IntRange(min=0),
+                default=0,
+            ),
+            click.option(
+                "--no-cache",
+                help="Do not read or update the encoding detection cache.",
+                is_flag=True,
+            ),
+        )
+    ):
+        func = option(func)
+    return func
+
+
+def print_results(content: str, results, line_number: bool, max_count):
+    click.echo(f'find file with content "{content}"')
+    click.echo()
+    n = matches = 0
+    for path, hits, error in results:
+        if error:
+            click.echo(f"{error} {path}", err=True)
+        if not hits:
+            continue
+        n += 1
+        if not line_number:
+            matches += 1
+            click.echo(path)
+        else:
+            for hit in hits[: max_count - matches if max_count else None]:
+                matches += 1
+                click.echo(f"{path}:{hit.lineno}: {hit.line}")
+        if max_count and matches >= max_count:
+            break
+    click.echo()
+    click.echo(f"found {n} files")
+
+
+@cli.command()
+@click.argument("content")
+@click.argument(
+    "find_path",
+    default=".",
+    type=click.Path(exists=True, file_okay=False),
+)
+@click.option(
+    "-E",
+    "--regex",
+    help="Treat CONTENT as a regular expression.",
+    is_flag=True,
+)
+@click.option(
+    "--ignore",
+    help="Honor .gitignore/.ignore files and skip .git.",
+    is_flag=True,
+)
+@search_options
+def search(
+    content: str,
+    find_path: str,
+    regex: bool,
+    ignore: bool,
+    encodings: tuple[str],
+    line_number: bool,
+    max_count: Optional[int],
+    jobs: int,
+    no_cache: bool,
+):
+    """在 FIND_PATH（默认为当前目录）下递归查找内容包含 CONTENT 的文本文件"""
+
+    query = make_query(content, encodings, regex, line_number, max_count, not no_cache)
+    results = traverse(find_path, query, resolve_jobs(jobs), ignore)
+    print_results(content, results, line_number, max_count)
+
+
+@cli.group()
+def index():
+    """维护三元组索引，重复查找同一目录时只需检查候选文件"""
+
+
+def index_options(func):
+    func = click.option(
+        "--ignore",
+        help="Honor .gitignore/.ignore files and skip .git.",
+        is_flag=True,
+    )(func)
+    func = click.option(
+        "-i",
+        "--index",
+        "index_file",
+        help="Index file. Default: one per ROOT in the cache directory.",
+        type=click.Path(dir_okay=False),
+    )(func)
+    func = click.argument(
+        "root",
+        default=".",
+        type=click.Path(exists=True, file_okay=False),
+    )(func)
+    return func
+
+
+def _echo_counter(counter: Counter):
+    for key in ("indexed", "unchanged", "removed"):
+        click.echo(f"\t{key}: {counter[key]}")
+
+
+@index.command()
+@index_options
+@click.option(
+    "-j",
+    "--jobs",
+    help="Number of worker processes, 0 for all CPUs. Default: 0.",
+    type=click.IntRange(min=0),
+    default=0,
+)
+def build(root: str, index_file: Optional[str], ignore: bool, jobs: int):
+    """为 ROOT 重新建立索引"""
+
+    with closing(open_index(index_file or index_path(root))) as db:
+        counter = update_index(
+            db, root, resolve_jobs(jobs), rebuild=True, ignore=ignore
+        )
+        _echo_counter(counter)
+
+
+@index.command()
+@index_options
+@click.option(
+    "-j",
+    "--jobs",
+    help="Number of worker processes, 0 for all CPUs. Default: 0.",
+    type=click.IntRange(min=0),
+    default=0,
+)
+def update(root: str, index_file: Optional[str], ignore: bool, jobs: int):
+    """只重新索引 ROOT 中大小或修改时间变化了的文件"""
+
+    with closing(open_index(index_file or index_path(root))) as db:
+        counter = update_index(db, root, resolve_jobs(jobs), ignore=ignore)
+        _echo_counter(counter)
+
+
+@index.command()
+@click.argument("content")
+@index_options
+@click.option(
+    "-u",
+    "--update",
+    "update_first",
+    help="Update the index before querying.",
+    is_flag=True,
+)
+@search_options
+def query(
+    content: str,
+    root: str,
+    index_file: Optional[str],
+    ignore: bool,
+    update_first: bool,
+    encodings: tuple[str],
+    line_number: bool,
+    max_count: Optional[int],
+    jobs: int,
+    no_cache: bool,
+):
+    """通过索引缩小候选范围，再在候选文件中查找 CONTENT"""
+
+    jobs = resolve_jobs(jobs)
+    with closing(open_index(index_file or index_path(root))) as db:
+        if update_first:
+            update_index(db, root, jobs, not no_cache, ignore=ignore)
+        candidates = query_index(db, content)
+
+    query = make_query(content, encodings, False, line_number, max_count, not no_cache)
+    results = search_paths(candidates, query, jobs)
+    print_results(content, results, line_number, max_count)
+
+
 if __name__ == "__main__":
-    print("find file with content \"", sys.argv[1], "\"", sep="")
-    print()
-    n = traverse(".", sys.argv[1])
-    print()
-    print("found", n, "files")
+    cli()
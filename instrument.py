@@ -0,0 +1,251 @@
+"""各脚本共用的分阶段计时、计数和 cProfile 采样
+
+    with instrument.session(table=True):
+        with instrument.phase("detect"):
+            ...
+        instrument.add("bytes_read", n)
+
+没有启用时 phase() 返回同一个空的上下文管理器，add() 什么都不做，开销只有
+一次函数调用；需要额外系统调用才能得到的计数应先检查 enabled()。
+
+工作进程中的统计随任务结果返回主进程汇总（见 imap_bounded），因此各阶段的
+耗时是所有进程累加的时间，可能超过总的墙钟时间。
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from functools import partial
+from typing import Callable, Iterable, Iterator, Optional, TextIO, TypeVar
+
+import click
+
+import parallel
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class _Phase:
+    __slots__ = ("stats", "name", "start")
+
+    def __init__(self, stats: "Stats", name: str):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        entry = self.stats.phases.get(self.name)
+        if entry is None:
+            self.stats.phases[self.name] = [elapsed, 1]
+        else:
+            entry[0] += elapsed
+            entry[1] += 1
+
+
+class Stats:
+    """各阶段的累计耗时和调用次数，以及各项计数"""
+
+    def __init__(self):
+        # 阶段名 -> [秒数, 次数]
+        self.phases: dict[str, list] = {}
+        self.counters = Counter()
+
+    def phase(self, name: str) -> _Phase:
+        return _Phase(self, name)
+
+    def add(self, name: str, n: int = 1):
+        self.counters[name] += n
+
+    def merge(self, other: dict):
+        """合并 to_dict() 的结果，通常来自工作进程"""
+        for name, (seconds, calls) in other["phases"].items():
+            entry = self.phases.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += calls
+        self.counters.update(other["counters"])
+
+    def to_dict(self) -> dict:
+        return {"phases": self.phases, "counters": dict(self.counters)}
+
+
+class _NullStats:
+    _null = nullcontext()
+
+    def phase(self, name: str):
+        return self._null
+
+    def add(self, name: str, n: int = 1):
+        pass
+
+
+_NULL = _NullStats()
+_current = _NULL
+
+# 主进程的 (pid, Profile)；fork 出的工作进程会继承它，需要先关掉
+_profiler: Optional[tuple[int, cProfile.Profile]] = None
+# 工作进程返回的 cProfile 数据在主进程中的汇总
+_worker_profiles: Optional[pstats.Stats] = None
+
+
+def enabled() -> bool:
+    return _current is not _NULL
+
+
+def phase(name: str):
+    """统计 with 语句块的耗时，计入阶段 name"""
+    return _current.phase(name)
+
+
+def add(name: str, n: int = 1):
+    _current.add(name, n)
+
+
+def timed(name: str, items: Iterable[T]) -> Iterable[T]:
+    """统计惰性迭代器（例如目录遍历）每次产出的耗时"""
+    if not enabled():
+        return items
+    return _timed(name, items)
+
+
+def _timed(name: str, items: Iterable[T]) -> Iterator[T]:
+    it = iter(items)
+    while True:
+        with phase(name):
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+        yield item
+
+
+class _LoadedProfile:
+    """让 pstats.Stats 从工作进程返回的数据构造"""
+
+    def __init__(self, stats: dict):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def _collect(func: Callable[[T], R], profile: bool, item: T):
+    global _current, _profiler
+    pid = os.getpid()
+    if _profiler is not None and _profiler[0] != pid:
+        _profiler[1].disable()
+        _profiler = None
+
+    saved, _current = _current, Stats()
+    profiler = None
+    if profile and _profiler is None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        result = func(item)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        stats, _current = _current, saved
+
+    profile_data = None
+    if profiler is not None:
+        profiler.create_stats()
+        profile_data = profiler.stats
+    return result, stats.to_dict(), profile_data
+
+
+def imap_bounded(
+    func: Callable[[T], R], items: Iterable[T], jobs: int = 1, **kwargs
+) -> Iterator[tuple[T, R]]:
+    """同 parallel.imap_bounded，启用统计时把各任务的统计汇总到主进程"""
+    global _worker_profiles
+    if not enabled():
+        yield from parallel.imap_bounded(func, items, jobs, **kwargs)
+        return
+
+    profile = _profiler is not None
+    for item, (result, stats, profile_data) in parallel.imap_bounded(
+        partial(_collect, func, profile), items, jobs, **kwargs
+    ):
+        _current.merge(stats)
+        if profile_data is not None:
+            loaded = _LoadedProfile(profile_data)
+            if _worker_profiles is None:
+                _worker_profiles = pstats.Stats(loaded)
+            else:
+                _worker_profiles.add(loaded)
+        yield item, result
+
+
+def _format_bytes(n: float) -> str:
+    if n < 1024:
+        return f"{n:.0f} B"
+    for unit in ("KB", "MB", "GB"):
+        n /= 1024
+        if n < 1024 or unit == "GB":
+            return f"{n:.1f} {unit}"
+
+
+def print_table(stats: Stats, wall: float):
+    click.echo("\nSTATS:")
+    click.echo(f"\twall: {wall:.3f}s")
+    for name, (seconds, calls) in stats.phases.items():
+        click.echo(f"\t{name}: {seconds:.3f}s ({calls} calls)")
+    for name, count in stats.counters.items():
+        rate = count / wall if wall > 0 else 0
+        if name.startswith("bytes"):
+            click.echo(f"\t{name}: {_format_bytes(count)} ({_format_bytes(rate)}/s)")
+        else:
+            click.echo(f"\t{name}: {count} ({rate:.1f}/s)")
+
+
+@contextmanager
+def session(
+    table: bool = False,
+    json_file: Optional[TextIO] = None,
+    profile: Optional[str] = None,
+):
+    """在 with 语句块内启用统计，结束时输出表格、JSON 和 cProfile 文件
+
+    三者都没有要求时什么都不做。profile 文件可以用 pstats、snakeviz 或
+    flameprof 等工具查看，包含主进程和各工作进程的数据。
+    """
+    global _current, _profiler, _worker_profiles
+    if not (table or json_file or profile):
+        yield None
+        return
+
+    stats = _current = Stats()
+    _worker_profiles = None
+    if profile:
+        _profiler = (os.getpid(), cProfile.Profile())
+        _profiler[1].enable()
+    start = time.perf_counter()
+    try:
+        yield stats
+    finally:
+        wall = time.perf_counter() - start
+        profiler, workers = _profiler, _worker_profiles
+        if profiler is not None:
+            profiler[1].disable()
+        _current = _NULL
+        _profiler = _worker_profiles = None
+
+    if table:
+        print_table(stats, wall)
+    if json_file:
+        json.dump({"wall": wall, **stats.to_dict()}, json_file, indent=2)
+        json_file.write("\n")
+    if profile:
+        merged = pstats.Stats(profiler[1])
+        if workers is not None:
+            merged.add(workers)
+        merged.dump_stats(profile)
@@ -1,36 +1,322 @@
+import re
 import sys
-import os
-import chardet
+from array import array
+from itertools import zip_longest
+from typing import Iterator
 
+import click
 
-def detect_encoding(file_path: str):
-    """判断给定路径文件的编码
+import textinfo
+
+
+def detect_encoding(file_path: str, use_cache: bool = True):
+    """判断给定路径文件的编码"""
+    return textinfo.detect(file_path, use_cache).encoding or "UTF-8"
+
+
+def line_key(line: str) -> int:
+    """比较时忽略行首尾的空白"""
+    return hash(line.strip())
+
+
+# 按字节切分行时每次读入的字节数
+CHUNK_SIZE = 1 << 20
+
+_NEWLINE = re.compile(rb"\r\n?|\n")
+
+
+def split_lines(f) -> Iterator[bytes]:
+    """按 CR、LF、CRLF 切分二进制文件，行尾保留在行内"""
+    rest = b""
+    while chunk := f.read(CHUNK_SIZE):
+        data = rest + chunk
+        start = 0
+        for m in _NEWLINE.finditer(data):
+            # 末尾的 CR 可能是跨块的 CRLF 的前半，留到下一块
+            if m.end() == len(data) and data.endswith(b"\r"):
+                break
+            yield data[start : m.end()]
+            start = m.end()
+        rest = data[start:]
+    if rest:
+        yield rest
+
+
+def iter_lines(path: str, encoding: str) -> Iterator[tuple[int, str]]:
+    """逐行产出 (行首偏移, 行内容)
+
+    CR、LF 在 ASCII 兼容编码中总是单字节，可以按字节切分并记录偏移，之后
+    按偏移回读；UTF-16/32 只能按文本读取，偏移为 -1。两种方式都把 CR、LF、
+    CRLF 视为行尾。
     """
-    with open(file_path, "rb") as f:
-        return chardet.detect(f.read(1024))["encoding"]
-    return
+    if textinfo.newline_transparent(encoding):
+        with open(path, "rb") as f:
+            offset = 0
+            for raw in split_lines(f):
+                yield offset, raw.decode(encoding, "replace")
+                offset += len(raw)
+    else:
+        with open(path, "r", encoding=encoding, errors="replace", newline="") as f:
+            for line in f:
+                yield -1, line
+
+
+class LineFile:
+    """只保存每行的哈希和偏移，输出差异时再回读所需的行"""
+
+    def __init__(self, path: str, encoding: str):
+        self.path = path
+        self.encoding = encoding
+        self.keys = array("q")
+        self.offsets = array("q")
+        # 无法按偏移回读时保存全部行
+        self._lines = None
+
+        for offset, line in iter_lines(path, encoding):
+            self.keys.append(line_key(line))
+            if offset < 0:
+                if self._lines is None:
+                    self._lines = []
+                self._lines.append(line)
+            else:
+                self.offsets.append(offset)
+        self._file = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def line(self, i: int) -> str:
+        if self._lines is not None:
+            return self._lines[i].rstrip("\r\n")
+        if self._file is None:
+            self._file = open(self.path, "rb")
+        # 各行首尾相接，下一行的偏移即本行的结尾
+        start = self.offsets[i]
+        self._file.seek(start)
+        if i + 1 < len(self.offsets):
+            raw = self._file.read(self.offsets[i + 1] - start)
+        else:
+            raw = self._file.read()
+        return raw.decode(self.encoding, "replace").rstrip("\r\n")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def _middle_snake(a, alo, ahi, b, blo, bhi) -> tuple[int, int, int, int]:
+    """Myers 线性空间算法的中间蛇，返回其在 a、b 中的起止下标 (x, y, u, v)"""
+    n, m = ahi - alo, bhi - blo
+    delta = n - m
+    odd = delta & 1
+    max_d = (n + m + 1) // 2
+    offset = max_d + 1
+    # vf[k]：正向在对角线 k = x - y 上到达的最远 x
+    # vb[k]：反向（从末尾出发）在对角线 k 上到达的最远 x
+    vf = [0] * (2 * offset + 1)
+    vb = [0] * (2 * offset + 1)
+
+    for d in range(max_d + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and vf[offset + k - 1] < vf[offset + k + 1]):
+                x = vf[offset + k + 1]
+            else:
+                x = vf[offset + k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            vf[offset + k] = x
+            rk = delta - k
+            if odd and -(d - 1) <= rk <= d - 1 and x + vb[offset + rk] >= n:
+                return alo + x0, blo + y0, alo + x, blo + y
+
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and vb[offset + k - 1] < vb[offset + k + 1]):
+                x = vb[offset + k + 1]
+            else:
+                x = vb[offset + k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[ahi - 1 - x] == b[bhi - 1 - y]:
+                x += 1
+                y += 1
+            vb[offset + k] = x
+            fk = delta - k
+            if not odd and -d <= fk <= d and x + vf[offset + fk] >= n:
+                return ahi - x, bhi - y, ahi - x0, bhi - y0
+
+    raise AssertionError("unreachable")
+
+
+def myers_diff(a, b) -> list[tuple[str, int, int, int, int]]:
+    """比较两个整数序列，返回与 difflib 相同格式的操作码"""
+    ops = []
+
+    def emit(tag, i1, i2, j1, j2):
+        if i1 == i2 and j1 == j2:
+            return
+        if ops and ops[-1][0] == tag:
+            ops[-1] = (tag, ops[-1][1], i2, ops[-1][3], j2)
+        else:
+            ops.append((tag, i1, i2, j1, j2))
+
+    def diff(alo, ahi, blo, bhi):
+        # 先去掉公共前缀和后缀
+        plo, qlo = alo, blo
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            alo += 1
+            blo += 1
+        emit("equal", plo, alo, qlo, blo)
+        ahi0, bhi0 = ahi, bhi
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+
+        if alo == ahi or blo == bhi:
+            emit("delete", alo, ahi, blo, blo)
+            emit("insert", ahi, ahi, blo, bhi)
+        else:
+            x, y, u, v = _middle_snake(a, alo, ahi, b, blo, bhi)
+            diff(alo, x, blo, y)
+            emit("equal", x, u, y, v)
+            diff(u, ahi, v, bhi)
+        emit("equal", ahi, ahi0, bhi, bhi0)
+
+    diff(0, len(a), 0, len(b))
+
+    # 连续的删除和插入合并为一处替换
+    merged = []
+    for op in ops:
+        if merged and op[0] != "equal" and merged[-1][0] != "equal":
+            _, i1, _, j1, _ = merged[-1]
+            _, _, i2, _, j2 = op
+            tag = "replace" if i1 < i2 and j1 < j2 else op[0]
+            merged[-1] = (tag, i1, i2, j1, j2)
+        else:
+            merged.append(op)
+    return merged
+
+
+def group_opcodes(opcodes, n: int = 3):
+    """把操作码按上下文行数 n 分组为差异块，与 SequenceMatcher.get_grouped_opcodes 一致"""
+    codes = list(opcodes)
+    if not codes:
+        return
+    if codes[0][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2 - n), i2, max(j1, j2 - n), j2
+    if codes[-1][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)
+
+    nn = n + n
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == "equal" and i2 - i1 > nn:
+            group.append((tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == "equal"):
+        yield group
+
+
+def _range(start: int, stop: int) -> str:
+    length = stop - start
+    if length == 1:
+        return str(start + 1)
+    if not length:
+        start -= 1
+    return f"{start + 1},{length}"
+
+
+def unified_diff(f1: LineFile, f2: LineFile, n: int = 3) -> Iterator[str]:
+    opcodes = myers_diff(f1.keys, f2.keys)
+    first = True
+    for group in group_opcodes(opcodes, n):
+        if first:
+            yield f"--- {f1.path}"
+            yield f"+++ {f2.path}"
+            first = False
+        i1, i2 = group[0][1], group[-1][2]
+        j1, j2 = group[0][3], group[-1][4]
+        yield f"@@ -{_range(i1, i2)} +{_range(j1, j2)} @@"
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                for i in range(i1, i2):
+                    yield " " + f1.line(i)
+                continue
+            for i in range(i1, i2):
+                yield "-" + f1.line(i)
+            for j in range(j1, j2):
+                yield "+" + f2.line(j)
+
+
+def files_differ(f1_path: str, f1_enc: str, f2_path: str, f2_enc: str) -> bool:
+    """逐行同时读取两个文件，遇到第一处不同立即返回"""
+    lines1 = iter_lines(f1_path, f1_enc)
+    lines2 = iter_lines(f2_path, f2_enc)
+    for l1, l2 in zip_longest(lines1, lines2):
+        if l1 is None or l2 is None or l1[1].strip() != l2[1].strip():
+            return True
+    return False
+
+
+@click.command()
+@click.argument("f1_path", type=click.Path(exists=True, dir_okay=False))
+@click.argument("f2_path", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "-U",
+    "--unified",
+    "context",
+    help="Number of context lines. Default: 3.",
+    type=click.IntRange(min=0),
+    default=3,
+)
+@click.option(
+    "-q",
+    "--brief",
+    help="Only report whether the files differ, stopping at the first difference.",
+    is_flag=True,
+)
+@click.option(
+    "--no-cache",
+    help="Do not read or update the encoding detection cache.",
+    is_flag=True,
+)
+def main(f1_path: str, f2_path: str, context: int, brief: bool, no_cache: bool):
+    """比较 F1_PATH 和 F2_PATH 两个文本文件，输出统一格式的差异
+
+    忽略行首尾的空白；两个文件的编码可以不同。文件相同时退出码为 0，
+    不同时为 1。
+    """
+
+    f1_enc = detect_encoding(f1_path, not no_cache)
+    f2_enc = detect_encoding(f2_path, not no_cache)
 
+    if brief:
+        if files_differ(f1_path, f1_enc, f2_path, f2_enc):
+            click.echo(f"Files {f1_path} and {f2_path} differ")
+            sys.exit(1)
+        return
 
-def main():
-    line_number = 0
+    f1 = LineFile(f1_path, f1_enc)
+    f2 = LineFile(f2_path, f2_enc)
     differences = 0
-    f1_path = sys.argv[1]
-    f2_path = sys.argv[2]
-    f1 = open(f1_path, encoding=detect_encoding(f1_path))
-    f2 = open(f2_path, encoding=detect_encoding(f2_path))
-    for line1, line2 in zip(f1, f2):
-        line1 = line1.strip()
-        line2 = line2.strip()
-        line_number += 1
-        if(line1 != line2):
-            differences += 1
-            print(line_number, ':')
-            print("->", line1)
-            print("->", line2)
-    f1.close()
-    f2.close()
-    print("found", differences, "difference(s)")
-    return
+    try:
+        for line in unified_diff(f1, f2, context):
+            if line.startswith("@@"):
+                differences += 1
+            click.echo(line)
+    finally:
+        f1.close()
+        f2.close()
+    click.echo(f"found {differences} difference(s)", err=True)
+    if differences:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
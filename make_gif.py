@@ -1,20 +1,418 @@
-from sys import argv
+"""把一个文件夹中的图片按文件名的自然顺序合成为 GIF 动图
 
-if len(argv) == 1:
-    print("""用法：$ %0 <输入文件夹> <输出文件名> [时间间隔]""")
-    exit()
+各帧在工作进程中解码、缩放并量化编码，主进程按顺序逐帧写出。同时在途的
+帧数有上限，内存占用与输入图片的数量无关。
 
-import imageio
-from os import listdir
-from os.path import join
+--global-palette 模式先从部分帧统计颜色，用 NumPy 中位切分得到所有帧共用
+的调色板，之后每帧只需查表映射颜色；除第一帧外只保存与上一帧不同的矩形
+区域，区域内未变化的像素设为透明。屏幕录像这类大部分画面不动的输入可以
+显著减小文件并加快编码。
+"""
 
-indir = argv[1]
-outfile = argv[2]
+import hashlib
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import NamedTuple, Optional
 
-if len(argv) < 4:
-    duration = 0.1
-else:
-    duration = float(argv[3])
+import click
+import imageio.v3 as iio
+import numpy as np
+from PIL import GifImagePlugin, Image
 
-frames = [imageio.imread(join(indir, i)) for i in listdir(indir)]
-imageio.mimsave(outfile, frames, "GIF", duration=duration)
+from parallel import imap_bounded, resolve_jobs
+from walk import natural_key
+
+IMAGE_EXTENSIONS = frozenset(
+    {".png", ".jpg", ".jpeg", ".bmp", ".gif", ".tif", ".tiff", ".webp"}
+)
+
+# 全局调色板模式中每个颜色通道保留的位数，颜色查找表有 2 ** (3 * _BITS) 项
+_BITS = 6
+
+# 全局调色板中表示透明的索引，其余 255 个索引为颜色
+TRANSPARENT = 255
+
+# 每帧最多取多少个像素统计颜色
+_SAMPLE_PIXELS = 1 << 16
+
+# 全局调色板的颜色查找表，由 set_lut 设置；在工作进程初始化时传入一次，
+# 不随每帧的任务重复 pickle
+_lut: Optional[np.ndarray] = None
+
+
+def list_frames(indir: str) -> list[str]:
+    """按自然顺序列出 indir 中的图片文件"""
+    names = [
+        entry.name
+        for entry in os.scandir(indir)
+        if entry.is_file()
+        and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS
+    ]
+    names.sort(key=natural_key)
+    return [os.path.join(indir, name) for name in names]
+
+
+def parse_resize(value: Optional[str], size: tuple[int, int]) -> tuple[int, int]:
+    """把 --resize 的参数（50%、WIDTH、WIDTHxHEIGHT、xHEIGHT）换算为输出尺寸"""
+    width, height = size
+    if not value:
+        return size
+    if value.endswith("%"):
+        ratio = float(value[:-1]) / 100
+        return max(1, round(width * ratio)), max(1, round(height * ratio))
+    m = re.fullmatch(r"(\d*)(?:x(\d*))?", value)
+    if m is None or not any(m.groups()):
+        raise click.BadParameter(f"invalid size {value!r}", param_hint="--resize")
+    w, h = (int(i) if i else None for i in m.groups())
+    # 只给出一边时保持宽高比
+    if h is None:
+        h = max(1, round(height * w / width))
+    elif w is None:
+        w = max(1, round(width * h / height))
+    return w, h
+
+
+def read_image(path: str) -> Image.Image:
+    return Image.fromarray(iio.imread(path, index=0)).convert("RGB")
+
+
+def load_frame(path: str, size: tuple[int, int]) -> Image.Image:
+    im = read_image(path)
+    if im.size != size:
+        im = im.resize(size, Image.Resampling.LANCZOS)
+    return im
+
+
+class Frame(NamedTuple):
+    # 缩放后像素的哈希，用于识别相同的相邻帧
+    key: bytes
+    # 图像描述符和 LZW 数据，不含图形控制扩展
+    data: bytes
+    # 是否使用全局调色板中的透明索引
+    transparent: bool = False
+
+
+def encode_frame(path: str, size: tuple[int, int]) -> Frame:
+    """解码、缩放并量化一帧，返回编码好的 GIF 帧数据"""
+    im = load_frame(path, size)
+    key = hashlib.blake2b(im.tobytes(), digest_size=16).digest()
+    im = im.quantize(256)
+    data = b"".join(GifImagePlugin.getdata(im, include_color_table=True))
+    return Frame(key, data)
+
+
+def _color_keys(pixels: np.ndarray) -> np.ndarray:
+    """把 (..., 3) 的 RGB 像素截断为 _BITS 位后合并为查找表下标"""
+    p = pixels.astype(np.uint32) >> (8 - _BITS)
+    return (p[..., 0] << (2 * _BITS)) | (p[..., 1] << _BITS) | p[..., 2]
+
+
+def color_histogram(path: str, size: tuple[int, int]) -> np.ndarray:
+    """统计一帧中（抽样的）像素颜色的直方图"""
+    pixels = np.asarray(load_frame(path, size)).reshape(-1, 3)
+    step = max(1, len(pixels) // _SAMPLE_PIXELS)
+    keys = _color_keys(pixels[::step])
+    return np.bincount(keys, minlength=1 << (3 * _BITS)).astype(np.uint32)
+
+
+def _key_colors(keys: np.ndarray) -> np.ndarray:
+    """查找表下标对应的颜色（取截断区间的中点）"""
+    mask = (1 << _BITS) - 1
+    channels = [(keys >> (2 * _BITS)) & mask, (keys >> _BITS) & mask, keys & mask]
+    half = 1 << (7 - _BITS)
+    return (np.stack(channels, axis=-1) << (8 - _BITS)) + half
+
+
+def median_cut(histogram: np.ndarray, colors: int = 255) -> np.ndarray:
+    """按颜色直方图做中位切分，返回 (colors, 3) 的 uint8 调色板"""
+    keys = np.flatnonzero(histogram)
+    points = _key_colors(keys).astype(np.int64)
+    weights = histogram[keys].astype(np.int64)
+
+    boxes = [np.arange(len(keys))]
+    while len(boxes) < colors:
+        # 切分“最长边 × 像素数”最大的盒子
+        best, best_score, best_axis = None, 0, 0
+        for i, box in enumerate(boxes):
+            if len(box) < 2:
+                continue
+            extent = np.ptp(points[box], axis=0)
+            axis = int(extent.argmax())
+            score = int(extent[axis]) * int(weights[box].sum())
+            if score > best_score:
+                best, best_score, best_axis = i, score, axis
+        if best is None:
+            break
+        box = boxes.pop(best)
+        box = box[np.argsort(points[box, best_axis], kind="stable")]
+        cum = np.cumsum(weights[box])
+        cut = int(np.searchsorted(cum, cum[-1] / 2))
+        cut = min(max(cut, 1), len(box) - 1)
+        boxes += [box[:cut], box[cut:]]
+
+    palette = [np.average(points[box], axis=0, weights=weights[box]) for box in boxes]
+    return np.rint(palette).clip(0, 255).astype(np.uint8)
+
+
+def palette_lut(palette: np.ndarray) -> np.ndarray:
+    """为每个截断后的颜色预先求出调色板中最近的颜色"""
+    colors = _key_colors(np.arange(1 << (3 * _BITS))).astype(np.int32)
+    pal = palette.astype(np.int32)
+    lut = np.empty(len(colors), np.uint8)
+    for start in range(0, len(colors), 4096):
+        chunk = colors[start : start + 4096]
+        dist = ((chunk[:, None, :] - pal[None, :, :]) ** 2).sum(axis=-1)
+        lut[start : start + 4096] = dist.argmin(axis=1)
+    return lut
+
+
+def set_lut(lut: np.ndarray):
+    global _lut
+    _lut = lut
+
+
+def index_frame(path: str, size: tuple[int, int]) -> np.ndarray:
+    """解码、缩放一帧并通过查找表（见 set_lut）映射到全局调色板，返回索引数组"""
+    return _lut[_color_keys(np.asarray(load_frame(path, size)))]
+
+
+def build_palette(
+    paths: list[str], size: tuple[int, int], samples: int, jobs: int
+) -> np.ndarray:
+    """从均匀抽取的至多 samples 帧中统计颜色，生成全局调色板"""
+    step = max(1, len(paths) / samples)
+    sampled = [paths[int(i * step)] for i in range(min(samples, len(paths)))]
+    histogram = np.zeros(1 << (3 * _BITS), np.uint64)
+    for _, h in imap_bounded(partial(color_histogram, size=size), sampled, jobs):
+        histogram += h
+    return median_cut(histogram)
+
+
+class DeltaEncoder:
+    """把索引帧编码为相对于上一帧变化区域的 GIF 帧"""
+
+    def __init__(self):
+        self._previous: Optional[np.ndarray] = None
+
+    def encode(self, indices: np.ndarray) -> Optional[Frame]:
+        """返回编码好的帧；与上一帧完全相同时返回 None"""
+        previous, self._previous = self._previous, indices
+        if previous is None:
+            return self._frame(indices, 0, 0, False)
+
+        changed = indices != previous
+        rows = np.flatnonzero(changed.any(axis=1))
+        if not rows.size:
+            return None
+        cols = np.flatnonzero(changed.any(axis=0))
+        y0, y1 = rows[0], rows[-1] + 1
+        x0, x1 = cols[0], cols[-1] + 1
+        region = indices[y0:y1, x0:x1].copy()
+        region[~changed[y0:y1, x0:x1]] = TRANSPARENT
+        return self._frame(region, int(x0), int(y0), True)
+
+    @staticmethod
+    def _frame(region: np.ndarray, x: int, y: int, transparent: bool) -> Frame:
+        height, width = region.shape
+        im = Image.frombytes("P", (width, height), region.tobytes())
+        data = b"".join(GifImagePlugin.getdata(im, offset=(x, y)))
+        return Frame(b"", data, transparent)
+
+
+def _o16(i: int) -> bytes:
+    return i.to_bytes(2, "little")
+
+
+class GifWriter:
+    """逐帧写出 GIF 文件
+
+    没有给出 palette 时每帧带有自己的调色板。为了合并相同的相邻帧，内存中
+    保留一帧尚未写出，它的显示时长会累加后续相同帧的时长。先写到临时文件，
+    完成后才替换 path；中途出错时删除临时文件，不留下不完整的 GIF。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        size: tuple[int, int],
+        loop: int = 0,
+        palette: Optional[np.ndarray] = None,
+    ):
+        self._path = path
+        self._temp = path + "~~~~~"
+        self._file = open(self._temp, "wb")
+        self._pending: Optional[Frame] = None
+        self._duration = 0.0
+        self.frames = 0
+        self.dropped = 0
+
+        width, height = size
+        # 逻辑屏幕描述符
+        screen = b"GIF89a" + _o16(width) + _o16(height)
+        if palette is None:
+            self._file.write(screen + b"\x70\x00\x00")
+        else:
+            # 256 色的全局调色板，不足的部分补零
+            table = np.zeros((256, 3), np.uint8)
+            table[: len(palette)] = palette
+            self._file.write(screen + b"\xf7\x00\x00" + table.tobytes())
+        # NETSCAPE2.0 扩展，loop 为 0 表示无限循环
+        self._file.write(b"!\xff\x0bNETSCAPE2.0\x03\x01" + _o16(loop) + b"\x00")
+
+    def append(self, frame: Frame, duration: float, dedup: bool = False):
+        """追加一帧，duration 以毫秒为单位"""
+        if dedup and self._pending is not None and frame.key == self._pending.key:
+            self._duration += duration
+            self.dropped += 1
+            return
+        self._flush()
+        self._pending = frame
+        self._duration = duration
+
+    def extend(self, duration: float):
+        """画面没有变化，延长上一帧的显示时长"""
+        self._duration += duration
+        self.dropped += 1
+
+    def _flush(self):
+        if self._pending is None:
+            return
+        delay = max(1, round(self._duration / 10))
+        # 图形控制扩展：保留上一帧画面、显示时长（单位 10 毫秒）、透明索引
+        flags = 0x04 | self._pending.transparent
+        self._file.write(
+            b"!\xf9\x04" + bytes([flags]) + _o16(delay) + bytes([TRANSPARENT, 0])
+        )
+        self._file.write(self._pending.data)
+        self._pending = None
+        self.frames += 1
+
+    def close(self):
+        try:
+            self._flush()
+            self._file.write(b";")
+            self._file.close()
+            os.replace(self._temp, self._path)
+        except BaseException:
+            self.abort()
+            raise
+
+    def abort(self):
+        """放弃写出，删除临时文件"""
+        self._file.close()
+        if os.path.exists(self._temp):
+            os.remove(self._temp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+@click.command()
+@click.argument("indir", type=click.Path(exists=True, file_okay=False))
+@click.argument("outfile", type=click.Path(dir_okay=False))
+@click.argument("duration", type=click.FloatRange(min=0), default=0.1)
+@click.option(
+    "--fps",
+    help="Frames per second. Overrides DURATION.",
+    type=click.FloatRange(min=0, min_open=True),
+)
+@click.option(
+    "--resize",
+    help="Scale frames to 50%, WIDTH, xHEIGHT or WIDTHxHEIGHT. "
+    "Frames are scaled to the size of the first one by default.",
+)
+@click.option(
+    "--dedup",
+    help="Drop frames identical to the previous one, extending its duration.",
+    is_flag=True,
+)
+@click.option(
+    "--global-palette",
+    help="Use one palette shared by all frames and store only the changed "
+    "region of each frame. Identical frames are always merged.",
+    is_flag=True,
+)
+@click.option(
+    "--palette-samples",
+    help="Number of frames sampled to build the global palette. Default: 16.",
+    type=click.IntRange(min=1),
+    default=16,
+)
+@click.option(
+    "--loop",
+    help="Number of times to play, 0 for forever. Default: 0.",
+    type=click.IntRange(min=0, max=0xFFFF),
+    default=0,
+)
+@click.option(
+    "-j",
+    "--jobs",
+    help="Number of worker processes, 0 for all CPUs. Default: 0.",
+    type=click.IntRange(min=0),
+    default=0,
+)
+def main(
+    indir: str,
+    outfile: str,
+    duration: float,
+    fps: Optional[float],
+    resize: Optional[str],
+    dedup: bool,
+    global_palette: bool,
+    palette_samples: int,
+    loop: int,
+    jobs: int,
+):
+    """把 INDIR 中的图片按文件名的自然顺序合成为 GIF 动图 OUTFILE
+
+    DURATION 为每帧的时间间隔（秒），默认为 0.1。
+    """
+    paths = list_frames(indir)
+    if not paths:
+        raise click.ClickException(f"no images in {indir}")
+
+    size = parse_resize(resize, read_image(paths[0]).size)
+    delay = 1000 / fps if fps else duration * 1000
+
+    jobs = resolve_jobs(jobs)
+    executor = ProcessPoolExecutor
+    if global_palette:
+        palette = build_palette(paths, size, palette_samples, jobs)
+        lut = palette_lut(palette)
+        set_lut(lut)
+        executor = partial(ProcessPoolExecutor, initializer=set_lut, initargs=(lut,))
+        worker = partial(index_frame, size=size)
+    else:
+        palette = None
+        worker = partial(encode_frame, size=size)
+
+    # 同时在途的帧不超过 jobs * 2 个
+    frames = imap_bounded(worker, paths, jobs, window=jobs * 2, executor=executor)
+    with GifWriter(outfile, size, loop, palette) as writer, click.progressbar(
+        frames, length=len(paths), label="Encoding"
+    ) as bar:
+        if palette is None:
+            for _, frame in bar:
+                writer.append(frame, delay, dedup)
+        else:
+            encoder = DeltaEncoder()
+            for _, indices in bar:
+                frame = encoder.encode(indices)
+                if frame is None:
+                    writer.extend(delay)
+                else:
+                    writer.append(frame, delay)
+
+    click.echo(f"{writer.frames} frames written, {writer.dropped} dropped")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,614 @@ Copyright (c) 2019-2024 by Yuhao Gu. All rights reserved.
 
 import click
 
+# 各工作进程中已打开的 PdfReader，同一输入只解析一次
+_readers = {}
+
+
+def _open_reader(path: str):
+    from pypdf import PdfReader
+
+    reader = _readers.get(path)
+    if reader is None:
+        reader = _readers[path] = PdfReader(path)
+    return reader
+
+
+# 内容流中可以引用的资源类别
+_RESOURCE_CATEGORIES = (
+    "/Font",
+    "/XObject",
+    "/ExtGState",
+    "/ColorSpace",
+    "/Pattern",
+    "/Shading",
+    "/Properties",
+)
+
+
+def _content_names(operands, names: set):
+    """收集操作数中出现的所有名字（包括内联图片参数中的）"""
+    from pypdf.generic import ArrayObject, DictionaryObject, NameObject
+
+    for operand in operands:
+        if isinstance(operand, NameObject):
+            names.add(operand)
+        elif isinstance(operand, (ArrayObject, list)):
+            _content_names(operand, names)
+        elif isinstance(operand, (DictionaryObject, dict)):
+            _content_names(operand.values(), names)
+
+
+def prune_resources(page):
+    """从页面的资源字典中去掉内容流没有引用的字体、图片等资源
+
+    扫描件等文档常让所有页面共用一个包含全部资源的字典，拆分后每个文件都会
+    带上全部资源。这里按名字保留内容流中出现过的资源，表单、图案等资源内部
+    的引用不受影响。
+    """
+    from pypdf.generic import DictionaryObject, NameObject
+
+    resources = page.get("/Resources")
+    if resources is None:
+        return
+    resources = resources.get_object()
+
+    names = set()
+    contents = page.get_contents()
+    if contents is not None:
+        for operands, _ in contents.operations:
+            _content_names(operands, names)
+
+    pruned = DictionaryObject()
+    for key, value in resources.items():
+        if key in _RESOURCE_CATEGORIES:
+            category = value.get_object()
+            kept = DictionaryObject(
+                (name, ref) for name, ref in category.items() if name in names
+            )
+            if kept:
+                pruned[NameObject(key)] = kept
+        else:
+            pruned[NameObject(key)] = value
+    page[NameObject("/Resources")] = pruned
+
+
+def _split_ranges(input: str, prune: bool, ranges: list[tuple[int, int, str]]) -> int:
+    """把 input 的页面范围 [start, stop) 分别写入对应文件，返回写出的页数"""
+    from pypdf import PdfWriter
+
+    import instrument
+
+    with instrument.phase("parse"):
+        reader = _open_reader(input)
+    pages = 0
+    for start, stop, out_path in ranges:
+        pdf_writer = PdfWriter()
+        with instrument.phase("copy"):
+            if prune:
+                for i in range(start, stop):
+                    page = reader.get_page(i)
+                    with instrument.phase("prune"):
+                        prune_resources(page)
+                    pdf_writer.add_page(page)
+            elif stop - start == 1:
+                pdf_writer.add_page(reader.get_page(start))
+            else:
+                pdf_writer.append(reader, pages=(start, stop))
+        with instrument.phase("write"), open(out_path, "wb") as f:
+            pdf_writer.write(f)
+            instrument.add("bytes_written", f.tell())
+        instrument.add("files")
+        pages += stop - start
+    instrument.add("pages", pages)
+    return pages
+
+
+class StreamingPdfWriter:
+    """边读边写的 PDF 合并器
+
+    每个输入文件的页面及其引用的对象立即写入输出，写完一个输入即可释放它，
+    内存中只保留对象偏移和去重用的摘要。内容相同的流对象（字体、图片、ICC
+    配置等）只写一次，后续引用直接指向已写出的对象。不复制书签、表单等
+    文档级结构。
+    """
+
+    def __init__(self, fp):
+        self._fp = fp
+        # 下标为对象号
+        self._offsets = [0]
+        self._page_refs = []
+        # 流对象内容摘要 -> 已写出的对象号
+        self._streams = {}
+        self.deduplicated = 0
+
+        fp.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        self._pages = self._reserve()
+
+    def _reserve(self) -> int:
+        self._offsets.append(0)
+        return len(self._offsets) - 1
+
+    def _write(self, num: int, obj):
+        self._offsets[num] = self._fp.tell()
+        self._fp.write(f"{num} 0 obj\n".encode())
+        obj.write_to_stream(self._fp)
+        self._fp.write(b"\nendobj\n")
+
+    def _digest(self, ref, memo: dict, visiting: set):
+        """对象及其引用的全部对象的内容摘要，存在循环引用时返回 None"""
+        import hashlib
+        from io import BytesIO
+
+        from pypdf.generic import (
+            ArrayObject,
+            DictionaryObject,
+            IndirectObject,
+            StreamObject,
+        )
+
+        key = ref.idnum, ref.generation
+        if key in memo:
+            return memo[key]
+        if key in visiting:
+            return None
+        visiting.add(key)
+
+        h = hashlib.blake2b(digest_size=20)
+
+        def feed(obj) -> bool:
+            if isinstance(obj, IndirectObject):
+                digest = self._digest(obj, memo, visiting)
+                if digest is None:
+                    return False
+                h.update(b"R" + digest)
+            elif isinstance(obj, DictionaryObject):
+                h.update(b"<<")
+                for k in sorted(obj):
+                    if k == "/Length" and isinstance(obj, StreamObject):
+                        continue
+                    h.update(k.encode() + b" ")
+                    if not feed(dict.__getitem__(obj, k)):
+                        return False
+                h.update(b">>")
+                if isinstance(obj, StreamObject):
+                    h.update(b"stream%d:" % len(obj._data))
+                    h.update(obj._data)
+            elif isinstance(obj, ArrayObject):
+                h.update(b"[")
+                for item in obj:
+                    if not feed(item):
+                        return False
+                h.update(b"]")
+            else:
+                buf = BytesIO()
+                obj.write_to_stream(buf)
+                h.update(type(obj).__name__.encode() + buf.getvalue() + b" ")
+            return True
+
+        ok = feed(ref.get_object())
+        visiting.discard(key)
+        memo[key] = digest = h.digest() if ok else None
+        return digest
+
+    def add_reader(self, reader):
+        """写出 reader 的全部页面"""
+        from pypdf.generic import (
+            ArrayObject,
+            DictionaryObject,
+            IndirectObject,
+            NameObject,
+            StreamObject,
+        )
+
+        # reader 中的 (对象号, 代数) -> 输出中的对象号
+        mapping = {}
+        memo = {}
+        pending = []
+
+        def ref_to(ref) -> IndirectObject:
+            key = ref.idnum, ref.generation
+            num = mapping.get(key)
+            if num is None:
+                obj = ref.get_object()
+                digest = None
+                if isinstance(obj, StreamObject):
+                    digest = self._digest(ref, memo, set())
+                    num = self._streams.get(digest) if digest else None
+                    if num is not None:
+                        self.deduplicated += 1
+                if num is None:
+                    num = self._reserve()
+                    if digest is not None:
+                        self._streams[digest] = num
+                    pending.append((obj, num))
+                mapping[key] = num
+            return IndirectObject(num, 0, None)
+
+        def convert(obj):
+            if isinstance(obj, IndirectObject):
+                return ref_to(obj)
+            if isinstance(obj, StreamObject):
+                new = StreamObject()
+                new._data = obj._data
+                for k, v in dict.items(obj):
+                    if k != "/Length":
+                        new[k] = convert(v)
+                return new
+            if isinstance(obj, DictionaryObject):
+                new = DictionaryObject()
+                for k, v in dict.items(obj):
+                    new[k] = convert(v)
+                return new
+            if isinstance(obj, ArrayObject):
+                return ArrayObject(convert(v) for v in obj)
+            return obj
+
+        pages = []
+        for page in reader.pages:
+            num = self._reserve()
+            ref = page.indirect_reference
+            if ref is not None:
+                mapping[ref.idnum, ref.generation] = num
+            pages.append((page, num))
+
+        for page, num in pages:
+            new = DictionaryObject()
+            # pypdf 读取时已把继承的 /Resources、/MediaBox 等属性放到页面上
+            for k, v in dict.items(page):
+                if k != "/Parent":
+                    new[k] = convert(v)
+            new[NameObject("/Parent")] = IndirectObject(self._pages, 0, None)
+            self._write(num, new)
+            self._page_refs.append(num)
+            while pending:
+                obj, obj_num = pending.pop()
+                self._write(obj_num, convert(obj))
+
+    def close(self):
+        from pypdf.generic import (
+            ArrayObject,
+            DictionaryObject,
+            IndirectObject,
+            NameObject,
+            NumberObject,
+        )
+
+        self._write(
+            self._pages,
+            DictionaryObject(
+                {
+                    NameObject("/Type"): NameObject("/Pages"),
+                    NameObject("/Kids"): ArrayObject(
+                        IndirectObject(num, 0, None) for num in self._page_refs
+                    ),
+                    NameObject("/Count"): NumberObject(len(self._page_refs)),
+                }
+            ),
+        )
+        root = self._reserve()
+        self._write(
+            root,
+            DictionaryObject(
+                {
+                    NameObject("/Type"): NameObject("/Catalog"),
+                    NameObject("/Pages"): IndirectObject(self._pages, 0, None),
+                }
+            ),
+        )
+
+        xref = self._fp.tell()
+        lines = [f"xref\n0 {len(self._offsets)}\n0000000000 65535 f \n"]
+        lines += [f"{offset:010d} 00000 n \n" for offset in self._offsets[1:]]
+        lines.append(
+            f"trailer\n<< /Size {len(self._offsets)} /Root {root} 0 R >>\n"
+            f"startxref\n{xref}\n%%EOF\n"
+        )
+        self._fp.write("".join(lines).encode())
+
+
+def _image_format(image_data: bytes) -> str:
+    if image_data.startswith(b"\x89\x50\x4e\x47"):
+        return "png"
+    if image_data.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    if image_data.startswith(b"\x47\x49\x46"):
+        return "gif"
+    if image_data.startswith(b"\x42\x4d"):
+        return "bmp"
+    if image_data.startswith(b"\x25\x50\x44\x46"):
+        return "pdf"
+    return "img"
+
+
+# 可以原样复制的图片编码
+_RAW_IMAGE_FILTERS = {"/DCTDecode": "jpg", "/JPXDecode": "jp2"}
+
+# 各工作进程中已提取的图片对象 (输入, 对象号, 代数) -> (摘要, 扩展名, 名字后缀)
+_extracted = {}
+
+
+def _image_xobject(page, image_id):
+    """返回 page.images 中 image_id 对应的图片流对象，内联图片返回 None"""
+    if isinstance(image_id, str):
+        if image_id.startswith("~"):
+            return None
+        image_id = [image_id]
+    obj = page
+    for name in image_id:
+        obj = obj["/Resources"]["/XObject"][name]
+    return obj
+
+
+def _extract_pages(
+    input: str, output: str, raw: bool, pages: range
+) -> list[tuple[str, str, str, str]]:
+    """提取 pages 中的图片，返回 [(页码-序号, 摘要, 扩展名, 名字)]
+
+    图片以摘要命名写入 output 下的隐藏文件，由主进程改名为第一次出现的
+    位置。同一个图片对象只解码一次。
+    """
+    import hashlib
+    import os
+
+    reader = _open_reader(input)
+    results = []
+    for pageno in pages:
+        page = reader.get_page(pageno)
+        for i, image_id in enumerate(page.images.keys()):
+            xobj = _image_xobject(page, image_id)
+            ref = getattr(xobj, "indirect_reference", None)
+            key = (input, ref.idnum, ref.generation) if ref is not None else None
+            base = (image_id if isinstance(image_id, str) else image_id[-1])[1:]
+
+            if key in _extracted:
+                digest, ext, suffix = _extracted[key]
+            else:
+                filters = xobj.get("/Filter") if xobj is not None else None
+                if isinstance(filters, list) and len(filters) == 1:
+                    filters = filters[0]
+                if raw and filters in _RAW_IMAGE_FILTERS:
+                    data = xobj._data
+                    ext = _RAW_IMAGE_FILTERS[filters]
+                    suffix = "." + ext
+                else:
+                    image = page.images[image_id]
+                    data = image.data
+                    ext = _image_format(data)
+                    suffix = image.name[len(base) :]
+                digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+
+                path = os.path.join(output, f".{digest}.{ext}")
+                if not os.path.exists(path):
+                    tmp = f"{path}.{os.getpid()}"
+                    with open(tmp, "wb") as f:
+                        f.write(data)
+                    os.replace(tmp, path)
+                if key is not None:
+                    _extracted[key] = digest, ext, suffix
+
+            results.append((f"{pageno+1}-{i+1}", digest, ext, base + suffix))
+    return results
+
+
+# 纸张大小（宽, 高），单位为点
+_PAPER_SIZES = {
+    "A2": (1191, 1684),
+    "A3": (842, 1191),
+    "A4": (595, 842),
+    "A5": (420, 595),
+    "A6": (298, 420),
+    "LETTER": (612, 792),
+    "LEGAL": (612, 1008),
+}
+
+
+def _sheet_size(
+    paper: str, orientation: str, cols: int, rows: int, page_size: tuple[float, float]
+) -> tuple[float, float]:
+    """按方向返回纸张的宽高；auto 时选使页面放大倍数更大的方向"""
+    width, height = _PAPER_SIZES[paper]
+    if orientation == "portrait":
+        return width, height
+    if orientation == "landscape":
+        return height, width
+
+    def scale(w, h):
+        return min(w / cols / page_size[0], h / rows / page_size[1])
+
+    if scale(height, width) > scale(width, height):
+        return height, width
+    return width, height
+
+
+def _page_box(page) -> tuple[float, float, float, float, int]:
+    box = page.cropbox
+    return (
+        float(box.left),
+        float(box.bottom),
+        float(box.right),
+        float(box.top),
+        page.rotation % 360,
+    )
+
+
+def _placement(page_box, cell: tuple[float, float, float, float]):
+    """把页面（考虑 /Rotate）等比缩放后居中放入 cell 的变换矩阵"""
+    from pypdf import Transformation
+
+    x0, y0, x1, y1, rotation = page_box
+    cx, cy, cw, ch = cell
+    t = Transformation().translate(-x0, -y0).rotate(-rotation)
+    xs, ys = zip(*(t.apply_on(p) for p in ((0, 0), (x1 - x0, 0), (0, y1 - y0))))
+    xs, ys = xs + (xs[1] + xs[2] - xs[0],), ys + (ys[1] + ys[2] - ys[0],)
+    w, h = max(xs) - min(xs), max(ys) - min(ys)
+    scale = min(cw / w, ch / h)
+    t = t.translate(-min(xs), -min(ys)).scale(scale, scale)
+    return t.translate(cx + (cw - w * scale) / 2, cy + (ch - h * scale) / 2)
+
+
+def _page_form(page, writer):
+    """把页面转换为表单 XObject 并加入 writer
+
+    只有一个内容流时直接沿用其压缩后的数据。
+    """
+    from pypdf.generic import (
+        ArrayObject,
+        DecodedStreamObject,
+        FloatObject,
+        NameObject,
+        StreamObject,
+    )
+
+    contents = page.get("/Contents")
+    contents = contents.get_object() if contents is not None else None
+    if isinstance(contents, StreamObject):
+        form = StreamObject()
+        form._data = contents._data
+        for key in ("/Filter", "/DecodeParms"):
+            if key in contents:
+                form[NameObject(key)] = contents.raw_get(key).clone(writer)
+    else:
+        form = DecodedStreamObject()
+        data = page.get_contents()
+        form.set_data(data.get_data() if data is not None else b"")
+        form = form.flate_encode()
+
+    x0, y0, x1, y1, _ = _page_box(page)
+    form[NameObject("/Type")] = NameObject("/XObject")
+    form[NameObject("/Subtype")] = NameObject("/Form")
+    form[NameObject("/BBox")] = ArrayObject(FloatObject(v) for v in (x0, y0, x1, y1))
+    if "/Resources" in page:
+        form[NameObject("/Resources")] = page.raw_get("/Resources").clone(writer)
+    return writer._add_object(form)
+
+
+def _impose_sheets(
+    input: str,
+    sheet_size: tuple[float, float],
+    cols: int,
+    rows: int,
+    task: tuple[str, list[list]],
+) -> int:
+    """把若干张纸的拼版写入 out_path，返回写出的纸张数
+
+    sheets 中每项为一张纸上按从左到右、从上到下排列的页码，None 为空位。
+    """
+    from pypdf import PdfWriter
+    from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+    out_path, sheets = task
+    reader = _open_reader(input)
+    writer = PdfWriter()
+    width, height = sheet_size
+    cw, ch = width / cols, height / rows
+    forms = {}
+
+    for sheet in sheets:
+        xobjects = DictionaryObject()
+        ops = []
+        for cell, pageno in enumerate(sheet):
+            if pageno is None:
+                continue
+            page = reader.get_page(pageno)
+            if pageno not in forms:
+                forms[pageno] = _page_form(page, writer)
+            name = NameObject(f"/P{pageno}")
+            xobjects[name] = forms[pageno]
+            col, row = cell % cols, cell // cols
+            t = _placement(_page_box(page), (col * cw, height - (row + 1) * ch, cw, ch))
+            matrix = " ".join(f"{v:.6f}" for v in t.ctm)
+            ops.append(f"q {matrix} cm {name} Do Q")
+
+        sheet_page = writer.add_blank_page(width, height)
+        sheet_page[NameObject("/Resources")] = DictionaryObject(
+            {NameObject("/XObject"): xobjects}
+        )
+        content = DecodedStreamObject()
+        content.set_data("\n".join(ops).encode())
+        sheet_page[NameObject("/Contents")] = writer._add_object(content)
+
+    with open(out_path, "wb") as f:
+        writer.write(f)
+    return len(sheets)
+
+
+def impose(
+    input: str,
+    output: str,
+    cols: int,
+    rows: int,
+    paper: str = "A4",
+    orientation: str = "auto",
+    booklet: bool = False,
+    jobs: int = 0,
+):
+    """N-up 拼版：每张纸按 cols x rows 排列 INPUT 的页面
+
+    纸张分段交给多个工作进程各自写成临时文件，再用 StreamingPdfWriter
+    顺序合并，相同的表单和图片在合并时去重。
+    """
+    import math
+    import os
+    import os.path as osp
+    import shutil
+    import tempfile
+    from functools import partial
+    from shlex import quote
+
+    from pypdf import PdfReader
+
+    from parallel import batched, imap_bounded, resolve_jobs
+
+    reader = PdfReader(input)
+    num_pages = reader.get_num_pages()
+    if num_pages == 0:
+        raise click.ClickException(f"{input} 没有页面")
+    x0, y0, x1, y1, rotation = _page_box(reader.get_page(0))
+    first = (y1 - y0, x1 - x0) if rotation in (90, 270) else (x1 - x0, y1 - y0)
+    sheet_size = _sheet_size(paper, orientation, cols, rows, first)
+    del reader
+
+    per_sheet = cols * rows
+    if booklet:
+        # 骑马钉：总页数补齐为 4 的倍数，每张纸正面为 (末, 首)，背面为 (次, 次末)
+        n = math.ceil(num_pages / 4) * 4
+        order = []
+        for s in range(n // 4):
+            order += [n - 1 - 2 * s, 2 * s, 2 * s + 1, n - 2 - 2 * s]
+    else:
+        n = math.ceil(num_pages / per_sheet) * per_sheet
+        order = list(range(n))
+    order = [i if i < num_pages else None for i in order]
+    sheets = [order[i : i + per_sheet] for i in range(0, len(order), per_sheet)]
+
+    jobs = resolve_jobs(jobs)
+    batch = max(1, math.ceil(len(sheets) / (jobs * 4)))
+    tmpdir = tempfile.mkdtemp(dir=osp.dirname(osp.abspath(output)))
+    try:
+        tasks = [
+            (osp.join(tmpdir, f"{i}.pdf"), part)
+            for i, part in enumerate(batched(sheets, batch))
+        ]
+        with click.progressbar(length=len(sheets), label="处理页面...") as bar:
+            for _, count in imap_bounded(
+                partial(_impose_sheets, input, sheet_size, cols, rows), tasks, jobs
+            ):
+                bar.update(count)
+
+        click.echo("\n输出 " + quote(output))
+        if len(tasks) == 1:
+            os.replace(tasks[0][0], output)
+        else:
+            with open(output, "wb") as f:
+                pdf_writer = StreamingPdfWriter(f)
+                for path, _ in tasks:
+                    pdf_writer.add_reader(PdfReader(path))
+                pdf_writer.close()
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    click.echo("DONE")
+
 
 @click.group()
 @click.version_option(__version__, message=__copyright__)
@@ -14,6 +622,27 @@ def cli():
     """基于 pypdf 的 PDF 文件实用工具"""
 
 
+def _instrument_options(func):
+    """split 和 merge 共用的统计选项"""
+    func = click.option(
+        "--profile",
+        help="把所有进程的 cProfile 数据写入该文件",
+        type=click.Path(dir_okay=False, writable=True),
+    )(func)
+    func = click.option(
+        "--stats-json",
+        help="把各阶段耗时和计数以 JSON 格式写入该文件",
+        type=click.File("w"),
+    )(func)
+    func = click.option(
+        "--stats",
+        "show_stats",
+        help="结束时输出各阶段耗时和吞吐量",
+        is_flag=True,
+    )(func)
+    return func
+
+
 @cli.command()
 @click.argument(
     "input",
@@ -39,46 +668,80 @@ def cli():
     help="拆分为所有单页",
     is_flag=True,
 )
-def split(input: str, seperators: list[int], output: str | None, all: bool):
-    """将 INPUT 按 SEPERATORS 给出的页码（首页为1）拆分为多个文件"""
+@click.option(
+    "-p",
+    "--prune",
+    help="去掉各页面没有引用的字体、图片等资源",
+    is_flag=True,
+)
+@click.option(
+    "-j",
+    "--jobs",
+    help="工作进程数，0 表示 CPU 核数，默认为 0",
+    type=click.IntRange(min=0),
+    default=0,
+)
+@_instrument_options
+def split(
+    input: str,
+    seperators: list[int],
+    output: str | None,
+    all: bool,
+    prune: bool,
+    jobs: int,
+    show_stats: bool,
+    stats_json,
+    profile: str | None,
+):
+    """将 INPUT 按 SEPERATORS 给出的页码（首页为1）拆分为多个文件
+
+    各输出文件分给多个工作进程写出，每个进程只解析一次 INPUT。
+    """
 
+    import math
     import os
     import os.path as osp
+    from functools import partial
 
-    from pypdf import PdfReader, PdfWriter
+    from pypdf import PdfReader
+
+    import instrument
+    from instrument import imap_bounded
+    from parallel import batched, resolve_jobs
+
+    click.get_current_context().with_resource(
+        instrument.session(show_stats, stats_json, profile)
+    )
 
     if output is None:
         output = osp.splitext(input)[0]
     os.makedirs(output, exist_ok=True)
 
-    pdf_reader = PdfReader(input)
-    num_pages = pdf_reader.get_num_pages()
+    with instrument.phase("parse"):
+        num_pages = PdfReader(input).get_num_pages()
+    if instrument.enabled():
+        instrument.add("bytes_read", os.path.getsize(input))
 
     if all:
-        for i in range(num_pages):
-            out_path = osp.join(output, f"{i+1}.pdf")
-            click.echo(out_path + " ...", nl=False)
-            with open(out_path, "wb") as f:
-                pdf_writer = PdfWriter()
-                pdf_writer.add_page(pdf_reader.get_page(i))
-                pdf_writer.write(f)
-            click.echo(" OK")
-        return
+        ranges = [(i, i + 1, osp.join(output, f"{i+1}.pdf")) for i in range(num_pages)]
+    else:
+        # 每个分隔页码是新一部分的第一页
+        seps = {i - 1 for i in seperators if 1 < i <= num_pages}
+        seps.add(num_pages)
+        ranges = []
+        last = 0
+        for sep in sorted(seps):
+            ranges.append((last, sep, osp.join(output, f"{last + 1}-{sep}.pdf")))
+            last = sep
 
-    seps = {i for i in seperators if 0 < i < num_pages}
-    seps.add(num_pages)
-    seperators = sorted(seps)
-    last = 0
-    for sep in seperators:
-        sep -= 1
-        out_path = osp.join(output, f"{last + 1}-{sep}.pdf")
-        click.echo(out_path + " ...", nl=False)
-        with open(out_path, "wb") as f:
-            pdf_writer = PdfWriter()
-            pdf_writer.append(pdf_reader, pages=(last, sep))
-            pdf_writer.write(f)
-        click.echo(" OK")
-        last = sep
+    jobs = resolve_jobs(jobs)
+    # 每个任务包含若干输出文件，既能均匀分配又不至于频繁跨进程通信
+    batch = max(1, math.ceil(len(ranges) / (jobs * 8)))
+    with click.progressbar(length=num_pages, label="拆分页面...") as bar:
+        for _, pages in imap_bounded(
+            partial(_split_ranges, input, prune), batched(ranges, batch), jobs
+        ):
+            bar.update(pages)
     click.echo("DONE")
 
 
@@ -96,10 +759,25 @@ def split(input: str, seperators: list[int], output: str | None, all: bool):
     type=click.Path(exists=False, writable=True, dir_okay=False),
     default="merge-output.pdf",
 )
-def merge(inputs: tuple[str], output: str):
+@click.option(
+    "-l",
+    "--low-memory",
+    help="边读边写并合并相同的流对象，不保留书签等文档级结构",
+    is_flag=True,
+)
+@_instrument_options
+def merge(
+    inputs: tuple[str],
+    output: str,
+    low_memory: bool,
+    show_stats: bool,
+    stats_json,
+    profile: str | None,
+):
     """将 INPUTS 中的页面按指定顺序合并为一个文件
 
-    如果 INPUTS 中包含目录，则将目录中的 .pdf 后缀文件按字典序合并输出
+    如果 INPUTS 中包含目录，则将目录中的 .pdf 后缀文件按文件名的自然顺序
+    合并输出
     """
 
     import os
@@ -108,27 +786,59 @@ def merge(inputs: tuple[str], output: str):
 
     from pypdf import PdfReader, PdfWriter
 
-    pdf_writer = PdfWriter()
+    import instrument
+    from walk import natural_key
+
+    click.get_current_context().with_resource(
+        instrument.session(show_stats, stats_json, profile)
+    )
 
+    paths = []
     for input in inputs:
         if os.path.isdir(input):
             files = [f for f in os.listdir(input) if f.endswith(".pdf")]
-            files.sort()
-            for file in files:
-                path = osp.join(input, file)
+            files.sort(key=natural_key)
+            paths += [osp.join(input, file) for file in files]
+        else:
+            paths.append(input)
+    if instrument.enabled():
+        instrument.add("files", len(paths))
+        instrument.add("bytes_read", sum(map(osp.getsize, paths)))
+
+    if low_memory:
+        click.echo("输出 " + quote(output))
+        with open(output, "wb") as f:
+            pdf_writer = StreamingPdfWriter(f)
+            for path in paths:
                 click.echo(path + " ...", nl=False)
-                pdf_reader = PdfReader(path)
-                pdf_writer.append(pdf_reader)
+                with instrument.phase("parse"):
+                    pdf_reader = PdfReader(path)
+                with instrument.phase("copy"):
+                    pdf_writer.add_reader(pdf_reader)
+                instrument.add("pages", len(pdf_reader.pages))
                 click.echo(" OK")
-        else:
-            click.echo(input + " ...", nl=False)
-            pdf_reader = PdfReader(input)
+            with instrument.phase("write"):
+                pdf_writer.close()
+            instrument.add("bytes_written", f.tell())
+        click.echo(f"\n去重 {pdf_writer.deduplicated} 个流对象")
+        click.echo("DONE")
+        return
+
+    pdf_writer = PdfWriter()
+
+    for path in paths:
+        click.echo(path + " ...", nl=False)
+        with instrument.phase("parse"):
+            pdf_reader = PdfReader(path)
+        with instrument.phase("copy"):
             pdf_writer.append(pdf_reader)
-            click.echo(" OK")
+        instrument.add("pages", len(pdf_reader.pages))
+        click.echo(" OK")
 
     click.echo("\n输出 " + quote(output))
-    with open(output, "wb") as f:
+    with instrument.phase("write"), open(output, "wb") as f:
         pdf_writer.write(f)
+        instrument.add("bytes_written", f.tell())
     click.echo("DONE")
 
 
@@ -145,48 +855,71 @@ def merge(inputs: tuple[str], output: str):
     help="输出目录",
     type=click.Path(exists=False, writable=True, file_okay=False),
 )
-def extract_images(input: str, output: str | None):
-    """提取 INPUT 中的图片到目录"""
+@click.option(
+    "-r",
+    "--raw",
+    help="直接复制 JPEG、JPEG 2000 图片的数据，不解码再编码",
+    is_flag=True,
+)
+@click.option(
+    "-j",
+    "--jobs",
+    help="工作进程数，0 表示 CPU 核数，默认为 0",
+    type=click.IntRange(min=0),
+    default=0,
+)
+def extract_images(input: str, output: str | None, raw: bool, jobs: int):
+    """提取 INPUT 中的图片到目录
+
+    内容相同的图片只写出一次，文件以第一次出现的位置（页码-序号）命名；
+    names.json 记录每一处图片对应的文件和它在 PDF 中的名字。
+    """
 
     import json
+    import math
     import os
     import os.path as osp
+    from functools import partial
     from shlex import quote
 
     from pypdf import PdfReader
 
+    from parallel import imap_bounded, resolve_jobs
+
     if output is None:
         output = osp.splitext(input)[0]
     os.makedirs(output, exist_ok=True)
 
-    pdf_reader = PdfReader(input)
-    num_pages = pdf_reader.get_num_pages()
-
-    def recongnize_format(image_data: bytes) -> str:
-        if image_data.startswith(b"\x89\x50\x4e\x47"):
-            return "png"
-        if image_data.startswith(b"\xff\xd8\xff"):
-            return "jpg"
-        if image_data.startswith(b"\x47\x49\x46"):
-            return "gif"
-        if image_data.startswith(b"\x42\x4d"):
-            return "bmp"
-        if image_data.startswith(b"\x25\x50\x44\x46"):
-            return "pdf"
-        return "img"
-
-    names = dict[str, str]()
-    for pageno in range(num_pages):
-        page = pdf_reader.get_page(pageno)
-        for i, img in enumerate(page.images):
-            name = f"{pageno+1}-{i+1}.{recongnize_format(img.data)}"
-            names[name] = img.name
-            click.echo(name + " ...", nl=False)
-            with open(osp.join(output, name), "wb") as f:
-                f.write(img.data)
-            click.echo(" OK")
-
-    click.echo("\n输出 " + quote(osp.join(output, "names.json")))
+    num_pages = PdfReader(input).get_num_pages()
+    jobs = resolve_jobs(jobs)
+    batch = max(1, math.ceil(num_pages / (jobs * 8)))
+    batches = [range(i, min(i + batch, num_pages)) for i in range(0, num_pages, batch)]
+
+    # 图片摘要 -> 输出文件名
+    files = dict[str, str]()
+    names = dict[str, dict[str, str]]()
+    with click.progressbar(length=num_pages, label="提取图片...") as bar:
+        for pages, results in imap_bounded(
+            partial(_extract_pages, input, output, raw), batches, jobs
+        ):
+            for occurrence, digest, ext, name in results:
+                file = files.get(digest)
+                if file is None:
+                    file = files[digest] = f"{occurrence}.{ext}"
+                    os.replace(
+                        osp.join(output, f".{digest}.{ext}"), osp.join(output, file)
+                    )
+                names[occurrence] = {"file": file, "name": name}
+            bar.update(len(pages))
+
+    # 不同进程可能重复写出了同一张图片
+    for digest, file in files.items():
+        tmp = osp.join(output, f".{digest}.{osp.splitext(file)[1][1:]}")
+        if osp.exists(tmp):
+            os.remove(tmp)
+
+    click.echo(f"\n共 {len(names)} 处图片，写出 {len(files)} 个文件")
+    click.echo("输出 " + quote(osp.join(output, "names.json")))
     with open(osp.join(output, "names.json"), "w") as f:
         json.dump(names, f, indent=2)
     click.echo("DONE")
@@ -199,92 +932,327 @@ def extract_attachments():
     raise NotImplementedError
 
 
+def _batch_options(func):
+    """encrypt 和 decrypt 共用的参数"""
+    func = click.option(
+        "-j",
+        "--jobs",
+        help="工作进程数，0 表示 CPU 核数，默认为 0",
+        type=click.IntRange(min=0),
+        default=0,
+    )(func)
+    func = click.option(
+        "--in-place",
+        help="直接覆盖原文件，不能与 -o 同时使用",
+        is_flag=True,
+    )(func)
+    func = click.option(
+        "-o",
+        "--output",
+        "output",
+        help="输出目录，不指定时必须给出 --in-place",
+        type=click.Path(exists=False, writable=True, file_okay=False),
+    )(func)
+    func = click.argument(
+        "inputs",
+        nargs=-1,
+        required=True,
+        type=click.Path(exists=True, readable=True),
+    )(func)
+    return func
+
+
+def _run_batch(
+    func,
+    inputs: tuple[str],
+    output: str | None,
+    in_place: bool,
+    jobs: int,
+    label: str,
+):
+    """对 INPUTS 中的文件（目录则递归查找 .pdf 文件）并行执行 func(src, dst)
+
+    func 返回 None 表示成功，否则返回失败原因。密码输错或算法选错都会让
+    原文件无法恢复，因此只有明确给出 --in-place 时才覆盖原文件。
+    """
+    import os
+    import os.path as osp
+    from collections import Counter
+
+    from parallel import imap_bounded, resolve_jobs
+    from walk import walk
+
+    if in_place == (output is not None):
+        raise click.UsageError("需要指定 -o 或 --in-place 中的一个")
+
+    tasks = []
+    for input in inputs:
+        if osp.isdir(input):
+            for entry in walk(input, ignore=False):
+                if entry.name.lower().endswith(".pdf"):
+                    rel = osp.relpath(entry.path, input)
+                    tasks.append(
+                        (entry.path, osp.join(output, rel) if output else None)
+                    )
+        else:
+            dst = osp.join(output, osp.basename(input)) if output else None
+            tasks.append((input, dst))
+
+    # 检查所有任务之后再开始，避免处理到一半才发现冲突
+    if output is not None:
+        seen = {}
+        for src, dst in tasks:
+            key = osp.normcase(osp.abspath(dst))
+            if key == osp.normcase(osp.abspath(src)):
+                raise click.UsageError(f"{dst} 会覆盖输入文件，请使用 --in-place")
+            if key in seen:
+                raise click.UsageError(f"{seen[key]} 和 {src} 都会输出到 {dst}")
+            seen[key] = src
+
+    counter = Counter()
+    with click.progressbar(length=len(tasks), label=label) as bar:
+        for (src, _), error in imap_bounded(func, tasks, resolve_jobs(jobs)):
+            if error is None:
+                counter["OK"] += 1
+            else:
+                counter[error] += 1
+                click.echo(f"\n{error} {src}", err=True)
+            bar.update(1)
+
+    click.echo()
+    for key, count in counter.most_common():
+        click.echo(f"\t{key}: {count}")
+    click.echo("DONE")
+
+
+def _write_atomic(writer, src: str, dst: str | None):
+    """写出到 dst；dst 为 None 时替换 src"""
+    import os
+
+    dst = dst or src
+    os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+    tmp = f"{dst}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            writer.write(f)
+        os.replace(tmp, dst)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _encrypt_file(
+    user_password: str, owner_password: str | None, algorithm: str, task
+) -> str | None:
+    from pypdf import PdfReader, PdfWriter
+
+    src, dst = task
+    try:
+        reader = PdfReader(src)
+        if reader.is_encrypted:
+            return "already encrypted"
+        writer = PdfWriter(clone_from=reader)
+        writer.encrypt(user_password, owner_password, algorithm=algorithm)
+        _write_atomic(writer, src, dst)
+    except Exception as e:
+        return type(e).__name__
+    return None
+
+
+def _decrypt_file(passwords: list[str], task) -> str | None:
+    from pypdf import PasswordType, PdfReader, PdfWriter
+
+    src, dst = task
+    try:
+        reader = PdfReader(src)
+        if not reader.is_encrypted:
+            return "not encrypted"
+        # 只解析一次文件，逐个验证密码；空密码可以打开只有所有者密码的文件
+        for password in ("", *passwords):
+            if reader.decrypt(password) != PasswordType.NOT_DECRYPTED:
+                break
+        else:
+            return "wrong password"
+        writer = PdfWriter(clone_from=reader)
+        _write_atomic(writer, src, dst)
+    except Exception as e:
+        return type(e).__name__
+    return None
+
+
 @cli.command()
-def encrypt():
-    """加密 PDF"""
+@_batch_options
+@click.option(
+    "-u",
+    "--user-password",
+    help="打开文件所需的密码",
+    prompt=True,
+    hide_input=True,
+    confirmation_prompt=True,
+)
+@click.option(
+    "-O",
+    "--owner-password",
+    help="所有者密码，默认与用户密码相同",
+)
+@click.option(
+    "-a",
+    "--algorithm",
+    help="加密算法，默认为 AES-256（需要安装 cryptography）",
+    type=click.Choice(["AES-256", "AES-256-R5", "AES-128", "RC4-128", "RC4-40"]),
+    default="AES-256",
+)
+def encrypt(
+    inputs: tuple[str],
+    output: str | None,
+    in_place: bool,
+    jobs: int,
+    user_password: str,
+    owner_password: str | None,
+    algorithm: str,
+):
+    """加密 INPUTS 中的 PDF 文件，目录中的 .pdf 文件会被递归处理"""
 
-    raise NotImplementedError
+    from functools import partial
+
+    func = partial(_encrypt_file, user_password, owner_password, algorithm)
+    _run_batch(func, inputs, output, in_place, jobs, "加密...")
 
 
 @cli.command()
-def decrypt():
-    """解密 PDF"""
+@_batch_options
+@click.option(
+    "-p",
+    "--password",
+    "passwords",
+    help="候选密码，可以多次指定",
+    multiple=True,
+)
+@click.option(
+    "-P",
+    "--password-file",
+    help="候选密码文件，每行一个",
+    type=click.File("r", encoding="utf-8"),
+)
+def decrypt(
+    inputs: tuple[str],
+    output: str | None,
+    in_place: bool,
+    jobs: int,
+    passwords: tuple[str],
+    password_file,
+):
+    """解密 INPUTS 中的 PDF 文件，依次尝试各个候选密码
 
-    raise NotImplementedError
+    目录中的 .pdf 文件会被递归处理。
+    """
+
+    from functools import partial
+
+    passwords = list(passwords)
+    if password_file is not None:
+        passwords += [line.rstrip("\r\n") for line in password_file]
+    func = partial(_decrypt_file, passwords)
+    _run_batch(func, inputs, output, in_place, jobs, "解密...")
 
 
 @cli.command()
 @click.argument(
     "input",
     nargs=1,
-    type=click.Path(exists=True, readable=True),
+    type=click.Path(exists=True, readable=True, dir_okay=False),
 )
 @click.option(
     "-o",
     "--output",
     "output",
     help="输出文件",
-    type=click.Path(exists=False, writable=True),
+    type=click.Path(exists=False, writable=True, dir_okay=False),
     default="output.pdf",
 )
-def reduce_to_a5x2(input: str, output: str):
-    """把 INPUT 缩放到A5，然后每两页A5拼成一页A4"""
-
-    from shlex import quote
-
-    from pypdf import PageObject, PaperSize, PdfReader, PdfWriter, Transformation
-
-    def scale_to_a5(page: PageObject):
-        fact = float(
-            min(
-                PaperSize.A5.width / page.mediabox.width,
-                PaperSize.A5.height / page.mediabox.height,
-            )
-        )
-        page.add_transformation(Transformation().scale(fact, fact))
-
-    with open(input, "rb") as fin, open(output, "wb") as fout:
-        pdf_reader = PdfReader(fin)
-        pdf_writer = PdfWriter()
-
-        with click.progressbar(
-            length=pdf_reader.get_num_pages(),
-            label="处理页面...",
-        ) as bar:
-            for i in range(1, pdf_reader.get_num_pages(), 2):
-                page_left = pdf_reader.pages[i - 1]
-                page_right = pdf_reader.pages[i]
-
-                scale_to_a5(page_left)
-                scale_to_a5(page_right)
-
-                page_both = PageObject.create_blank_page(
-                    None, PaperSize.A4.height, PaperSize.A4.width
-                )
-                page_both.merge_translated_page(page_left, 0, 0)
-                page_both.merge_translated_page(page_right, PaperSize.A5.width, 0)
+@click.option(
+    "-g",
+    "--grid",
+    help="每张纸上的页面排列，列数x行数，默认为 2x1",
+    default="2x1",
+)
+@click.option(
+    "-p",
+    "--paper",
+    help="纸张大小，默认为 A4",
+    type=click.Choice(sorted(_PAPER_SIZES), case_sensitive=False),
+    default="A4",
+)
+@click.option(
+    "--orientation",
+    help="纸张方向，默认自动选择使页面放大倍数最大的方向",
+    type=click.Choice(["auto", "portrait", "landscape"]),
+    default="auto",
+)
+@click.option(
+    "-b",
+    "--booklet",
+    help="按骑马钉小册子的顺序排列页面，只适用于每张两页",
+    is_flag=True,
+)
+@click.option(
+    "-j",
+    "--jobs",
+    help="工作进程数，0 表示 CPU 核数，默认为 0",
+    type=click.IntRange(min=0),
+    default=0,
+)
+def nup(
+    input: str,
+    output: str,
+    grid: str,
+    paper: str,
+    orientation: str,
+    booklet: bool,
+    jobs: int,
+):
+    """把 INPUT 的多个页面缩放后拼到一张纸上
 
-                pdf_writer.add_page(page_both)
+    每个页面作为表单 XObject 只写入一次，拼版时按位置引用，不改写页面的
+    内容流。
+    """
 
-                bar.update(2)
+    import re
 
-            if i < pdf_reader.get_num_pages():
-                page_left = pdf_reader.pages[pdf_reader.get_num_pages() - 1]
+    m = re.fullmatch(r"(\d+)x(\d+)", grid.lower())
+    cols, rows = (int(m[1]), int(m[2])) if m else (0, 0)
+    # 按数值判断，00x2 这样的写法同样无效
+    if cols == 0 or rows == 0:
+        raise click.BadParameter(f"invalid grid {grid!r}", param_hint="--grid")
+    if booklet and cols * rows != 2:
+        raise click.BadParameter("booklet needs 2 pages per sheet", param_hint="--grid")
 
-                scale_to_a5(page_left)
+    impose(input, output, cols, rows, paper.upper(), orientation, booklet, jobs)
 
-                page_both = PageObject.create_blank_page(
-                    None, PaperSize.A4.height, PaperSize.A4.width
-                )
-                page_both.merge_translated_page(page_left, 0, 0)
 
-                pdf_writer.add_page(page_both)
+@cli.command()
+@click.argument(
+    "input",
+    nargs=1,
+    type=click.Path(exists=True, readable=True),
+)
+@click.option(
+    "-o",
+    "--output",
+    "output",
+    help="输出文件",
+    type=click.Path(exists=False, writable=True),
+    default="output.pdf",
+)
+def reduce_to_a5x2(input: str, output: str):
+    """把 INPUT 缩放到A5，然后每两页A5拼成一页A4
 
-                bar.update(1)
+    每页在所在的半张纸中居中；早期版本贴着左下角放置。
+    """
 
-        click.echo("\n输出 " + quote(output))
-        pdf_writer.write(fout)
-        click.echo("DONE")
+    impose(input, output, 2, 1, "A4", "landscape")
 
 
-cli()
+if __name__ == "__main__":
+    cli()
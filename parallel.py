@@ -0,0 +1,67 @@
+"""各脚本共用的并行执行工具"""
+
+import os
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def resolve_jobs(jobs: int) -> int:
+    """把命令行的 -j 参数换算为工作进程数，0 表示 CPU 核数"""
+    if jobs <= 0:
+        return os.cpu_count() or 1
+    return jobs
+
+
+def imap_bounded(
+    func: Callable[[T], R],
+    items: Iterable[T],
+    jobs: int = 1,
+    window: Optional[int] = None,
+    executor: Callable[[int], Executor] = ProcessPoolExecutor,
+) -> Iterator[tuple[T, R]]:
+    """按输入顺序产出 (item, func(item))
+
+    jobs <= 1 时直接串行执行；否则交给 executor 并行执行，同时在途的任务
+    不超过 window 个（默认 jobs * 4），因此输入再多内存占用也保持平稳。
+    func 和 item 在多进程下必须可以被 pickle。提前关闭返回的生成器会取消
+    尚未开始的任务。
+    """
+    if jobs <= 1:
+        for item in items:
+            yield item, func(item)
+        return
+
+    if window is None:
+        window = jobs * 4
+
+    with executor(jobs) as pool:
+        pending = deque()
+        try:
+            for item in items:
+                pending.append((item, pool.submit(func, item)))
+                if len(pending) >= window:
+                    item, future = pending.popleft()
+                    yield item, future.result()
+            while pending:
+                item, future = pending.popleft()
+                yield item, future.result()
+        finally:
+            # 调用方提前停止迭代时，取消还没开始执行的任务
+            for _, future in pending:
+                future.cancel()
+
+
+def batched(items: Iterable[T], n: int) -> Iterator[list[T]]:
+    """把 items 按每 n 个一组切分，用于摊薄跨进程提交任务的开销"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -1,8 +1,232 @@
-from subprocess import call
+"""升级当前 Python 环境中的所有包
 
-call("python -m pip install --upgrade pip")
+只调用一次 pip 解析依赖（pip install --dry-run --report），得到整个环境的
+升级计划；再并行下载计划中的文件，最后用一次 pip install --no-deps 安装。
+"""
 
-from pip._internal.utils.misc import get_installed_distributions
+import hashlib
+import importlib.metadata
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import NamedTuple, Optional
 
-for dist in get_installed_distributions():
-    call("pip3 install --upgrade " + dist.project_name, shell=True)
+import click
+
+from parallel import imap_bounded
+
+_PIP = [sys.executable, "-m", "pip"]
+
+
+def canonical_name(name: str) -> str:
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def _from_source(dist: importlib.metadata.Distribution) -> bool:
+    """是否从本地目录或 VCS 直接安装
+
+    pip 从文件安装（包括本脚本下载的 wheel）时也会写 direct_url.json，其中
+    是 archive_info，这类包照常升级。
+    """
+    text = dist.read_text("direct_url.json")
+    if not text:
+        return False
+    try:
+        info = json.loads(text)
+    except ValueError:
+        return False
+    return "dir_info" in info or "vcs_info" in info
+
+
+def installed_distributions() -> dict[str, str]:
+    """返回 {规范化的包名: 版本}，跳过从本地目录或 VCS 直接安装的包"""
+    result = {}
+    for dist in importlib.metadata.distributions():
+        name = dist.metadata["Name"]
+        if not name or _from_source(dist):
+            continue
+        result.setdefault(canonical_name(name), dist.version)
+    return result
+
+
+class Upgrade(NamedTuple):
+    name: str
+    old: Optional[str]
+    new: str
+    url: str
+    sha256: Optional[str]
+
+
+def resolve(installed: dict[str, str], pip_args: list[str]) -> list[Upgrade]:
+    """一次解析整个环境的升级，返回版本有变化的包"""
+    proc = subprocess.run(
+        [
+            *_PIP,
+            "install",
+            "--upgrade",
+            "--dry-run",
+            "--quiet",
+            "--report",
+            "-",
+            *pip_args,
+            *sorted(installed),
+        ],
+        stdout=subprocess.PIPE,
+    )
+    if proc.returncode:
+        raise click.ClickException("pip failed to resolve the upgrade")
+
+    plan = []
+    for item in json.loads(proc.stdout)["install"]:
+        name = canonical_name(item["metadata"]["name"])
+        version = item["metadata"]["version"]
+        old = installed.get(name)
+        if old == version:
+            continue
+        info = item["download_info"]
+        hashes = info.get("archive_info", {}).get("hashes", {})
+        plan.append(Upgrade(name, old, version, info["url"], hashes.get("sha256")))
+    return plan
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def download(wheelhouse: str, upgrade: Upgrade) -> str:
+    """下载到 wheelhouse 并校验哈希，返回本地路径；本地文件直接使用"""
+    url = urllib.parse.urlparse(upgrade.url)
+    if url.scheme == "file":
+        return urllib.request.url2pathname(url.path)
+
+    path = os.path.join(wheelhouse, urllib.parse.unquote(os.path.basename(url.path)))
+    if os.path.exists(path) and upgrade.sha256 in (None, _sha256(path)):
+        return path
+
+    h = hashlib.sha256()
+    part = path + ".part"
+    with urllib.request.urlopen(upgrade.url) as resp, open(part, "wb") as f:
+        while chunk := resp.read(1 << 20):
+            h.update(chunk)
+            f.write(chunk)
+    if upgrade.sha256 is not None and h.hexdigest() != upgrade.sha256:
+        os.remove(part)
+        raise click.ClickException(f"hash mismatch for {upgrade.url}")
+    os.replace(part, path)
+    return path
+
+
+@click.command()
+@click.option(
+    "-n",
+    "--dry-run",
+    help="Only print the upgrade plan and how long resolving took.",
+    is_flag=True,
+)
+@click.option(
+    "-j",
+    "--jobs",
+    help="Number of parallel downloads. Default: 8.",
+    type=click.IntRange(min=1),
+    default=8,
+)
+@click.option(
+    "-w",
+    "--wheelhouse",
+    help="Keep downloaded files in this directory and reuse them next time.",
+    type=click.Path(file_okay=False),
+)
+@click.option(
+    "-i",
+    "--index-url",
+    help="Base URL of the package index, passed to pip.",
+)
+@click.option(
+    "-f",
+    "--find-links",
+    help="Local directory or URL to look for packages in, passed to pip.",
+    multiple=True,
+)
+@click.option(
+    "--skip",
+    help="Do not upgrade this package. Can be given multiple times.",
+    multiple=True,
+)
+def main(
+    dry_run: bool,
+    jobs: int,
+    wheelhouse: Optional[str],
+    index_url: Optional[str],
+    find_links: tuple[str],
+    skip: tuple[str],
+):
+    """把当前环境中的所有包（包括 pip）升级到最新版本"""
+
+    pip_args = []
+    if index_url:
+        pip_args += ["--index-url", index_url]
+    for link in find_links:
+        pip_args += ["--find-links", link]
+
+    skipped = {canonical_name(name) for name in skip}
+    installed = {
+        name: version
+        for name, version in installed_distributions().items()
+        if name not in skipped
+    }
+
+    start = time.perf_counter()
+    plan = resolve(installed, pip_args)
+    resolved = time.perf_counter()
+
+    width = max((len(u.name) for u in plan), default=0)
+    for u in plan:
+        click.echo(f"{u.name:<{width}}  {u.old or '(new)'} -> {u.new}")
+    click.echo(f"{len(plan)} of {len(installed)} packages to upgrade")
+    click.echo(f"resolve: {resolved - start:.2f}s")
+    if dry_run or not plan:
+        return
+
+    tmpdir = None
+    if wheelhouse is None:
+        wheelhouse = tmpdir = tempfile.mkdtemp(prefix="pip3update-")
+    else:
+        os.makedirs(wheelhouse, exist_ok=True)
+    try:
+        files = []
+        with click.progressbar(length=len(plan), label="Downloading") as bar:
+            for _, path in imap_bounded(
+                partial(download, wheelhouse),
+                plan,
+                jobs,
+                executor=ThreadPoolExecutor,
+            ):
+                files.append(path)
+                bar.update(1)
+        downloaded = time.perf_counter()
+        click.echo(f"download: {downloaded - resolved:.2f}s")
+
+        # 依赖已经解析完毕，一次安装全部文件
+        if subprocess.call([*_PIP, "install", "--no-deps", *files]):
+            raise click.ClickException("pip failed to install the upgrade")
+        click.echo(f"install: {time.perf_counter() - downloaded:.2f}s")
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,14 +4,24 @@ __copyright__ = """recode v%(version)s
 Copyright (c) 2019-2020 by Yuhao Gu. All rights reserved.
 """
 
+import codecs
+import itertools
 import os
 import re
+import shutil
 from collections import Counter
-from typing import Union
+from functools import partial
+from typing import Callable, Optional, Union
 
-import chardet
 import click
 
+import instrument
+import textinfo
+import watch_daemon
+from instrument import imap_bounded
+from parallel import resolve_jobs
+from walk import walk
+
 default_from_encodings = (
     "UTF-8",
     "UTF-8-SIG",
@@ -28,13 +38,14 @@ class UnkownEncoding(RuntimeError):
     pass
 
 
-def detect_encoding(file_path: str) -> str:
-    with open(file_path, "rb") as f:
-        s = f.read(4096)
-    ans = chardet.detect(s)
-    if ans["confidence"] < 0.5:
+def detect_encoding(
+    file_path: str, use_cache: bool = True, froms=default_from_encodings
+) -> str:
+    with instrument.phase("detect"):
+        ans = textinfo.detect(file_path, use_cache, froms)
+    if ans.confidence < 0.5:
         raise UnkownEncoding()
-    return ans["encoding"].upper()
+    return ans.encoding
 
 
 def detect_newlines(file_path: str, encoding: str):
@@ -52,13 +63,123 @@ def translate_newlines(newlines: Union[str, tuple, None]) -> str:
     return "NONE"
 
 
-def atomic_rewrite(path: str, s: str, encoding, newline):
+# 流式转换时每次读入的字符数（按字节处理时为字节数）
+CHUNK_SIZE = 1 << 20
+
+_NEWLINE_ORDER = ("\r", "\n", "\r\n")
+
+
+def _newline_set(newlines) -> set:
+    if newlines is None:
+        return set()
+    if isinstance(newlines, str):
+        return {newlines}
+    return set(newlines)
+
+
+def scan_newlines(file_path: str, encoding: str):
+    """流式读完整个文件，返回其中出现的所有换行符"""
+    with instrument.phase("scan"):
+        with open(file_path, "r", encoding=encoding, newline="") as f:
+            while f.read(CHUNK_SIZE):
+                pass
+    if instrument.enabled():
+        instrument.add("bytes_read", os.path.getsize(file_path))
+    return f.newlines
+
+
+def scan_bytes(file_path: str) -> tuple[bool, Union[str, tuple, None]]:
+    """不解码，按字节读完整个文件，返回 (是否为纯 ASCII, 所有换行符)
+
+    换行符只对 newline_transparent 的编码有意义，也不会检查文件能否解码。
+    """
+    is_ascii = True
+    found = set()
+    carry = b""
+    with instrument.phase("scan"):
+        with open(file_path, "rb") as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                # 块末尾的 CR 可能属于跨块的 CRLF，留到下一块
+                chunk = carry + chunk
+                is_ascii = is_ascii and chunk.isascii()
+                found |= _newline_set(textinfo.scan_newlines(chunk, False))
+                carry = b"\r" if chunk.endswith(b"\r") else b""
+        if carry:
+            found.add("\r")
+    if instrument.enabled():
+        instrument.add("bytes_read", os.path.getsize(file_path))
+
+    newlines = tuple(i for i in _NEWLINE_ORDER if i in found)
+    if not newlines:
+        return is_ascii, None
+    return is_ascii, newlines[0] if len(newlines) == 1 else newlines
+
+
+def same_codec(a: str, b: str) -> bool:
+    try:
+        return codecs.lookup(a).name == codecs.lookup(b).name
+    except LookupError:
+        return a.upper() == b.upper()
+
+
+def _rewrite_text(path: str, temp: str, encoding, to, newline):
+    with open(
+        path, "r", encoding=encoding, newline=None if newline else ""
+    ) as fin, open(temp, "w", encoding=to, newline=newline) as fout:
+        while True:
+            chunk = fin.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            fout.write(chunk)
+
+
+def _rewrite_bytes(path: str, temp: str, newline: str):
+    target = newline.encode("ascii")
+    carry = b""
+    with open(path, "rb") as fin, open(temp, "wb") as fout:
+        while True:
+            chunk = fin.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            chunk = carry + chunk
+            if chunk.endswith(b"\r"):
+                chunk, carry = chunk[:-1], b"\r"
+            else:
+                carry = b""
+            chunk = chunk.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+            if target != b"\n":
+                chunk = chunk.replace(b"\n", target)
+            fout.write(chunk)
+        if carry:
+            fout.write(target)
+
+
+def atomic_rewrite(path: str, encoding, to, newline, same_bytes=False):
+    """把 path 从 encoding 流式转换为 to 编码，内存占用与文件大小无关
+
+    newline 为 "" 时保持原有行尾，否则把所有行尾统一为 newline。增量解码器
+    会正确处理跨块的多字节字符和 CRLF。
+
+    same_bytes 表示该文件按 encoding 和 to 编码的结果相同（同一编码，或者纯
+    ASCII 文件在两个 ASCII 兼容编码之间转换），此时对 CR、LF 是单字节的编码
+    直接按字节替换行尾，不解码。新文件保留原文件的权限和时间戳，通过
+    os.replace 原子地替换原文件。
+    """
     temp = path + "~~~~~"
     try:
-        with open(temp, "w", encoding=encoding, newline=newline) as f:
-            f.write(s)
-        os.remove(path)
-        os.rename(temp, path)
+        with instrument.phase("rewrite"):
+            if same_bytes and textinfo.newline_transparent(encoding):
+                _rewrite_bytes(path, temp, newline)
+            else:
+                _rewrite_text(path, temp, encoding, to, newline)
+        if instrument.enabled():
+            instrument.add("bytes_read", os.path.getsize(path))
+            instrument.add("bytes_written", os.path.getsize(temp))
+        shutil.copystat(path, temp)
+        os.replace(temp, path)
     except BaseException as e:
         if os.path.exists(temp):
             os.remove(temp)
@@ -66,6 +187,137 @@ def atomic_rewrite(path: str, s: str, encoding, newline):
     return
 
 
+def examine(path: str, encoding: str, to: str):
+    """返回 (转换为 to 编码后字节是否不变, 文件中的所有换行符)
+
+    CR、LF 是单字节的编码按字节扫描，不必解码整个文件。
+    """
+    if same_codec(encoding, to) and textinfo.newline_transparent(encoding):
+        return True, scan_bytes(path)[1]
+    if textinfo.ascii_compatible(encoding) and textinfo.ascii_compatible(to):
+        return scan_bytes(path)
+    return same_codec(encoding, to), scan_newlines(path, encoding)
+
+
+NEWLINES = {"CR": "\r", "LF": "\n", "CRLF": "\r\n"}
+
+
+def run_guarded(func: Callable, path: str) -> tuple[object, Optional[str]]:
+    """执行 func(path)，把异常转换为着色的错误标签，便于跨进程返回"""
+    try:
+        return func(path), None
+    except BaseException as e:
+        return None, click.style(f"[{type(e).__name__}]", bg="red")
+
+
+def inspect_file(
+    path: str,
+    use_cache: bool = True,
+    froms=default_from_encodings,
+    whole: bool = False,
+) -> tuple[str, str, str]:
+    """统计模式：一次读取同时识别文件的编码和行尾，并返回给出编码的识别层"""
+    with instrument.phase("detect"):
+        ans = textinfo.detect(path, use_cache, froms, whole)
+    if ans.confidence < 0.5:
+        raise UnkownEncoding()
+    eof = ans.newlines
+    if eof is False:
+        # 缓存里记录了解码失败，重新解码以抛出原本的异常
+        eof = detect_newlines(path, ans.encoding)
+    return ans.encoding, translate_newlines(eof), ans.stage
+
+
+def from_daemon(records: list, inspect: Callable):
+    """统计模式：把守护进程的编码视图转换为 inspect_file 的结果"""
+    for path, (encoding, confidence, newlines, stage) in records:
+        if confidence < 0.5 or newlines is False:
+            # 照常检查，得到与直接遍历相同的错误标签
+            yield path, run_guarded(inspect, path)
+            continue
+        if isinstance(newlines, list):
+            newlines = tuple(newlines)
+        yield path, ((encoding, translate_newlines(newlines), stage), None)
+
+
+def process_full(path, to, eof, froms, force_encoding, use_cache=True):
+    """全功能模式：同时转换编码和行尾"""
+    newline = NEWLINES[eof]
+
+    if not force_encoding:
+        encoding = detect_encoding(path, use_cache, froms)
+        if encoding not in froms:
+            return click.style(f"[{encoding}]", fg="black", bg="yellow")
+    else:
+        encoding = force_encoding
+
+    same_bytes, newlines = examine(path, encoding, to)
+    # 没有换行符的文件统一行尾后不变
+    newlines_ok = newlines in (newline, None)
+
+    if same_bytes and newlines_ok:
+        return click.style("[SKIPPED]", fg="green")
+
+    if newlines_ok:
+        atomic_rewrite(path, encoding, to, "")
+        return click.style(f"[{encoding} -> {to}]", fg="green")
+
+    if same_codec(encoding, to):
+        atomic_rewrite(path, encoding, encoding, newline, same_bytes)
+        return click.style(
+            f"[{translate_newlines(newlines)} -> {eof}]", fg="green"
+        )
+
+    atomic_rewrite(path, encoding, to, newline, same_bytes)
+    return click.style(
+        f"[{encoding} -> {to}, " + f"{translate_newlines(newlines)} -> {eof}]",
+        fg="green",
+    )
+
+
+def process_recode(path, to, froms, force_encoding, use_cache=True):
+    """只重新编码"""
+    if not force_encoding:
+        encoding = detect_encoding(path, use_cache, froms)
+    else:
+        encoding = force_encoding
+
+    if same_codec(encoding, to):
+        return click.style("[SKIPPED]", fg="green")
+    if encoding not in froms:
+        return click.style(f"[{encoding}]", fg="black", bg="yellow")
+
+    # 纯 ASCII 文件在 ASCII 兼容的编码之间转换，结果与原文件相同
+    if (
+        textinfo.ascii_compatible(encoding)
+        and textinfo.ascii_compatible(to)
+        and scan_bytes(path)[0]
+    ):
+        return click.style("[SKIPPED]", fg="green")
+
+    atomic_rewrite(path, encoding, to, "")
+    return click.style(f"[{encoding} -> {to}]", fg="green")
+
+
+def process_newline(
+    path, eof, force_encoding, use_cache=True, froms=default_from_encodings
+):
+    """只格式化行尾"""
+    newline = NEWLINES[eof]
+
+    if not force_encoding:
+        encoding = detect_encoding(path, use_cache, froms)
+    else:
+        encoding = force_encoding
+
+    _, newlines = examine(path, encoding, encoding)
+    if newlines in (newline, None):
+        return click.style("[SKIPPED]", fg="green")
+
+    atomic_rewrite(path, encoding, encoding, newline, True)
+    return click.style(f"[{translate_newlines(newlines)} -> {eof}]", fg="green")
+
+
 @click.command()
 @click.version_option(__version__, message=__copyright__)
 @click.argument(
@@ -121,6 +373,45 @@ def atomic_rewrite(path: str, s: str, encoding, newline):
     help="Specify source encoding.",
     type=str,
 )
+@click.option(
+    "-j",
+    "--jobs",
+    help="Number of worker processes, 0 for all CPUs. Default: 1.",
+    type=click.IntRange(min=0),
+    default=1,
+)
+@click.option(
+    "--no-cache",
+    help="Do not read or update the encoding detection cache.",
+    is_flag=True,
+)
+@click.option(
+    "--full-scan",
+    help="In stats mode, scan whole files for newlines instead of the first 4 KB.",
+    is_flag=True,
+)
+@click.option(
+    "--ignore",
+    help="Honor .gitignore/.ignore files and skip .git when searching "
+    "recursively.",
+    is_flag=True,
+)
+@click.option(
+    "--stats",
+    "show_stats",
+    help="Print time spent in each phase and throughput after the results.",
+    is_flag=True,
+)
+@click.option(
+    "--stats-json",
+    help="Write the phase timings and counters as JSON to this file.",
+    type=click.File("w"),
+)
+@click.option(
+    "--profile",
+    help="Write cProfile data of all processes to this file.",
+    type=click.Path(dir_okay=False, writable=True),
+)
 def cli(
     pathes: tuple[str],
     recursive: tuple[str],
@@ -130,6 +421,13 @@ def cli(
     to: str,
     eof: str,
     force_encoding: str,
+    jobs: int,
+    no_cache: bool,
+    full_scan: bool,
+    ignore: bool,
+    show_stats: bool,
+    stats_json,
+    profile: Optional[str],
 ):
     """文本文件重编码脚本，具备编码识别、指定输出编码、行尾格式化功能。
 
@@ -148,8 +446,19 @@ def cli(
     \b
     5. 正则模式包含与排除，同时匹配时，优先选择排除
         recode -r dir1 dir2 --include "a.*" --exclude ".*.cpp"
+    \b
+    6. 使用所有 CPU 核并行处理
+        recode -r dir -t utf-8 -j 0
     """
 
+    # 统计在命令结束时输出，位于 RESULTS 之后
+    click.get_current_context().with_resource(
+        instrument.session(show_stats, stats_json, profile)
+    )
+
+    jobs = resolve_jobs(jobs)
+    froms = tuple(i.upper() for i in froms)
+
     include = re.compile(include)
     exclude = re.compile(exclude)
 
@@ -157,7 +466,17 @@ def cli(
         name = os.path.basename(path)
         return include.match(name) and not exclude.search(path)
 
-    def gen_matched_files():
+    # 统计模式下由守护进程应答的目录，不再遍历
+    watched = {}
+    if not to and not eof and not no_cache:
+        for dir in recursive:
+            records = watch_daemon.query(
+                dir, "text", ignore, candidates=froms, whole=full_scan
+            )
+            if records is not None:
+                watched[dir] = [item for item in records if match(item[0])]
+
+    def gen_listed_files():
         for path in pathes:
             if os.path.isfile(path):
                 if match(path):
@@ -169,36 +488,62 @@ def cli(
                     if match(full_path) and os.path.isfile(full_path):
                         yield full_path
 
+    def gen_walked_files(dir):
+        # exclude 是任意正则，不能据此剪掉目录：
+        # 目录路径匹配时，其下的文件路径未必匹配
+        for entry in walk(dir, None, ignore, jobs):
+            if match(entry.path):
+                yield entry.path
+
+    def gen_matched_files():
+        yield from gen_listed_files()
         for dir in recursive:
-            for path, _, files in os.walk(dir):
-                for file in files:
-                    full_path = os.path.join(path, file)
-                    if match(full_path):
-                        yield full_path
-        return
+            yield from gen_walked_files(dir)
 
     if not to and not eof:
         # 什么都不做模式：统计文本编码和换行符
         encodings = Counter()
         eofs = Counter()
         errors = Counter()
+        stages = Counter()
 
-        for path in gen_matched_files():
-            try:
-                encoding = detect_encoding(path)
-                encodings[click.style(f"[{encoding}]", fg="green")] += 1
-
-                eof = detect_newlines(path, encoding)
-                eofs[
-                    click.style(f"[{translate_newlines(eof)}]", fg="green")
-                ] += 1
+        inspect = partial(
+            inspect_file, use_cache=not no_cache, froms=froms, whole=full_scan
+        )
 
-                result = click.style(
-                    f"[{encoding}, {translate_newlines(eof)}]", fg="green"
-                )
+        def inspect_files(paths):
+            return imap_bounded(
+                partial(run_guarded, inspect),
+                instrument.timed("walk", itertools.chain.from_iterable(paths)),
+                jobs,
+            )
 
-            except BaseException as e:
-                result = click.style(f"[{type(e).__name__}]", bg="red")
+        def gen_results():
+            """按命令行中的顺序产出结果
+
+            每个目录只用一个来源：守护进程应答时用它的记录（按路径排序），
+            否则遍历。相邻的需要检查的路径共用一个进程池。
+            """
+            pending = [gen_listed_files()]
+            for dir in recursive:
+                if dir not in watched:
+                    pending.append(gen_walked_files(dir))
+                    continue
+                yield from inspect_files(pending)
+                pending = []
+                yield from from_daemon(watched[dir], inspect)
+            yield from inspect_files(pending)
+
+        for path, (ans, error) in gen_results():
+            instrument.add("files")
+            if error is None:
+                encoding, eof, stage = ans
+                stages[stage] += 1
+                encodings[click.style(f"[{encoding}]", fg="green")] += 1
+                eofs[click.style(f"[{eof}]", fg="green")] += 1
+                result = click.style(f"[{encoding}, {eof}]", fg="green")
+            else:
+                result = error
                 errors[result] += 1
 
             click.echo(result + " " + path)
@@ -215,94 +560,51 @@ def cli(
             click.echo("\nErrors:")
             for error, count in errors.items():
                 click.echo(f"\t{error}: {count}")
+        if stages:
+            click.echo("\nDetection:")
+            for stage, count in stages.items():
+                click.echo(f"\t[{stage}]: {count}")
         return
 
     # 定制执行过程
     if to and eof:
         # 全功能模式
-        to = to.upper()
-        newline = {"CR": "\r", "LF": "\n", "CRLF": "\r\n"}[eof]
-
-        def process(path):
-            if not force_encoding:
-                encoding = detect_encoding(path)
-                if encoding not in froms:
-                    return click.style(
-                        f"[{encoding}]", fg="black", bg="yellow"
-                    )
-            else:
-                encoding = force_encoding
-
-            with open(path, "r", encoding=encoding) as f:
-                content = f.read()
-
-            if encoding == to and f.newlines == newline:
-                return click.style("[SKIPPED]", fg="green")
-
-            if f.newlines == newline:
-                atomic_rewrite(path, content, to, "")
-                return click.style(f"[{encoding} -> {to}]", fg="green")
-
-            if encoding == to:
-                atomic_rewrite(path, content, encoding, newline)
-                return click.style(
-                    f"[{translate_newlines(f.newlines)} -> {eof}]", fg="green"
-                )
-
-            atomic_rewrite(path, content, to, newline)
-            return click.style(
-                f"[{encoding} -> {to}, "
-                + f"{translate_newlines(f.newlines)} -> {eof}]",
-                fg="green",
-            )
-
+        process = partial(
+            process_full,
+            to=to.upper(),
+            eof=eof,
+            froms=froms,
+            force_encoding=force_encoding,
+            use_cache=not no_cache,
+        )
     elif to:
-        to = to.upper()
-
         # 只重新编码
-        def process(path):
-            if not force_encoding:
-                encoding = detect_encoding(path)
-            else:
-                encoding = force_encoding
-
-            if encoding == to:
-                return click.style("[SKIPPED]", fg="green")
-            if encoding not in froms:
-                return click.style(f"[{encoding}]", fg="black", bg="yellow")
-
-            with open(path, "r", encoding=encoding) as f:
-                content = f.read()
-            atomic_rewrite(path, content, to, "")
-            return click.style(f"[{encoding} -> {to}]", fg="green")
-
+        process = partial(
+            process_recode,
+            to=to.upper(),
+            froms=froms,
+            force_encoding=force_encoding,
+            use_cache=not no_cache,
+        )
     else:
         # 只格式化行尾
-        newline = {"CR": "\r", "LF": "\n", "CRLF": "\r\n"}[eof]
-
-        def process(path):
-            if not force_encoding:
-                encoding = detect_encoding(path)
-            else:
-                encoding = force_encoding
-
-            with open(path, "r", encoding=encoding) as f:
-                content = f.read()
-            if f.newlines == newline:
-                return click.style("[SKIPPED]", fg="green")
-
-            atomic_rewrite(path, content, encoding, newline)
-            return click.style(
-                f"[{translate_newlines(f.newlines)} -> {eof}]", fg="green"
-            )
+        process = partial(
+            process_newline,
+            eof=eof,
+            force_encoding=force_encoding,
+            use_cache=not no_cache,
+            froms=froms,
+        )
 
     # 运行程序
     results = Counter()
-    for path in gen_matched_files():
-        try:
-            result = process(path)
-        except BaseException as e:
-            result = click.style(f"[{type(e).__name__}]", bg="red")
+    for path, (result, error) in imap_bounded(
+        partial(run_guarded, process),
+        instrument.timed("walk", gen_matched_files()),
+        jobs,
+    ):
+        instrument.add("files")
+        result = result or error
         results[result] += 1
         click.echo(result + " " + path)
 
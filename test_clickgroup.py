@@ -0,0 +1,43 @@
+import click
+import pytest
+from click.testing import CliRunner
+
+from clickgroup import DefaultGroup
+
+
+@click.group(cls=DefaultGroup, default="search")
+def cli():
+    pass
+
+
+@cli.command()
+@click.argument("words", nargs=-1)
+def search(words):
+    click.echo("search " + " ".join(words))
+
+
+@cli.command()
+def index():
+    click.echo("index")
+
+
+@pytest.mark.parametrize(
+    "args, output",
+    [
+        (["hello", "world"], "search hello world"),
+        (["index"], "index"),
+        (["search", "index"], "search index"),
+        (["--", "index"], "search index"),
+        (["search", "--", "--help"], "search --help"),
+    ],
+)
+def test_default_command(args, output):
+    result = CliRunner().invoke(cli, args)
+    assert result.exit_code == 0, result.output
+    assert result.output == output + "\n"
+
+
+def test_help_and_no_args_show_the_group():
+    for args in ([], ["--help"]):
+        result = CliRunner().invoke(cli, args)
+        assert "Commands:" in result.output
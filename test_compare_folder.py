@@ -0,0 +1,126 @@
+import os
+import shutil
+import sqlite3
+from contextlib import closing
+
+import click
+import pytest
+
+from compare_folder import (
+    HASH_NAME,
+    SNAPSHOT_VERSION,
+    compare_trees,
+    content_digest,
+    fill_digests,
+    hash_file,
+    iter_files,
+    load_snapshot,
+    scan,
+    take_snapshot,
+)
+
+
+@pytest.fixture
+def root(tmp_path):
+    root = tmp_path / "root"
+    for rel, content in {
+        "a.txt": "a",
+        "sub/b.txt": "bb",
+        "sub/deep/c.txt": "ccc",
+        "名字/d.txt": "dddd",
+    }.items():
+        path = root.joinpath(*rel.split("/"))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+    (root / "empty").mkdir()
+    return str(root)
+
+
+def snapshot_of(root, tmp_path, name="snap.db"):
+    output = str(tmp_path / name)
+    take_snapshot(root, output, use_cache=False)
+    return output
+
+
+def test_snapshot_tables(root, tmp_path):
+    output = snapshot_of(root, tmp_path)
+    with closing(sqlite3.connect(output)) as db:
+        meta = dict(db.execute("SELECT key, value FROM meta"))
+        files = {
+            path: (size, mtime, digest)
+            for path, size, mtime, digest in db.execute("SELECT * FROM files")
+        }
+        dirs = {path: digest for path, _, digest in db.execute("SELECT * FROM dirs")}
+
+    assert meta["version"] == SNAPSHOT_VERSION
+    assert meta["hash"] == HASH_NAME
+    assert meta["root"] == os.path.abspath(root)
+    assert int(meta["created"]) > 0
+
+    # 路径相对于根目录、以 / 分隔，根目录本身为 ""
+    assert sorted(files) == ["a.txt", "sub/b.txt", "sub/deep/c.txt", "名字/d.txt"]
+    assert sorted(dirs) == ["", "empty", "sub", "sub/deep", "名字"]
+    for rel, (size, mtime, digest) in files.items():
+        st = os.stat(os.path.join(root, *rel.split("/")))
+        assert (size, mtime) == (st.st_size, st.st_mtime_ns)
+        assert digest == hash_file(os.path.join(root, *rel.split("/")))
+
+    tree = scan(root)
+    fill_digests([f for _, f in iter_files(tree, "")], use_cache=False)
+    assert dirs[""] == content_digest(tree)
+    assert dirs["sub/deep"] == content_digest(tree.children["sub"].children["deep"])
+
+
+def test_load_snapshot_round_trip(root, tmp_path):
+    tree = load_snapshot(snapshot_of(root, tmp_path))
+    assert sorted(tree.children) == ["a.txt", "empty", "sub", "名字"]
+    assert tree.children["empty"].children == {}
+    assert tree.children["sub"].children["b.txt"].size == 2
+
+    report = compare_trees(tree, scan(root), use_cache=False)
+    assert report.differences == 0
+    assert report.errors == []
+
+
+def test_compare_snapshot_with_changed_tree(root, tmp_path):
+    snapshot = snapshot_of(root, tmp_path)
+    with open(os.path.join(root, "a.txt"), "w") as f:
+        f.write("changed")
+    os.remove(os.path.join(root, "sub", "b.txt"))
+    shutil.move(os.path.join(root, "名字"), os.path.join(root, "renamed"))
+    with open(os.path.join(root, "new.txt"), "w") as f:
+        f.write("new")
+
+    report = compare_trees(load_snapshot(snapshot), scan(root), use_cache=False)
+    assert report.modified == ["a.txt"]
+    assert report.removed == ["sub/b.txt"]
+    assert report.added == ["new.txt"]
+    assert report.moved == [("名字/", "renamed/")]
+
+
+def test_snapshot_reuses_unchanged_digests(root, tmp_path):
+    output = snapshot_of(root, tmp_path)
+    counter = take_snapshot(root, output, use_cache=False)
+    assert (counter["unchanged"], counter["hashed"]) == (4, 0)
+
+    with open(os.path.join(root, "a.txt"), "w") as f:
+        f.write("longer")
+    counter = take_snapshot(root, output, use_cache=False)
+    assert (counter["unchanged"], counter["hashed"]) == (3, 1)
+    assert not os.path.exists(output + ".tmp")
+
+    counter = take_snapshot(root, output, use_cache=False, rebuild=True)
+    assert (counter["unchanged"], counter["hashed"]) == (0, 4)
+
+
+def test_load_snapshot_rejects_other_files(tmp_path):
+    path = tmp_path / "not.db"
+    path.write_text("not a database")
+    with pytest.raises(click.ClickException):
+        load_snapshot(str(path))
+
+    with closing(sqlite3.connect(str(path.with_suffix(".old")))) as db, db:
+        db.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        db.execute("INSERT INTO meta VALUES ('version', '0')")
+    with pytest.raises(click.ClickException):
+        load_snapshot(str(path.with_suffix(".old")))
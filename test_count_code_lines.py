@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+from count_code_lines import Lines, _from_daemon, count_tree
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+@pytest.fixture
+def root(tmp_path):
+    # ROOT 本身位于 build、venv 之下，只有 ROOT 之内的同名目录被排除
+    root = str(tmp_path / "build" / "venv" / "proj")
+    write(os.path.join(root, "main.py"), "# comment\n\nprint(1)\n")
+    write(os.path.join(root, "src", "app.js"), "let a = 1;\n")
+    write(os.path.join(root, "build", "out.js"), "let b = 2;\n")
+    write(os.path.join(root, "src", "venv", "lib.py"), "x = 1\n")
+    write(os.path.join(root, "node_modules", "m.ts"), "let c = 3;\n")
+    return root
+
+
+def test_excludes_are_relative_to_root(root):
+    found = {
+        os.path.relpath(path, root): (language, lines)
+        for path, language, lines in count_tree(root, use_cache=False)
+    }
+    assert found == {
+        "main.py": ("Python", Lines(1, 1, 1)),
+        os.path.join("src", "app.js"): ("JavaScript", Lines(1, 0, 0)),
+    }
+
+
+def test_daemon_records_use_the_same_excludes(root):
+    records = [
+        (os.path.join(root, "main.py"), [0, 1, 1, 1]),
+        (os.path.join(root, "build", "out.js"), [1, 1, 0, 0]),
+        (os.path.join(root, "src", "app.js"), [1, 1, 0, 0]),
+        (os.path.join(root, "src", "venv", "lib.py"), [0, 1, 0, 0]),
+    ]
+    assert [path for path, _, _ in _from_daemon(root, records)] == [
+        os.path.join(root, "main.py"),
+        os.path.join(root, "src", "app.js"),
+    ]
+
+
+def test_relative_root(root, monkeypatch):
+    monkeypatch.chdir(root)
+    paths = [path for path, _, _ in count_tree(".", use_cache=False)]
+    assert sorted(paths) == [
+        os.path.join(".", "main.py"),
+        os.path.join(".", "src", "app.js"),
+    ]
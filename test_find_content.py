@@ -0,0 +1,49 @@
+import os
+import random
+from contextlib import closing
+
+import pytest
+
+import find_content
+from find_content import open_index, query_index, update_index
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("MYCMD_CACHE_DIR", str(tmp_path / "cache"))
+
+
+def make_files(root, rng, count):
+    contents = {}
+    for i in range(count):
+        text = "".join(rng.choice("abcd 中文\n") for _ in range(rng.randrange(200)))
+        path = os.path.join(root, f"d{i % 3}", f"f{i}.txt")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        contents[path] = text
+    return contents
+
+
+@pytest.mark.parametrize("postings, grams", [(1, 1 << 18), (50, 1 << 18), (1 << 20, 7)])
+def test_index_with_small_flushes(tmp_path, monkeypatch, postings, grams):
+    # 每个文件、或每几个文件就写入一次，同一三元组的倒排表由多段拼接而成
+    monkeypatch.setattr(find_content, "_FLUSH_POSTINGS", postings)
+    monkeypatch.setattr(find_content, "_FLUSH_GRAMS", grams)
+    rng = random.Random(postings)
+    root = str(tmp_path / "root")
+    contents = make_files(root, rng, 30)
+
+    with closing(open_index(str(tmp_path / "index.sqlite3"))) as db:
+        assert update_index(db, root, use_cache=False)["indexed"] == 30
+        for _ in range(50):
+            text = rng.choice([t for t in contents.values() if len(t) > 5])
+            start = rng.randrange(len(text) - 4)
+            needle = text[start : start + rng.randrange(3, 5)]
+            expected = sorted(p for p, t in contents.items() if needle in t)
+            found = query_index(db, needle)
+            assert found == sorted(found)
+            assert set(expected) <= set(found)
+            # 三元组来自同一文件时候选不会多于含有全部三元组的文件
+            grams = find_content.trigrams(needle)
+            assert all(grams <= find_content.trigrams(contents[p]) for p in found)
@@ -0,0 +1,142 @@
+import difflib
+import io
+import random
+
+import pytest
+
+import line_compare
+from line_compare import (
+    LineFile,
+    files_differ,
+    group_opcodes,
+    myers_diff,
+    split_lines,
+    unified_diff,
+)
+
+
+def apply(opcodes, a, b):
+    """按操作码把 a 变换为 b，同时检查操作码首尾相接"""
+    out = []
+    i = j = 0
+    for tag, i1, i2, j1, j2 in opcodes:
+        assert (i1, j1) == (i, j)
+        if tag == "equal":
+            assert a[i1:i2] == b[j1:j2]
+            out += a[i1:i2]
+        else:
+            assert tag in ("replace", "delete", "insert")
+            out += b[j1:j2]
+        i, j = i2, j2
+    assert (i, j) == (len(a), len(b))
+    return out
+
+
+def edit_distance(opcodes):
+    return sum(i2 - i1 + j2 - j1 for tag, i1, i2, j1, j2 in opcodes if tag != "equal")
+
+
+def lcs_distance(a, b):
+    """最短编辑脚本的长度（只有插入和删除）"""
+    prev = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        cur = [i]
+        for j, y in enumerate(b, 1):
+            cur.append(prev[j - 1] if x == y else min(prev[j], cur[j - 1]) + 1)
+        prev = cur
+    return prev[-1]
+
+
+@pytest.mark.parametrize(
+    "a, b",
+    [
+        ([], []),
+        ([1, 2, 3], []),
+        ([], [1, 2, 3]),
+        ([1, 2, 3], [1, 2, 3]),
+        ([1, 2, 3], [4, 5, 6]),
+        ([1, 2, 3, 4], [1, 3, 4, 5]),
+        ([1, 1, 1], [1, 1]),
+    ],
+)
+def test_myers_small(a, b):
+    opcodes = myers_diff(a, b)
+    assert apply(opcodes, a, b) == b
+    assert edit_distance(opcodes) == lcs_distance(a, b)
+
+
+def test_myers_random():
+    rng = random.Random(0)
+    for _ in range(300):
+        a = [rng.randrange(4) for _ in range(rng.randrange(40))]
+        b = [rng.randrange(4) for _ in range(rng.randrange(40))]
+        opcodes = myers_diff(a, b)
+        assert apply(opcodes, a, b) == b
+        assert edit_distance(opcodes) == lcs_distance(a, b)
+        # 相邻的操作码不会同为 equal，删除和插入已合并为替换
+        for x, y in zip(opcodes, opcodes[1:]):
+            assert not (x[0] == "equal" and y[0] == "equal")
+            assert x[0] == "equal" or y[0] == "equal"
+
+
+@pytest.mark.parametrize("n", [0, 1, 3])
+def test_group_opcodes_matches_difflib(n):
+    rng = random.Random(n)
+    for _ in range(100):
+        a = [rng.randrange(5) for _ in range(rng.randrange(30))]
+        b = [rng.randrange(5) for _ in range(rng.randrange(30))]
+        # difflib 的匹配不一定最短，用它自己的操作码比较分组
+        matcher = difflib.SequenceMatcher(None, a, b, False)
+        expected = list(matcher.get_grouped_opcodes(n))
+        assert list(group_opcodes(matcher.get_opcodes(), n)) == expected
+
+
+def write_lines(path, lines, newline="\n", encoding="utf-8"):
+    path.write_bytes("".join(i + newline for i in lines).encode(encoding))
+    return str(path)
+
+
+@pytest.mark.parametrize("encoding", ["utf-8", "gb18030", "utf-16"])
+def test_unified_diff(tmp_path, encoding):
+    a = ["第一行", "two", "three", "four", "five", "six", "seven", "eight"]
+    b = ["第一行", "2", "three", "four", "five", "six", "seven", "eight", "九"]
+    f1 = LineFile(write_lines(tmp_path / "a.txt", a, "\r\n", encoding), encoding)
+    f2 = LineFile(write_lines(tmp_path / "b.txt", b, "\n", encoding), encoding)
+    try:
+        lines = list(unified_diff(f1, f2, 1))
+    finally:
+        f1.close()
+        f2.close()
+    expected = difflib.unified_diff(a, b, f1.path, f2.path, n=1, lineterm="")
+    assert lines == [i.rstrip() for i in expected]
+
+
+def test_unified_diff_ignores_surrounding_whitespace(tmp_path):
+    f1 = LineFile(write_lines(tmp_path / "a.txt", ["a", " b", "c"]), "utf-8")
+    f2 = LineFile(write_lines(tmp_path / "b.txt", ["a", "b\t", "c"]), "utf-8")
+    assert list(unified_diff(f1, f2)) == []
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 1 << 20])
+def test_split_lines(monkeypatch, chunk_size):
+    monkeypatch.setattr(line_compare, "CHUNK_SIZE", chunk_size)
+    rng = random.Random(chunk_size)
+    for _ in range(200):
+        data = bytes(rng.choice(b"ab\r\n") for _ in range(rng.randrange(20)))
+        text = io.TextIOWrapper(io.BytesIO(data), encoding="ascii", newline="")
+        assert [i.decode() for i in split_lines(io.BytesIO(data))] == list(text)
+
+
+@pytest.mark.parametrize("newline", ["\r", "\r\n"])
+@pytest.mark.parametrize("encoding", ["utf-8", "utf-16"])
+def test_newlines_do_not_matter(tmp_path, monkeypatch, newline, encoding):
+    monkeypatch.setattr(line_compare, "CHUNK_SIZE", 3)
+    lines = ["a", "第二行", "c"]
+    f1 = LineFile(write_lines(tmp_path / "a.txt", lines, newline, encoding), encoding)
+    f2 = LineFile(write_lines(tmp_path / "b.txt", lines, "\n", encoding), encoding)
+    assert len(f1) == 3
+    assert [f1.line(i) for i in range(3)] == lines
+    assert list(unified_diff(f1, f2)) == []
+    assert not files_differ(f1.path, encoding, f2.path, encoding)
+    f1.close()
+    f2.close()
@@ -0,0 +1,30 @@
+import pytest
+from click.testing import CliRunner
+from pypdf import PdfReader, PdfWriter
+
+from mypdf import cli
+
+
+@pytest.fixture
+def two_pages(tmp_path):
+    writer = PdfWriter()
+    for _ in range(2):
+        writer.add_blank_page(595, 842)
+    path = str(tmp_path / "in.pdf")
+    writer.write(path)
+    return path
+
+
+@pytest.mark.parametrize("grid", ["0x2", "2x0", "00x2", "2x00", "0x0", "x2", "2"])
+def test_nup_rejects_invalid_grid(tmp_path, two_pages, grid):
+    output = str(tmp_path / "out.pdf")
+    result = CliRunner().invoke(cli, ["nup", two_pages, "-o", output, "-g", grid])
+    assert result.exit_code == 2
+    assert "invalid grid" in result.output
+
+
+def test_nup(tmp_path, two_pages):
+    output = str(tmp_path / "out.pdf")
+    result = CliRunner().invoke(cli, ["nup", two_pages, "-o", output, "-g", "02X1"])
+    assert result.exit_code == 0, result.output
+    assert len(PdfReader(output).pages) == 1
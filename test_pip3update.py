@@ -0,0 +1,113 @@
+import importlib.metadata
+import json
+import os
+import subprocess
+import sys
+import zipfile
+from functools import partial
+
+import pytest
+
+from pip3update import installed_distributions
+
+
+def make_wheel(directory, name, version):
+    """生成一个只有元数据的最小 wheel"""
+    dist_info = f"{name}-{version}.dist-info"
+    path = directory / f"{name}-{version}-py3-none-any.whl"
+    files = {
+        f"{name}.py": "",
+        f"{dist_info}/METADATA": (
+            f"Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n"
+        ),
+        f"{dist_info}/WHEEL": (
+            "Wheel-Version: 1.0\nGenerator: test\n"
+            "Root-Is-Purelib: true\nTag: py3-none-any\n"
+        ),
+    }
+    records = [f"{p},," for p in files] + [f"{dist_info}/RECORD,,"]
+    files[f"{dist_info}/RECORD"] = "\n".join(records) + "\n"
+    with zipfile.ZipFile(path, "w") as zf:
+        for p, content in files.items():
+            zf.writestr(p, content)
+    return str(path)
+
+
+@pytest.fixture
+def site(tmp_path, monkeypatch):
+    """只包含测试中创建的包的环境"""
+    target = tmp_path / "site"
+    target.mkdir()
+    monkeypatch.setattr(
+        importlib.metadata,
+        "distributions",
+        partial(importlib.metadata.distributions, path=[str(target)]),
+    )
+    return target
+
+
+@pytest.fixture
+def venv(tmp_path):
+    """可以安装、升级包的虚拟环境，借用当前环境的 pip 和 click"""
+    subprocess.run(
+        [sys.executable, "-m", "venv", "--without-pip", "--system-site-packages"]
+        + [str(tmp_path / "venv")],
+        check=True,
+    )
+    bin_dir = "Scripts" if sys.platform == "win32" else "bin"
+    return str(tmp_path / "venv" / bin_dir / "python")
+
+
+def venv_install(python, path):
+    # 与 main 相同，从 wheel 文件安装
+    subprocess.run(
+        [sys.executable, "-m", "pip", "--python", python, "install", "--quiet"]
+        + ["--disable-pip-version-check", "--no-index", "--no-deps", path],
+        check=True,
+    )
+
+
+def venv_installed(python):
+    proc = subprocess.run(
+        [
+            python,
+            "-c",
+            "import json, pip3update;"
+            " print(json.dumps(pip3update.installed_distributions()))",
+        ],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    return json.loads(proc.stdout)
+
+
+def test_upgraded_packages_stay_upgradable(tmp_path, venv):
+    venv_install(venv, make_wheel(tmp_path, "demo_pkg", "1.0"))
+    assert venv_installed(venv)["demo-pkg"] == "1.0"
+
+    # 升级后 direct_url.json 中记录的是 archive_info，下次运行仍然要升级它
+    venv_install(venv, make_wheel(tmp_path, "demo_pkg", "2.0"))
+    assert venv_installed(venv)["demo-pkg"] == "2.0"
+
+
+@pytest.mark.parametrize(
+    "direct_url, skipped",
+    [
+        (None, False),
+        ({"url": "file:///w/a.whl", "archive_info": {}}, False),
+        ({"url": "file:///src/a", "dir_info": {"editable": True}}, True),
+        ({"url": "https://host/a.git", "vcs_info": {"vcs": "git"}}, True),
+        ("not json", False),
+    ],
+)
+def test_installed_from_source_is_skipped(site, direct_url, skipped):
+    dist_info = site / "pkg-1.0.dist-info"
+    dist_info.mkdir()
+    (dist_info / "METADATA").write_text(
+        "Metadata-Version: 2.1\nName: Pkg\nVersion: 1.0\n"
+    )
+    if direct_url is not None:
+        text = direct_url if isinstance(direct_url, str) else json.dumps(direct_url)
+        (dist_info / "direct_url.json").write_text(text)
+    assert installed_distributions() == ({} if skipped else {"pkg": "1.0"})
@@ -0,0 +1,128 @@
+import io
+import random
+
+import pytest
+
+import recode
+from recode import _rewrite_bytes, atomic_rewrite, examine, same_codec, scan_bytes
+from textinfo import ascii_compatible
+
+
+def random_bytes(rng, n, alphabet=b"ab\r\n"):
+    return bytes(rng.choice(alphabet) for _ in range(n))
+
+
+def text_newlines(data: bytes):
+    f = io.TextIOWrapper(io.BytesIO(data), encoding="latin-1", newline=None)
+    f.read()
+    return f.newlines
+
+
+@pytest.fixture(params=[1, 2, 3, 7])
+def small_chunks(request, monkeypatch):
+    # 块很小时几乎每个 CRLF 都会被切开
+    monkeypatch.setattr(recode, "CHUNK_SIZE", request.param)
+
+
+@pytest.mark.parametrize("newline", ["\n", "\r\n", "\r"])
+def test_rewrite_bytes_across_chunks(tmp_path, small_chunks, newline):
+    rng = random.Random(newline)
+    src, dst = tmp_path / "src", tmp_path / "dst"
+    target = newline.encode()
+    for _ in range(50):
+        data = random_bytes(rng, rng.randrange(20))
+        src.write_bytes(data)
+        _rewrite_bytes(str(src), str(dst), newline)
+        expected = data.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        assert dst.read_bytes() == expected.replace(b"\n", target)
+
+
+def test_scan_bytes_across_chunks(tmp_path, small_chunks):
+    rng = random.Random(0)
+    path = tmp_path / "f"
+    for _ in range(100):
+        data = random_bytes(rng, rng.randrange(20), b"ab\r\n\xe4")
+        path.write_bytes(data)
+        assert scan_bytes(str(path)) == (data.isascii(), text_newlines(data))
+
+
+def test_scan_bytes_crlf_split_at_chunk_end(tmp_path, monkeypatch):
+    monkeypatch.setattr(recode, "CHUNK_SIZE", 2)
+    path = tmp_path / "f"
+    path.write_bytes(b"a\r\nb\r\n")
+    assert scan_bytes(str(path)) == (True, "\r\n")
+    path.write_bytes(b"a\r")
+    assert scan_bytes(str(path)) == (True, "\r")
+
+
+@pytest.mark.parametrize(
+    "a, b, expected",
+    [
+        ("utf-8", "UTF8", True),
+        ("GB2312", "gb2312", True),
+        ("gb2312", "gb18030", False),
+        ("utf-8", "utf-8-sig", False),
+        ("x-unknown", "X-UNKNOWN", True),
+        ("x-unknown", "utf-8", False),
+    ],
+)
+def test_same_codec(a, b, expected):
+    assert same_codec(a, b) is expected
+
+
+@pytest.mark.parametrize(
+    "encoding, expected",
+    [
+        ("ascii", True),
+        ("utf-8", True),
+        ("gb18030", True),
+        ("big5", True),
+        ("euc-tw", False),
+        ("utf-8-sig", False),
+        ("utf-16", False),
+        ("hz", False),
+        ("iso-2022-cn", False),
+    ],
+)
+def test_ascii_compatible(encoding, expected):
+    assert ascii_compatible(encoding) is expected
+
+
+@pytest.fixture
+def no_decode(monkeypatch):
+    """确认走的是按字节扫描的路径"""
+
+    def fail(*args):
+        raise AssertionError("decoded the file")
+
+    monkeypatch.setattr(recode, "scan_newlines", fail)
+
+
+def test_examine_same_codec_skips_decoding(tmp_path, no_decode):
+    path = tmp_path / "f"
+    path.write_bytes("中文\r\n".encode("gb2312"))
+    assert examine(str(path), "GB2312", "gb2312") == (True, "\r\n")
+
+
+def test_examine_ascii_between_compatible_codecs(tmp_path, no_decode):
+    path = tmp_path / "f"
+    path.write_bytes(b"plain\nascii\n")
+    assert examine(str(path), "GB2312", "UTF-8") == (True, "\n")
+    path.write_bytes("中文\n".encode("gb2312"))
+    assert examine(str(path), "GB2312", "UTF-8") == (False, "\n")
+
+
+@pytest.mark.parametrize("encoding", ["UTF-8-SIG", "HZ-GB-2312", "UTF-16"])
+def test_examine_decodes_other_codecs(tmp_path, encoding):
+    path = tmp_path / "f"
+    path.write_bytes("ascii\r\n".encode(encoding))
+    assert examine(str(path), encoding, "UTF-8") == (False, "\r\n")
+
+
+def test_atomic_rewrite_utf16_across_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(recode, "CHUNK_SIZE", 3)
+    path = tmp_path / "f"
+    path.write_bytes("一\r\n二\r三\n".encode("utf-16"))
+    atomic_rewrite(str(path), "utf-16", "utf-8", "\r\n")
+    assert path.read_bytes() == "一\r\n二\r\n三\r\n".encode()
+    assert not (tmp_path / "f~~~~~").exists()
@@ -0,0 +1,141 @@
+import os
+
+import pytest
+
+from walk import is_ignored, natural_key, parse_ignore, walk
+
+
+@pytest.mark.parametrize(
+    "patterns, rel, is_dir, expected",
+    [
+        (["*.o"], "a.o", False, True),
+        (["*.o"], "src/deep/a.o", False, True),
+        (["*.o"], "a.c", False, False),
+        # 不含 / 的模式匹配任意层级，含 / 的相对于规则所在目录
+        (["build"], "src/build", True, True),
+        (["/build"], "src/build", True, False),
+        (["/build"], "build", True, True),
+        (["doc/*.txt"], "doc/a.txt", False, True),
+        (["doc/*.txt"], "doc/sub/a.txt", False, False),
+        # 只匹配目录
+        (["out/"], "out", False, False),
+        (["out/"], "out", True, True),
+        # ** 匹配任意层目录
+        (["**/foo"], "foo", False, True),
+        (["**/foo"], "a/b/foo", False, True),
+        (["a/**/b"], "a/b", False, True),
+        (["a/**/b"], "a/x/y/b", False, True),
+        (["a/**"], "a/x/y", False, True),
+        (["a/**"], "b/a/x", False, False),
+        # 后出现的规则优先
+        (["*.log", "!keep.log"], "keep.log", False, False),
+        (["!keep.log", "*.log"], "keep.log", False, True),
+        # 字符类、? 和转义
+        (["[ab].txt"], "b.txt", False, True),
+        (["[!ab].txt"], "a.txt", False, False),
+        (["[!ab].txt"], "c.txt", False, True),
+        (["?.c"], "x.c", False, True),
+        (["?.c"], "xy.c", False, False),
+        (["\\#x"], "#x", False, True),
+        (["\\!x"], "!x", False, True),
+        (["a\\ "], "a ", False, True),
+        # 注释和空行
+        (["# a", "", "   "], "# a", False, False),
+    ],
+)
+def test_is_ignored(patterns, rel, is_dir, expected):
+    assert is_ignored(parse_ignore(patterns), rel, is_dir) is expected
+
+
+def test_rules_relative_to_base():
+    rules = parse_ignore(["/gen", "*.tmp"], "pkg")
+    assert is_ignored(rules, "pkg/gen", True)
+    assert not is_ignored(rules, "gen", True)
+    assert not is_ignored(rules, "pkg/sub/gen", True)
+    assert is_ignored(rules, "pkg/sub/x.tmp", False)
+
+
+def test_natural_key():
+    names = ["img10.png", "img2.png", "IMG1.png", "img2a.png", "a", "10", "9"]
+    assert sorted(names, key=natural_key) == [
+        "9",
+        "10",
+        "a",
+        "IMG1.png",
+        "img2.png",
+        "img2a.png",
+        "img10.png",
+    ]
+
+
+def make_tree(root, files):
+    for rel, content in files.items():
+        path = root.joinpath(*rel.split("/"))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+
+
+def walked(root, **kwargs):
+    return [
+        os.path.relpath(e.path, root).replace(os.sep, "/") for e in walk(root, **kwargs)
+    ]
+
+
+@pytest.fixture
+def tree(tmp_path):
+    make_tree(
+        tmp_path,
+        {
+            ".gitignore": "*.log\nbuild/\n",
+            ".git/config": "",
+            "a.txt": "",
+            "a.log": "",
+            "build/out.txt": "",
+            "src/.gitignore": "!keep.log\n/gen\n",
+            "src/keep.log": "",
+            "src/x.log": "",
+            "src/gen/g.txt": "",
+            "src/lib/gen/g.txt": "",
+            "src/lib/m.txt": "",
+            "vendor/v.txt": "",
+        },
+    )
+    return str(tmp_path)
+
+
+def test_walk_ignore_is_opt_in(tree):
+    assert len(walked(tree)) == 12
+
+
+def test_walk_ignore(tree):
+    assert sorted(walked(tree, ignore=True)) == [
+        ".gitignore",
+        "a.txt",
+        "src/.gitignore",
+        "src/keep.log",
+        "src/lib/gen/g.txt",
+        "src/lib/m.txt",
+        "vendor/v.txt",
+    ]
+
+
+def test_walk_prune(tree):
+    files = walked(tree, prune=lambda path: os.path.basename(path) == "lib")
+    assert "src/lib/m.txt" not in files
+    assert "src/gen/g.txt" in files
+
+
+@pytest.mark.parametrize("ignore", [False, True])
+def test_walk_order_matches_os_walk(tree, ignore):
+    expected = []
+    for dir_path, _, files in os.walk(tree):
+        expected += [os.path.join(dir_path, name) for name in files]
+    if ignore:
+        # 被忽略的文件去掉后其余文件的顺序不变
+        kept = set(os.path.join(tree, *p.split("/")) for p in walked(tree, ignore=True))
+        expected = [p for p in expected if p in kept]
+
+    paths = [e.path for e in walk(tree, ignore=ignore)]
+    assert paths == expected
+    for jobs in (2, 4):
+        assert [e.path for e in walk(tree, ignore=ignore, jobs=jobs)] == paths
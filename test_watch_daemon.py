@@ -0,0 +1,194 @@
+import errno
+import os
+import shutil
+import sys
+import threading
+import time
+
+import pytest
+
+import watch_daemon
+from watch_daemon import IN_Q_OVERFLOW, Watcher, text_view
+
+pytestmark = pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="inotify is only available on Linux"
+)
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("MYCMD_CACHE_DIR", str(tmp_path / "cache"))
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+@pytest.fixture
+def root(tmp_path):
+    root = str(tmp_path / "root")
+    write(os.path.join(root, "a.py"), "print('alpha')\n")
+    write(os.path.join(root, "sub", "b.txt"), "bravo\n")
+    return root
+
+
+def start(root, ignore=False):
+    watcher = Watcher(root, ignore)
+    watcher.dirty = watcher._scan(watcher.root, [])
+    watcher.flush()
+    return watcher
+
+
+def files(watcher):
+    watcher.handle_events()
+    watcher.flush()
+    return sorted(os.path.relpath(p, watcher.root) for p in watcher.files)
+
+
+def search(watcher, needle):
+    watcher.handle_events()
+    watcher.flush()
+    found = watcher._candidates(needle, watcher.root + os.sep)
+    return sorted(os.path.relpath(p, watcher.root) for p in found)
+
+
+def test_file_events(root):
+    w = start(root)
+    assert files(w) == ["a.py", os.path.join("sub", "b.txt")]
+    assert search(w, "alpha") == ["a.py"]
+
+    write(os.path.join(root, "c.txt"), "charlie\n")
+    assert search(w, "charlie") == ["c.txt"]
+
+    write(os.path.join(root, "a.py"), "print('delta')\n")
+    assert search(w, "alpha") == []
+    assert search(w, "delta") == ["a.py"]
+
+    os.remove(os.path.join(root, "c.txt"))
+    assert "c.txt" not in files(w)
+    assert search(w, "charlie") == []
+
+    os.rename(os.path.join(root, "a.py"), os.path.join(root, "e.py"))
+    assert search(w, "delta") == ["e.py"]
+
+
+def test_directory_events(root, tmp_path):
+    w = start(root)
+    write(os.path.join(root, "new", "deep", "f.txt"), "foxtrot\n")
+    assert search(w, "foxtrot") == [os.path.join("new", "deep", "f.txt")]
+    # 新目录也被监视
+    write(os.path.join(root, "new", "deep", "g.txt"), "golf\n")
+    assert search(w, "golf") == [os.path.join("new", "deep", "g.txt")]
+
+    shutil.move(os.path.join(root, "new"), str(tmp_path / "outside"))
+    assert files(w) == ["a.py", os.path.join("sub", "b.txt")]
+    shutil.move(str(tmp_path / "outside"), os.path.join(root, "back"))
+    assert search(w, "golf") == [os.path.join("back", "deep", "g.txt")]
+
+    shutil.rmtree(os.path.join(root, "sub"))
+    assert search(w, "bravo") == []
+    assert os.path.join(root, "sub") not in w.wds
+
+
+def test_ignore_file_changes(root):
+    write(os.path.join(root, ".git", "HEAD"), "ref\n")
+    w = start(root, ignore=True)
+    assert files(w) == ["a.py", os.path.join("sub", "b.txt")]
+
+    write(os.path.join(root, ".gitignore"), "*.txt\n")
+    assert files(w) == [".gitignore", "a.py"]
+    write(os.path.join(root, "sub", "c.txt"), "charlie\n")
+    assert search(w, "charlie") == []
+
+    os.remove(os.path.join(root, ".gitignore"))
+    assert files(w) == [
+        "a.py",
+        os.path.join("sub", "b.txt"),
+        os.path.join("sub", "c.txt"),
+    ]
+
+
+def test_queue_overflow_rescans(root, monkeypatch):
+    w = start(root)
+    # 模拟溢出：事件丢失，只收到 IN_Q_OVERFLOW
+    monkeypatch.setattr(w.inotify, "read", lambda: iter([(-1, IN_Q_OVERFLOW, "")]))
+    write(os.path.join(root, "sub", "lost.txt"), "lima\n")
+    os.remove(os.path.join(root, "a.py"))
+    assert search(w, "lima") == [os.path.join("sub", "lost.txt")]
+    assert "a.py" not in files(w)
+
+
+def test_watch_limit_degrades(root, monkeypatch):
+    w = start(root)
+    add_watch = w.inotify.add_watch
+
+    def full(path, mask):
+        raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC), path)
+
+    monkeypatch.setattr(w.inotify, "add_watch", full)
+    write(os.path.join(root, "limit", "h.txt"), "hotel\n")
+    w.handle_events()
+    assert w.unwatched == {os.path.join(root, "limit")}
+    assert "error" in w.answer({"op": "files", "root": root})
+    sub = w.answer({"op": "files", "root": os.path.join(root, "sub")})
+    assert sub == {"files": [os.path.join(root, "sub", "b.txt")]}
+
+    monkeypatch.setattr(w.inotify, "add_watch", add_watch)
+    w.rescan(w.root)
+    assert w.unwatched == set()
+    assert search(w, "hotel") == [os.path.join("limit", "h.txt")]
+
+
+def test_postings_compaction(root, monkeypatch):
+    monkeypatch.setattr(watch_daemon, "_COMPACT_MIN", 0)
+    w = start(root)
+    # 两个文件中的一个修改两次后，失效的编号与有效的一样多，应当整理
+    for i in range(2):
+        write(os.path.join(root, "a.py"), f"round{i}\n")
+        assert search(w, f"round{i}") == ["a.py"]
+    assert w.dead == 0
+    live = set(w.paths)
+    assert all(set(ids) <= live for ids in w.postings.values())
+    assert search(w, "round0") == []
+
+
+def test_new_view_is_filled_in_batches(root):
+    w = start(root)
+    view = text_view(None, False)
+    w.start_view(view)
+    write(os.path.join(root, "c.txt"), "charlie\n")
+    files(w)
+    while view in w.filling:
+        w.fill()
+    values = w.views[view]
+    assert sorted(values) == sorted(w.files)
+    assert values[os.path.join(root, "c.txt")][:1] == ["ASCII"]
+
+
+def test_serve(root):
+    w = start(root)
+    path = watch_daemon.socket_path(root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    thread = threading.Thread(target=w.serve, args=(path,))
+    thread.start()
+    try:
+        for _ in range(100):
+            if os.path.exists(path):
+                break
+            time.sleep(0.01)
+        assert watch_daemon.query(root, "search", needle="bravo") == [
+            os.path.join(root, "sub", "b.txt")
+        ]
+        records = watch_daemon.query(root, "text", candidates=None, whole=False)
+        assert [p for p, _ in records] == [
+            os.path.join(root, "a.py"),
+            os.path.join(root, "sub", "b.txt"),
+        ]
+        # 与监视进程的设置不同时让调用方自己遍历
+        assert watch_daemon.query(root, "files", ignore=True) is None
+    finally:
+        watch_daemon._request(path, {"op": "stop"})
+        thread.join(5)
+    assert not thread.is_alive()
@@ -0,0 +1,278 @@
+"""文本文件的编码与换行符识别，结果缓存在 filecache 中
+
+recode、find_content、line_compare、count_code_lines 共用这里的识别逻辑，
+未改动过的文件再次扫描时不会重新运行 chardet。
+
+识别分层进行，前一层能确定时不再进入后一层：
+
+1. BOM
+2. 纯 ASCII（bytes.isascii）
+3. 合法 UTF-8（C 实现的增量解码器）
+4. chardet，只在候选编码中比较
+"""
+
+import codecs
+import io
+import mmap
+import os
+import re
+import sqlite3
+import threading
+import warnings
+import zlib
+from collections import Counter
+from functools import lru_cache
+from typing import Iterable, NamedTuple, Optional, Union
+
+import chardet
+
+from filecache import open_cache
+
+# 识别编码和换行符时读取的文件头长度
+SNIFF_SIZE = 4096
+
+# 识别逻辑变化时递增，使旧的缓存记录失效
+_CACHE_KIND = "textinfo-3"
+
+# 各识别层的命中次数（当前进程）
+stats = Counter()
+
+# 长的 BOM 必须排在前面：UTF-32-LE 的 BOM 以 UTF-16-LE 的 BOM 开头
+_BOMS = (
+    (codecs.BOM_UTF32_LE, "UTF-32"),
+    (codecs.BOM_UTF32_BE, "UTF-32"),
+    (codecs.BOM_UTF8, "UTF-8-SIG"),
+    (codecs.BOM_UTF16_LE, "UTF-16"),
+    (codecs.BOM_UTF16_BE, "UTF-16"),
+)
+
+_LONE_CR = re.compile(rb"\r(?!\n)")
+_LONE_LF = re.compile(rb"(?<!\r)\n")
+
+# 每个线程复用一块读缓冲区，扫描大量小文件时不必反复分配
+_local = threading.local()
+
+Newlines = Union[str, tuple, None]
+
+
+class TextInfo(NamedTuple):
+    encoding: Optional[str]
+    confidence: float
+    # 与 TextIOWrapper.newlines 的含义相同；无法按 encoding 解码时为 False
+    newlines: Union[Newlines, bool]
+    # 给出结果的识别层：bom、ascii、utf-8、chardet 或 cache
+    stage: str = ""
+
+
+def _buffer() -> bytearray:
+    buf = getattr(_local, "buffer", None)
+    if buf is None:
+        buf = _local.buffer = bytearray(SNIFF_SIZE)
+    return buf
+
+
+@lru_cache(maxsize=None)
+def newline_transparent(encoding: str) -> bool:
+    """encoding 中的 CR、LF 是否就是单字节 0x0D、0x0A，且不会出现在多字节字符里"""
+    name = codecs.lookup(encoding).name
+    if name.startswith(("utf-16", "utf-32")):
+        return False
+    return "\r\n".encode(encoding) == b"\r\n"
+
+
+_ASCII = "".join(map(chr, range(128)))
+
+
+@lru_cache(maxsize=None)
+def ascii_compatible(encoding: str) -> bool:
+    """纯 ASCII 文本按 encoding 编码后是否与原字节完全相同（没有 BOM 或转义）"""
+    try:
+        return _ASCII.encode(encoding) == _ASCII.encode("ascii")
+    except (UnicodeError, LookupError):
+        return False
+
+
+def scan_newlines(data, complete: bool = True) -> Newlines:
+    """在字节串（bytes、bytearray 或 mmap）中查找换行符
+
+    只适用于 newline_transparent 的编码，返回值与 TextIOWrapper.newlines 一致。
+    data 不完整时忽略末尾的 CR，它可能是被截断的 CRLF。
+    """
+    end = len(data)
+    if not complete and data[-1:] == b"\r":
+        end -= 1
+    found = []
+    if _LONE_CR.search(data, 0, end):
+        found.append("\r")
+    if _LONE_LF.search(data, 0, end):
+        found.append("\n")
+    if data.find(b"\r\n", 0, end) != -1:
+        found.append("\r\n")
+    if not found:
+        return None
+    return found[0] if len(found) == 1 else tuple(found)
+
+
+def _decode_newlines(data, complete: bool, encoding: str) -> Newlines:
+    """按 encoding 解码 data，返回其中的换行符；解码失败时抛出异常"""
+    text = codecs.getincrementaldecoder(encoding)().decode(data, complete)
+    decoder = io.IncrementalNewlineDecoder(None, False)
+    decoder.decode(text, complete)
+    return decoder.newlines
+
+
+@lru_cache(maxsize=None)
+def _chardet_includes(candidates: tuple[str, ...]) -> Optional[tuple[str, ...]]:
+    """candidates 中 chardet 认识的编码；chardet 不支持限定候选时返回 None"""
+    known = []
+    for name in candidates:
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                chardet.detect(b"", include_encodings=[name])
+        except TypeError:
+            return None
+        except ValueError:
+            continue
+        known.append(name)
+    return tuple(known)
+
+
+def _chardet(s: bytes, candidates: Optional[tuple[str, ...]]) -> tuple:
+    if candidates:
+        includes = _chardet_includes(candidates)
+        if includes:
+            with warnings.catch_warnings():
+                # 没有候选匹配时 chardet 会警告并返回 None
+                warnings.simplefilter("ignore")
+                ans = chardet.detect(s, include_encodings=includes)
+            return ans["encoding"], ans["confidence"]
+
+        # 旧版 chardet 或候选都不被认识：在全部结果里挑第一个候选编码
+        for ans in chardet.detect_all(s):
+            if ans["encoding"] and ans["encoding"].upper() in candidates:
+                return ans["encoding"], ans["confidence"]
+        return None, 0.0
+
+    ans = chardet.detect(s)
+    return ans["encoding"], ans["confidence"]
+
+
+def detect_bytes(
+    s: bytes, complete: bool, candidates: Optional[tuple[str, ...]] = None
+) -> tuple[Optional[str], float, str]:
+    """识别字节串 s 的编码，返回 (编码, 置信度, 识别层)
+
+    complete 表示 s 是否为完整文件；不完整时允许末尾有被截断的 UTF-8 字符。
+    """
+    for bom, encoding in _BOMS:
+        if s.startswith(bom):
+            return encoding, 1.0, "bom"
+
+    if s.isascii():
+        return "ASCII", 1.0, "ascii"
+
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(s, complete)
+    except UnicodeDecodeError:
+        pass
+    else:
+        return "UTF-8", 1.0, "utf-8"
+
+    encoding, confidence = _chardet(s, candidates)
+    if encoding is None:
+        return None, 0.0, "chardet"
+    return encoding.upper(), confidence, "chardet"
+
+
+def sniff(
+    path: str, candidates: Optional[Iterable[str]] = None, whole: bool = False
+) -> TextInfo:
+    """不使用缓存，直接识别 path 的编码和换行符
+
+    文件头只读取一次，编码和换行符都在同一块缓冲区上识别。candidates 限定
+    chardet 只在这些编码中比较，不影响 BOM/ASCII/UTF-8 的判定。whole 为真时
+    通过 mmap 在整个文件中查找换行符，而不只是文件头（UTF-16/32 仍只看文件头）。
+    """
+    if candidates is not None:
+        candidates = tuple(i.upper() for i in candidates)
+
+    buf = _buffer()
+    with open(path, "rb", buffering=0) as f:
+        n = f.readinto(buf)
+        complete = n < SNIFF_SIZE
+        data = buf[:n] if complete else buf
+
+        encoding, confidence, stage = detect_bytes(data, complete, candidates)
+        stats[stage] += 1
+        if encoding is None:
+            return TextInfo(None, confidence, False, stage)
+
+        try:
+            if stage == "chardet" or not newline_transparent(encoding):
+                # chardet 的结论不一定可靠，顺便验证能否按它解码
+                newlines = _decode_newlines(data, complete, encoding)
+            else:
+                newlines = scan_newlines(data, complete)
+        except (UnicodeDecodeError, LookupError):
+            return TextInfo(encoding, confidence, False, stage)
+
+        if whole and not complete and newline_transparent(encoding):
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                newlines = scan_newlines(mm)
+
+    return TextInfo(encoding, confidence, newlines, stage)
+
+
+def _dump(info: TextInfo) -> list:
+    newlines = info.newlines
+    if isinstance(newlines, str):
+        newlines = [newlines]
+    elif isinstance(newlines, tuple):
+        newlines = list(newlines)
+    return [info.encoding, info.confidence, newlines]
+
+
+def _load(value: list) -> TextInfo:
+    encoding, confidence, newlines = value
+    if isinstance(newlines, list):
+        newlines = newlines[0] if len(newlines) == 1 else tuple(newlines)
+    return TextInfo(encoding, confidence, newlines, "cache")
+
+
+def _cache_kind(candidates: Optional[Iterable[str]], whole: bool) -> str:
+    # 识别结果依赖候选编码和扫描范围，分开缓存
+    kind = _CACHE_KIND + ("-whole" if whole else "")
+    if candidates is None:
+        return kind
+    names = ",".join(sorted(i.upper() for i in candidates))
+    return f"{kind}:{zlib.crc32(names.encode()):08x}"
+
+
+def detect(
+    path: str,
+    use_cache: bool = True,
+    candidates: Optional[Iterable[str]] = None,
+    whole: bool = False,
+) -> TextInfo:
+    """识别 path 的编码和换行符，文件未变化时直接返回缓存的结果"""
+    cache = open_cache(_cache_kind(candidates, whole)) if use_cache else None
+    if cache is None:
+        return sniff(path, candidates, whole)
+
+    # 先取 stat 再识别，识别期间文件被改动时记录会在下次自然失效
+    st = os.stat(path)
+    try:
+        value = cache.get(path, st)
+    except sqlite3.Error:
+        value = None
+    if value is not None:
+        stats["cache"] += 1
+        return _load(value)
+
+    info = sniff(path, candidates, whole)
+    try:
+        cache.put(path, _dump(info), st)
+    except sqlite3.Error:
+        pass
+    return info
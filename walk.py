@@ -0,0 +1,205 @@
+"""基于 os.scandir 的目录遍历，供 recode、find_content、count_code_lines 共用
+
+与 os.walk 后再逐个过滤文件不同，这里在进入目录之前就判断是否剪枝，
+被排除的目录（node_modules、venv、build 等）不会被列出。同时支持
+.gitignore/.ignore 规则，并直接产出 os.DirEntry，调用方可以复用其中
+缓存的 stat 结果。
+"""
+
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, NamedTuple, Optional
+
+IGNORE_FILES = (".gitignore", ".ignore")
+
+# 启用忽略规则时总是跳过的目录
+ALWAYS_IGNORED = frozenset({".git", ".hg", ".svn"})
+
+
+class Rule(NamedTuple):
+    regex: re.Pattern
+    negate: bool
+    dir_only: bool
+    # 规则所在目录相对于遍历起点的路径，使用 / 分隔，起点本身为 ""
+    base: str
+
+
+def _translate(pattern: str) -> str:
+    """把 gitignore 的通配符模式转换为正则表达式"""
+    i, n = 0, len(pattern)
+    out = []
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            if pattern.startswith("**", i):
+                at_start = i == 0 or pattern[i - 1] == "/"
+                if at_start and pattern.startswith("**/", i):
+                    out.append("(?:.*/)?")
+                    i += 3
+                    continue
+                if at_start and i + 2 == n:
+                    out.append(".*")
+                    i += 2
+                    continue
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            j = pattern.find("]", i + 2)
+            if j == -1:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1 : j]
+                if body[0] == "!":
+                    body = "^" + body[1:]
+                out.append("[" + body.replace("\\", "\\\\") + "]")
+                i = j
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+def parse_ignore(lines, base: str = "") -> list[Rule]:
+    """解析 .gitignore 格式的规则"""
+    rules = []
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if not line.endswith("\\ "):
+            line = line.rstrip(" ")
+        if not line or line.startswith("#"):
+            continue
+
+        negate = line.startswith("!")
+        if negate:
+            line = line[1:]
+        elif line.startswith("\\"):
+            line = line[1:]
+
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        if not line:
+            continue
+
+        # 含有 / 的模式相对于规则所在目录，否则匹配任意层级的名字
+        if "/" in line:
+            regex = _translate(line.lstrip("/"))
+        else:
+            regex = "(?:.*/)?" + _translate(line)
+        rules.append(Rule(re.compile(regex, re.S), negate, dir_only, base))
+    return rules
+
+
+def is_ignored(rules: list[Rule], rel: str, is_dir: bool) -> bool:
+    """按规则判断相对路径 rel 是否被忽略，后出现的规则优先"""
+    ignored = False
+    for rule in rules:
+        if rule.dir_only and not is_dir:
+            continue
+        sub = rel[len(rule.base) + 1 :] if rule.base else rel
+        if rule.regex.fullmatch(sub):
+            ignored = not rule.negate
+    return ignored
+
+
+def _load_rules(path: str, base: str, names: set[str]) -> list[Rule]:
+    rules = []
+    for name in IGNORE_FILES:
+        if name not in names:
+            continue
+        try:
+            with open(
+                os.path.join(path, name), encoding="utf-8", errors="replace"
+            ) as f:
+                rules += parse_ignore(f, base)
+        except OSError:
+            pass
+    return rules
+
+
+def dir_rules(path: str, rel: str, inherited: list[Rule]) -> list[Rule]:
+    """目录 path 中各项适用的规则：上级目录的规则加上该目录自己的忽略文件"""
+    return inherited + _load_rules(path, rel, set(IGNORE_FILES))
+
+
+def is_excluded(rules: list[Rule], rel: str, name: str, is_dir: bool) -> bool:
+    """启用忽略规则时是否跳过 rel：版本库目录，或被规则忽略"""
+    if is_dir and name in ALWAYS_IGNORED:
+        return True
+    return bool(rules) and is_ignored(rules, rel, is_dir)
+
+
+def _scan(
+    path: str,
+    rel: str,
+    rules: list[Rule],
+    ignore: bool,
+    prune: Optional[Callable[[str], bool]],
+) -> tuple[list[os.DirEntry], list[tuple]]:
+    """列出一个目录，返回 (文件, [(子目录路径, 相对路径, 规则)])"""
+    try:
+        with os.scandir(path) as it:
+            entries = list(it)
+    except OSError:
+        return [], []
+
+    if ignore:
+        rules = rules + _load_rules(path, rel, {e.name for e in entries})
+
+    files, dirs = [], []
+    for entry in entries:
+        entry_rel = f"{rel}/{entry.name}" if rel else entry.name
+        try:
+            is_dir = entry.is_dir(follow_symlinks=False)
+        except OSError:
+            continue
+
+        if ignore and is_excluded(rules, entry_rel, entry.name, is_dir):
+            continue
+
+        if is_dir:
+            if prune is None or not prune(entry.path):
+                dirs.append((entry.path, entry_rel, rules))
+        elif entry.is_file():
+            files.append(entry)
+    return files, dirs
+
+
+def natural_key(name: str) -> list:
+    """按自然顺序排序文件名的键，使 2.png 排在 10.png 之前"""
+    return [int(s) if s.isdigit() else s.lower() for s in re.split(r"(\d+)", name)]
+
+
+def walk(
+    root: str,
+    prune: Optional[Callable[[str], bool]] = None,
+    ignore: bool = False,
+    jobs: int = 1,
+) -> Iterator[os.DirEntry]:
+    """递归产出 root 下所有文件的 DirEntry
+
+    prune(dir_path) 返回真时不进入该目录。ignore 为真时遵循各级目录中的
+    .gitignore/.ignore，并跳过 .git 等版本库目录。与 os.walk 相同，不进入
+    指向目录的符号链接。产出顺序与 os.walk 相同（先序深度优先），与 jobs 无关；
+    jobs > 1 时用线程池提前列出已经发现的子目录。
+    """
+    if jobs <= 1:
+        stack = [(root, "", [])]
+        while stack:
+            files, dirs = _scan(*stack.pop(), ignore, prune)
+            yield from files
+            stack.extend(reversed(dirs))
+        return
+
+    # 栈中是已提交的列目录任务，只有产出父目录时才提交子目录，
+    # 因此提前列出的只是当前的边界
+    with ThreadPoolExecutor(jobs) as pool:
+        stack = [pool.submit(_scan, root, "", [], ignore, prune)]
+        while stack:
+            files, dirs = stack.pop().result()
+            yield from files
+            stack.extend(pool.submit(_scan, *i, ignore, prune) for i in reversed(dirs))
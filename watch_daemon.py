@@ -0,0 +1,747 @@
+"""常驻的目录监视进程，让 recode、find_content、count_code_lines 不必每次遍历
+
+    $ python watch_daemon.py start ~/src --detach
+    $ python count_code_lines.py ~/src/project   # 自动向守护进程查询
+    $ python watch_daemon.py stop ~/src
+
+守护进程通过 inotify（用 ctypes 调用，仅限 Linux）监视 ROOT 下所有未被忽略
+的目录，为每个文件维护若干视图：编码和换行符（按候选编码分别维护）、代码
+行数，以及查找用的三元组索引。文件变化后只重新计算这一个文件。
+
+各脚本通过本地 Unix socket 查询（见 query），ROOT 及其上级目录都没有守护
+进程时返回 None，调用方退回到直接遍历。
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import json
+import os
+import selectors
+import signal
+import socket
+import stat
+import struct
+import sys
+import time
+import zlib
+from array import array
+from functools import partial
+from operator import itemgetter
+from typing import Any, Callable, Iterable, Iterator, NamedTuple, Optional
+
+import click
+
+import textinfo
+import walk
+from filecache import cache_dir
+from parallel import batched, imap_bounded, resolve_jobs
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONTFOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+_DIR_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+    | IN_DONTFOLLOW
+    | IN_EXCL_UNLINK
+)
+
+# 没有新事件多久之后重新计算变化的文件（秒）
+_SETTLE = 0.2
+# 事件持续不断时，最多推迟这么久也要重新计算
+_MAX_DELAY = 2.0
+# 变化的文件超过这个数时才使用工作进程
+_PARALLEL_MIN = 256
+# 客户端等待应答的时间（秒），新视图首次计算整个目录树时可能较慢
+_TIMEOUT = 300
+# 失效的文件编号超过这个数、且多于有效的编号时整理倒排表
+_COMPACT_MIN = 1024
+
+# 视图：("text", 候选编码, 是否扫描整个文件)、("lines",)、("grams",)
+_LINES = ("lines",)
+_GRAMS = ("grams",)
+
+
+def text_view(candidates: Optional[Iterable[str]], whole: bool) -> tuple:
+    if candidates is not None:
+        candidates = tuple(sorted({i.upper() for i in candidates}))
+    return ("text", candidates, bool(whole))
+
+
+def compute(view: tuple, path: str, size: int) -> Any:
+    """计算单个文件在某个视图中的值，必须可以 JSON 序列化（grams 除外）"""
+    # 这两个脚本也会导入本模块，放在函数内导入以避免循环
+    import count_code_lines
+    import find_content
+
+    if view[0] == "text":
+        info = textinfo.detect(path, True, view[1], view[2])
+        newlines = info.newlines
+        if isinstance(newlines, tuple):
+            newlines = list(newlines)
+        return [info.encoding, info.confidence, newlines, info.stage]
+    if view == _LINES:
+        # excludes 与调用方给出的路径形式有关，由调用方判断
+        index = count_code_lines.language_index(path)
+        if index is None:
+            return None
+        lines = count_code_lines.count_file(path, count_code_lines.languages[index])
+        return None if lines is None else [index, *lines]
+    if view == _GRAMS:
+        return find_content.index_file(path, size)
+    raise ValueError(f"unknown view {view!r}")
+
+
+def _compute_batch(views: tuple, paths: list[str]) -> list[tuple]:
+    """返回 [(path, (size, mtime, ino), [各视图的值])]，文件已不存在时后两项为 None"""
+    results = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            if not stat.S_ISREG(st.st_mode):
+                raise FileNotFoundError(path)
+            values = [compute(view, path, st.st_size) for view in views]
+        except OSError:
+            results.append((path, None, None))
+            continue
+        results.append((path, (st.st_size, st.st_mtime_ns, st.st_ino), values))
+    return results
+
+
+class Inotify:
+    """inotify 系统调用的最小封装"""
+
+    _EVENT = struct.Struct("iIII")
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = (ctypes.c_int, ctypes.c_int)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+
+    def add_watch(self, path: str, mask: int) -> int:
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e), path)
+        return wd
+
+    def rm_watch(self, wd: int):
+        # 目录已被删除时内核已经移除了监视，忽略错误
+        self._rm_watch(self.fd, wd)
+
+    def read(self) -> Iterator[tuple[int, int, str]]:
+        """读出所有已到达的事件，产出 (wd, mask, name)"""
+        while True:
+            try:
+                buf = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                return
+            pos = 0
+            while pos < len(buf):
+                wd, mask, _, length = self._EVENT.unpack_from(buf, pos)
+                pos += self._EVENT.size
+                name = os.fsdecode(buf[pos : pos + length].rstrip(b"\0"))
+                pos += length
+                yield wd, mask, name
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Dir(NamedTuple):
+    path: str
+    # 相对于 ROOT 的路径，使用 / 分隔，ROOT 本身为 ""
+    rel: str
+    # 目录中各项适用的忽略规则
+    rules: list
+
+
+class Watcher:
+    """监视 root 下的文件，维护各文件在各视图中的值"""
+
+    def __init__(self, root: str, ignore: bool = False, jobs: int = 1):
+        self.root = os.path.abspath(root)
+        self.ignore = ignore
+        self.jobs = jobs
+        self.inotify = Inotify()
+        self.dirs: dict[int, Dir] = {}
+        self.wds: dict[str, int] = {}
+        # path -> (size, mtime, ino)
+        self.files: dict[str, tuple] = {}
+        # 视图 -> {path: 值}；编码视图在第一次被查询时加入。grams 视图只保存
+        # indexed，三元组记在倒排表中
+        self.views: dict[tuple, dict[str, Any]] = {_LINES: {}, _GRAMS: {}}
+        # 三元组 -> 含有它的文件的编号（递增）。文件变化后换一个新编号，旧编号
+        # 留在表中、查询时滤掉，失效的编号多了再整理
+        self.postings: dict[str, array] = {}
+        self.ids: dict[str, int] = {}
+        self.paths: dict[int, str] = {}
+        self.next_id = 0
+        self.dead = 0
+        # 过大而没有建立索引的文件总是候选
+        self.unindexed: set[str] = set()
+        self.dirty: set[str] = set()
+        self.dirty_since: Optional[float] = None
+        # 正在计算的新视图 -> 产出计算结果的迭代器，以及等待这些视图的连接
+        self.filling: dict[tuple, Iterator] = {}
+        self.waiting: list[tuple[socket.socket, dict]] = []
+        # 因为 inotify 监视数达到上限而没有监视的目录，查询它们时让调用方
+        # 自己遍历
+        self.unwatched: set[str] = set()
+        self.stopping = False
+
+    def _rel(self, path: str) -> str:
+        rel = os.path.relpath(path, self.root)
+        return "" if rel == "." else rel.replace(os.sep, "/")
+
+    def _excluded(self, parent: Dir, name: str, is_dir: bool) -> bool:
+        if not self.ignore:
+            return False
+        rel = f"{parent.rel}/{name}" if parent.rel else name
+        return walk.is_excluded(parent.rules, rel, name, is_dir)
+
+    def _scan(self, path: str, inherited: list) -> set[str]:
+        """监视 path 及其下所有未被忽略的目录，返回其中的文件"""
+        found = set()
+        stack = [(path, inherited)]
+        while stack:
+            path, inherited = stack.pop()
+            # 先加监视再列目录，两者之间新建的文件不会遗漏
+            try:
+                wd = self.inotify.add_watch(path, _DIR_MASK)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    self.unwatched.add(path)
+                continue
+            rel = self._rel(path)
+            rules = walk.dir_rules(path, rel, inherited) if self.ignore else []
+            d = self.dirs[wd] = Dir(path, rel, rules)
+            self.wds[path] = wd
+
+            try:
+                with os.scandir(path) as it:
+                    entries = list(it)
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    if self._excluded(d, entry.name, is_dir):
+                        continue
+                    if is_dir:
+                        stack.append((entry.path, rules))
+                    elif entry.is_file():
+                        found.add(entry.path)
+                except OSError:
+                    continue
+        return found
+
+    def _unwatch(self, path: str):
+        """停止监视 path 及其下所有目录"""
+        prefix = path + os.sep
+        for dir_path, wd in list(self.wds.items()):
+            if dir_path == path or dir_path.startswith(prefix):
+                del self.wds[dir_path]
+                del self.dirs[wd]
+                self.inotify.rm_watch(wd)
+        self.unwatched = {
+            p for p in self.unwatched if p != path and not p.startswith(prefix)
+        }
+
+    def _under(self, path: str) -> list[str]:
+        prefix = path + os.sep
+        return [p for p in self.files if p.startswith(prefix)]
+
+    def rescan(self, path: str):
+        """重新扫描目录 path，用于忽略规则变化和事件队列溢出"""
+        if path == self.root:
+            inherited = []
+        else:
+            inherited = self.dirs[self.wds[os.path.dirname(path)]].rules
+        prefix = path + os.sep
+        old = set(self._under(path))
+        self._unwatch(path)
+        found = self._scan(path, inherited)
+        for p in old - found:
+            self._remove(p)
+        # 之前标记的文件可能已被忽略
+        self.dirty = {p for p in self.dirty if not p.startswith(prefix)} | found
+
+    def _remove(self, path: str):
+        self.files.pop(path, None)
+        for values in self.views.values():
+            values.pop(path, None)
+        self._unpost(path)
+
+    def _post(self, path: str, grams: tuple):
+        file_id = self.ids[path] = self.next_id
+        self.paths[file_id] = path
+        self.next_id += 1
+        for gram in grams:
+            ids = self.postings.get(gram)
+            if ids is None:
+                ids = self.postings[gram] = array("I")
+            ids.append(file_id)
+
+    def _unpost(self, path: str):
+        file_id = self.ids.pop(path, None)
+        if file_id is not None:
+            del self.paths[file_id]
+            self.unindexed.discard(path)
+            self.dead += 1
+
+    def _compact(self):
+        """失效的编号多于有效的编号时，把它们从倒排表中去掉"""
+        if self.dead < max(_COMPACT_MIN, len(self.paths)):
+            return
+        live = self.paths
+        for gram, ids in list(self.postings.items()):
+            kept = array("I", (i for i in ids if i in live))
+            if kept:
+                self.postings[gram] = kept
+            else:
+                del self.postings[gram]
+        self.dead = 0
+
+    def _store(self, path: str, st: tuple, views: tuple, values: list):
+        self.files[path] = st
+        for view, value in zip(views, values):
+            if view == _GRAMS:
+                indexed, grams = value
+                self._unpost(path)
+                self._post(path, grams)
+                if indexed == 0:
+                    self.unindexed.add(path)
+                value = indexed
+            self.views[view][path] = value
+
+    def _changed(self, path: str) -> bool:
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+        if st is None or not stat.S_ISREG(st.st_mode):
+            self._remove(path)
+            return False
+        return self.files.get(path) != (st.st_size, st.st_mtime_ns, st.st_ino)
+
+    def _compute(self, views: tuple, paths: list[str]) -> Iterator[list]:
+        jobs = self.jobs if len(paths) >= _PARALLEL_MIN else 1
+        results = imap_bounded(partial(_compute_batch, views), batched(paths, 64), jobs)
+        return map(itemgetter(1), results)
+
+    def flush(self):
+        """重新计算变化了的文件"""
+        paths = [p for p in self.dirty if self._changed(p)]
+        self.dirty.clear()
+        self.dirty_since = None
+        if not paths:
+            return
+
+        views = tuple(self.views)
+        for results in self._compute(views, paths):
+            for path, st, values in results:
+                if st is None:
+                    self._remove(path)
+                else:
+                    self._store(path, st, views, values)
+        self._compact()
+
+    def start_view(self, view: tuple):
+        """开始为所有文件计算新视图，由 fill 分批完成"""
+        self.views[view] = {}
+        self.filling[view] = self._compute((view,), list(self.files))
+
+    def fill(self):
+        """取回正在计算的新视图的一批结果，算完后应答等待它的连接
+
+        每次只处理一批，期间照常读取事件、应答其他查询，避免事件队列溢出。
+        """
+        view, results = next(iter(self.filling.items()))
+        values = self.views[view]
+        try:
+            batch = next(results)
+        except StopIteration:
+            del self.filling[view]
+            waiting, self.waiting = self.waiting, []
+            for conn, request in waiting:
+                self._dispatch(conn, request)
+            return
+        for path, st, (value,) in (r for r in batch if r[1] is not None):
+            # 开始计算后变化的文件由 flush 负责：已经删除的不再加入，flush
+            # 已经算过的保留 flush 的值
+            if path in self.files:
+                values.setdefault(path, value)
+
+    def handle_events(self):
+        for wd, mask, name in self.inotify.read():
+            if mask & IN_Q_OVERFLOW:
+                self.rescan(self.root)
+                continue
+            d = self.dirs.get(wd)
+            if d is None:
+                continue
+            if mask & IN_IGNORED:
+                del self.dirs[wd]
+                if self.wds.get(d.path) == wd:
+                    del self.wds[d.path]
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                # 子目录由上级目录的事件处理，ROOT 本身没有了就退出
+                if d.path == self.root:
+                    self.stopping = True
+                continue
+
+            path = os.path.join(d.path, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    if not self._excluded(d, name, True):
+                        self.dirty |= self._scan(path, d.rules)
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self._unwatch(path)
+                    for p in self._under(path):
+                        self._remove(p)
+            elif self.ignore and name in walk.IGNORE_FILES:
+                self.rescan(d.path)
+            elif not self._excluded(d, name, False):
+                self.dirty.add(path)
+
+        if self.dirty and self.dirty_since is None:
+            self.dirty_since = time.monotonic()
+
+    def _watched(self, request: dict) -> Optional[str]:
+        """请求中的 root 完整地处于监视之下时返回它的绝对路径"""
+        root = os.path.abspath(request["root"])
+        if request.get("ignore", False) != self.ignore or root not in self.wds:
+            return None
+        prefix = root + os.sep
+        if any(p == root or p.startswith(prefix) for p in self.unwatched):
+            return None
+        return root
+
+    def answer(self, request: dict) -> dict:
+        op = request.get("op")
+        if op == "status":
+            return {
+                "root": self.root,
+                "ignore": self.ignore,
+                "files": len(self.files),
+                "dirs": len(self.dirs),
+                "unwatched": sorted(self.unwatched),
+                "views": [
+                    list(view) for view in self.views if view not in self.filling
+                ],
+            }
+        if op == "stop":
+            self.stopping = True
+            return {}
+
+        # 先处理已经到达的事件，保证应答与磁盘上的内容一致
+        self.handle_events()
+        self.flush()
+
+        root = self._watched(request)
+        if root is None:
+            return {"error": f"{request['root']} is not watched"}
+        prefix = root + os.sep
+
+        if op == "files":
+            return {"files": sorted(p for p in self.files if p.startswith(prefix))}
+        if op == "text":
+            values = self.views[text_view(request["candidates"], request["whole"])]
+            return {"files": _items_under(values, prefix)}
+        if op == "lines":
+            return {"files": _items_under(self.views[_LINES], prefix)}
+        if op == "search":
+            return {"files": sorted(self._candidates(request["needle"], prefix))}
+        return {"error": f"unknown op {op!r}"}
+
+    def _candidates(self, needle: str, prefix: str) -> Iterator[str]:
+        """可能包含 needle 的文件，与 find_content.query_index 相同"""
+        from find_content import trigrams
+
+        grams = trigrams(needle)
+        if grams:
+            lists = sorted((self.postings.get(g, ()) for g in grams), key=len)
+            ids = set(lists[0]).intersection(*lists[1:])
+            found = {self.paths[i] for i in ids if i in self.paths}
+            found |= self.unindexed
+        else:
+            values = self.views[_GRAMS]
+            found = (p for p, indexed in values.items() if indexed >= 0)
+        return (p for p in found if p.startswith(prefix))
+
+    def _accept(self, conn: socket.socket):
+        """读取请求；需要的视图还没算好时让连接等待，不阻塞其他查询"""
+        conn.settimeout(5)
+        try:
+            with conn.makefile("rb") as f:
+                request = json.loads(f.readline())
+            view = None
+            if request.get("op") == "text" and self._watched(request):
+                view = text_view(request["candidates"], request["whole"])
+        except OSError:
+            conn.close()
+            return
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self._send(conn, {"error": f"bad request: {e}"})
+            return
+        if view is not None and view not in self.views:
+            self.start_view(view)
+        if view in self.filling:
+            self.waiting.append((conn, request))
+        else:
+            self._dispatch(conn, request)
+
+    def _dispatch(self, conn: socket.socket, request: dict):
+        try:
+            response = self.answer(request)
+        except (ValueError, KeyError, TypeError) as e:
+            response = {"error": f"bad request: {e}"}
+        self._send(conn, response)
+
+    def _send(self, conn: socket.socket, response: dict):
+        with conn:
+            try:
+                conn.sendall(json.dumps(response, ensure_ascii=False).encode() + b"\n")
+            except OSError:
+                pass
+
+    def serve(self, path: str):
+        """在 Unix socket path 上应答查询，直到收到 stop 或 ROOT 被删除"""
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        server.bind(path)
+        server.listen(16)
+
+        sel = selectors.DefaultSelector()
+        sel.register(server, selectors.EVENT_READ)
+        sel.register(self.inotify.fd, selectors.EVENT_READ)
+        try:
+            while not self.stopping:
+                # 计算新视图期间不等待，每轮取回一批结果
+                filling = bool(self.filling)
+                ready = sel.select(0 if filling else _SETTLE if self.dirty else None)
+                for key, _ in ready:
+                    if key.fileobj is server:
+                        try:
+                            self._accept(server.accept()[0])
+                        except OSError:
+                            pass
+                    else:
+                        self.handle_events()
+                overdue = (
+                    self.dirty_since is not None
+                    and time.monotonic() - self.dirty_since > _MAX_DELAY
+                )
+                if self.dirty and ((not ready and not filling) or overdue):
+                    self.flush()
+                if self.filling:
+                    self.fill()
+        finally:
+            for conn, _ in self.waiting:
+                conn.close()
+            sel.close()
+            server.close()
+            os.unlink(path)
+            self.inotify.close()
+
+
+def _items_under(values: dict[str, Any], prefix: str) -> list:
+    items = [[p, v] for p, v in values.items() if p.startswith(prefix)]
+    items.sort(key=itemgetter(0))
+    return items
+
+
+def socket_path(root: str) -> str:
+    """监视 root 的守护进程使用的 socket，位于 filecache 的缓存目录中"""
+    root = os.path.normcase(os.path.abspath(root))
+    return os.path.join(cache_dir(), f"watch-{zlib.crc32(root.encode()):08x}.sock")
+
+
+def _request(path: str, request: dict) -> Optional[dict]:
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(path):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(_TIMEOUT)
+            sock.connect(path)
+            with sock.makefile("rwb") as f:
+                f.write(json.dumps(request).encode() + b"\n")
+                f.flush()
+                line = f.readline()
+        return json.loads(line) if line else None
+    except (OSError, ValueError):
+        return None
+
+
+def query(root: str, op: str, ignore: bool = False, **params) -> Optional[list]:
+    """向监视 root（或其上级目录）的守护进程查询，没有可用的守护进程时返回 None
+
+    op 为 files、search（params：needle）时返回文件路径列表；为 text
+    （params：candidates、whole）、lines 时返回 [(path, 值)]。路径与从 root
+    开始遍历时的形式相同。
+    """
+    root_abs = os.path.abspath(root)
+    request = {"op": op, "root": root_abs, "ignore": ignore, **params}
+    d = root_abs
+    while True:
+        response = _request(socket_path(d), request)
+        if response is not None and "files" in response:
+            break
+        parent = os.path.dirname(d)
+        if parent == d:
+            return None
+        d = parent
+
+    # 换回以 root 开头的路径，与直接遍历时 DirEntry.path 的形式一致
+    start = len(root_abs) + 1
+    if op in ("files", "search"):
+        return [os.path.join(root, p[start:]) for p in response["files"]]
+    return [(os.path.join(root, p[start:]), v) for p, v in response["files"]]
+
+
+def unpruned(
+    root: str, items: Iterable, prune: Optional[Callable[[str], bool]]
+) -> Iterator:
+    """去掉位于被 prune 剪掉的目录中的条目，items 为 path 或 (path, 值)"""
+    if prune is None:
+        yield from items
+        return
+    memo = {}
+    prefix = os.path.join(root, "")
+
+    def pruned(dir_path: str) -> bool:
+        if len(dir_path) < len(prefix):
+            return False
+        result = memo.get(dir_path)
+        if result is None:
+            result = memo[dir_path] = bool(
+                pruned(os.path.dirname(dir_path)) or prune(dir_path)
+            )
+        return result
+
+    for item in items:
+        path = item if isinstance(item, str) else item[0]
+        if not pruned(os.path.dirname(path)):
+            yield item
+
+
+@click.group()
+def cli():
+    """监视目录树，为 recode、find_content、count_code_lines 保存最新的扫描结果"""
+
+
+@cli.command()
+@click.argument("root", default=".", type=click.Path(exists=True, file_okay=False))
+@click.option(
+    "-j",
+    "--jobs",
+    help="Number of worker processes for the initial scan, 0 for all CPUs. "
+    "Default: 0.",
+    type=click.IntRange(min=0),
+    default=0,
+)
+@click.option(
+    "--ignore",
+    help="Honor .gitignore/.ignore files and skip .git, like the --ignore "
+    "option of the other scripts.",
+    is_flag=True,
+)
+@click.option(
+    "-d",
+    "--detach",
+    help="Run in the background.",
+    is_flag=True,
+)
+def start(root: str, jobs: int, ignore: bool, detach: bool):
+    """监视 ROOT（默认为当前目录）并应答各脚本的查询
+
+    初次扫描完成后才开始应答，在此之前各脚本照常直接遍历。
+    """
+    if not sys.platform.startswith("linux"):
+        raise click.ClickException("inotify is only available on Linux")
+    path = socket_path(root)
+    if _request(path, {"op": "status"}) is not None:
+        raise click.ClickException(f"{root} is already watched")
+    os.makedirs(cache_dir(), exist_ok=True)
+
+    if detach:
+        pid = os.fork()
+        if pid:
+            click.echo(f"watching {root} in process {pid}")
+            return
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in range(3):
+            os.dup2(devnull, fd)
+
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    watcher = Watcher(root, ignore, resolve_jobs(jobs))
+    watcher.dirty = watcher._scan(watcher.root, [])
+    if watcher.unwatched:
+        raise click.ClickException(
+            "inotify watch limit reached, raise fs.inotify.max_user_watches"
+        )
+    watcher.flush()
+    if not detach:
+        click.echo(f"watching {len(watcher.files)} files under {watcher.root}")
+    try:
+        watcher.serve(path)
+    except KeyboardInterrupt:
+        pass
+
+
+@cli.command()
+@click.argument("root", default=".", type=click.Path(exists=True, file_okay=False))
+def status(root: str):
+    """显示监视 ROOT 的守护进程的状态"""
+    response = _request(socket_path(root), {"op": "status"})
+    if response is None:
+        click.echo(f"{root} is not watched", err=True)
+        sys.exit(1)
+    click.echo(json.dumps(response, ensure_ascii=False, indent=2))
+
+
+@cli.command()
+@click.argument("root", default=".", type=click.Path(exists=True, file_okay=False))
+def stop(root: str):
+    """停止监视 ROOT 的守护进程"""
+    if _request(socket_path(root), {"op": "stop"}) is None:
+        click.echo(f"{root} is not watched", err=True)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    cli()